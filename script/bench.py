@@ -0,0 +1,383 @@
+#!/usr/bin/env python3
+"""
+导出流程的分阶段基准测试。
+
+用真实的 book/ 书稿，不读写任何缓存，逐个阶段计时（每个阶段重复 N 次取中位数）：
+    common.index        解析 index.md、扫描章节（书籍模型）
+    common.read         读取全部章节文件
+    common.markdown     章节编号 + Markdown 转换
+    common.postprocess  BookTreeprocessor 后处理（图片路径、引言、图片说明、标题 ID）
+    pdf.images          生成 pdf-print 衍生图
+    pdf.html            逐章写出全书 HTML 文件
+    pdf.layout          WeasyPrint 排版
+    pdf.write           写出 PDF
+    epub.images         生成 epub 衍生图
+    epub.assemble       组装章节并流式写入 EPUB（含并行压缩）
+    epub.write          写出目录、content.opf 并完成 zip
+    docx.images / docx.assemble / docx.write
+
+结果写入 output/bench/latest.json。--save-baseline 把本次结果存为基线
+（output/bench/baseline.json）；之后每次运行都与基线比较，某个阶段比基线慢了
+超过 --threshold（且至少慢 MIN_DELTA 秒）即视为退化，退出码为 1。
+基线与机器相关，换机器后应重新保存。
+
+用法：
+    python script/bench.py --save-baseline
+    python script/bench.py
+    python script/bench.py --formats epub,docx --stages markdown,assemble,write -n 5
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import markdown
+
+from book_model import BOOK_DIR, ROOT_DIR, build_book, read_chapter
+from build import FORMATS, parse_formats
+from images import chapter_images, image_map, use_derivatives
+from render import get_markdown, render_content
+
+BENCH_DIR = os.path.join(ROOT_DIR, "output", "bench")
+BASELINE_FILE = os.path.join(BENCH_DIR, "baseline.json")
+LATEST_FILE = os.path.join(BENCH_DIR, "latest.json")
+
+# 结果文件格式变化时递增
+BENCH_VERSION = 1
+
+# 默认比基线慢 10% 视为退化
+DEFAULT_THRESHOLD = 0.10
+
+# 毫秒级的阶段波动很大，至少慢这么多（秒）才算退化
+MIN_DELTA = 0.005
+
+COMMON_STAGES = ("index", "read", "markdown", "postprocess")
+FORMAT_STAGES = {
+    "pdf": ("images", "html", "layout", "write"),
+    "epub": ("images", "assemble", "write"),
+    "docx": ("images", "assemble", "write"),
+}
+STAGE_NAMES = sorted(set(COMMON_STAGES).union(*FORMAT_STAGES.values()))
+
+
+def measure(func, repeat, setup=None):
+    """运行 func repeat 次，返回 (各次耗时, 最后一次的返回值)。setup 在每次计时前调用。"""
+    times = []
+    value = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.perf_counter()
+        value = func()
+        times.append(time.perf_counter() - start)
+    return times, value
+
+
+def render_timed(chapters, contents):
+    """渲染全部章节，返回 (渲染结果, 后处理耗时)。后处理耗时单独累计。"""
+    processor = get_markdown().treeprocessors["book"]
+    run = processor.run
+    elapsed = [0.0]
+
+    def timed_run(root):
+        start = time.perf_counter()
+        try:
+            return run(root)
+        finally:
+            elapsed[0] += time.perf_counter() - start
+
+    processor.run = timed_run
+    try:
+        rendered = {
+            ch["file"]: render_content(ch, contents[ch["file"]])
+            for ch in chapters
+            if ch["file"] in contents
+        }
+    finally:
+        del processor.run
+    return rendered, elapsed[0]
+
+
+def bench_common(repeat, stages, record):
+    """书籍模型和章节渲染，返回 (书籍模型, 渲染结果)。"""
+    times, book = measure(build_book, repeat)
+    record("common.index", times, "index" in stages)
+    chapters = [ch for ch in book["chapters"] if not ch["missing"]]
+
+    def read_all():
+        return {ch["file"]: read_chapter(ch["file"]) for ch in chapters}
+
+    times, contents = measure(read_all, repeat)
+    record("common.read", times, "read" in stages)
+
+    totals, post = [], []
+    rendered = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rendered, post_time = render_timed(chapters, contents)
+        totals.append(time.perf_counter() - start)
+        post.append(post_time)
+    record("common.markdown", [t - p for t, p in zip(totals, post)], "markdown" in stages)
+    record("common.postprocess", post, "postprocess" in stages)
+    return book, rendered
+
+
+def bench_images(fmt, profile, rendered, repeat, jobs, stages, record, work_dir):
+    """每轮在空目录中生成衍生图，返回 {原图路径: 衍生图路径}。"""
+    cache_dir = os.path.join(work_dir, f"img-{fmt}")
+    paths = chapter_images(rendered)
+
+    def clear():
+        shutil.rmtree(cache_dir, ignore_errors=True)
+
+    if "images" not in stages:
+        # 后续阶段仍需要衍生图，生成一次但不计入结果
+        repeat = 1
+    times, image_paths = measure(
+        lambda: image_map(paths, profile, jobs=jobs, cache_dir=cache_dir), repeat, clear,
+    )
+    record(f"{fmt}.images", times, "images" in stages)
+    return image_paths
+
+
+def bench_pdf(book, rendered, repeat, jobs, stages, record, work_dir):
+    from export_pdf import write_html
+
+    image_paths = bench_images("pdf", "pdf-print", rendered, repeat, jobs, stages, record, work_dir)
+    rendered = use_derivatives(rendered, image_paths)
+    html_path = os.path.join(work_dir, "bench.html")
+    times, _ = measure(
+        lambda: write_html(html_path, book["title"], book["chapters"], rendered), repeat,
+    )
+    record("pdf.html", times, "html" in stages)
+
+    if not ({"layout", "write"} & stages):
+        return
+    try:
+        from weasyprint import HTML
+    except Exception as e:
+        print(f"  跳过 pdf.layout、pdf.write：无法导入 WeasyPrint ({e})", file=sys.stderr)
+        return
+    times, document = measure(lambda: HTML(filename=html_path, base_url=BOOK_DIR).render(), repeat)
+    record("pdf.layout", times, "layout" in stages)
+    output = os.path.join(work_dir, "bench.pdf")
+    times, _ = measure(lambda: document.write_pdf(output), repeat)
+    record("pdf.write", times, "write" in stages)
+
+
+def bench_epub(book, rendered, repeat, jobs, stages, record, work_dir):
+    from epub_writer import EpubZipWriter, finish_epub
+    from export_epub import build_epub
+
+    image_paths = bench_images("epub", "epub", rendered, repeat, jobs, stages, record, work_dir)
+    # 章节在组装时就写入文件，两个阶段必须在同一个 EpubZipWriter 上依次进行
+    output = os.path.join(work_dir, "bench.epub")
+    assemble_times, write_times = [], []
+    for _ in range(repeat):
+        with EpubZipWriter(output, jobs=jobs) as out:
+            start = time.perf_counter()
+            epub_book = build_epub(book["title"], book["chapters"], rendered, image_paths, out)
+            assemble_times.append(time.perf_counter() - start)
+            start = time.perf_counter()
+            finish_epub(out, epub_book)
+            out.close()
+            write_times.append(time.perf_counter() - start)
+    record("epub.assemble", assemble_times, "assemble" in stages)
+    record("epub.write", write_times, "write" in stages)
+
+
+def bench_docx(book, rendered, repeat, jobs, stages, record, work_dir):
+    from export_docx import build_docx, save_docx
+
+    image_paths = bench_images("docx", "docx", rendered, repeat, jobs, stages, record, work_dir)
+    times, doc = measure(
+        lambda: build_docx(book["title"], book["chapters"], rendered, image_paths), repeat,
+    )
+    record("docx.assemble", times, "assemble" in stages)
+    output = os.path.join(work_dir, "bench.docx")
+    times, _ = measure(lambda: save_docx(doc, output, jobs=jobs), repeat)
+    record("docx.write", times, "write" in stages)
+
+
+BENCHMARKS = {"pdf": bench_pdf, "epub": bench_epub, "docx": bench_docx}
+
+
+def run_benchmarks(formats, stages, repeat=3, jobs=1):
+    """运行基准测试，返回 {阶段: {"median", "min", "runs"}}（秒）。"""
+    results = {}
+
+    def record(name, times, enabled):
+        if not enabled:
+            return
+        results[name] = {
+            "median": statistics.median(times),
+            "min": min(times),
+            "runs": times,
+        }
+        print(f"  {name:<20} {format_seconds(results[name]['median'])}")
+
+    book, rendered = bench_common(repeat, stages, record)
+    with tempfile.TemporaryDirectory(prefix="book-bench-") as work_dir:
+        for fmt in formats:
+            if stages & set(FORMAT_STAGES[fmt]):
+                BENCHMARKS[fmt](book, rendered, repeat, jobs, stages, record, work_dir)
+    return results
+
+
+def environment(book_bytes):
+    """记录在结果中的运行环境，用于判断基线是否可比。"""
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=ROOT_DIR, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, check=True,
+        ).stdout.decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        "machine": f"{platform.node()} {platform.machine()}",
+        "cpus": os.cpu_count(),
+        "python": platform.python_version(),
+        "markdown": markdown.__version__,
+        "commit": commit,
+        "book_bytes": book_bytes,
+    }
+
+
+def book_size():
+    return sum(
+        os.path.getsize(os.path.join(BOOK_DIR, name))
+        for name in os.listdir(BOOK_DIR)
+        if name.endswith(".md")
+    )
+
+
+def compare(results, baseline, threshold):
+    """与基线比较并打印对比表，返回退化的阶段列表。"""
+    regressions = []
+    print(f"\n{'阶段':<18} {'本次':>8} {'基线':>8} {'变化':>6}")
+    for name, result in results.items():
+        current = result["median"]
+        base = baseline.get(name, {}).get("median")
+        if base is None:
+            print(f"{name:<20} {format_seconds(current):>10} {'-':>10} {'':>8}")
+            continue
+        change = (current - base) / base if base else 0.0
+        flag = ""
+        if change > threshold and current - base > MIN_DELTA:
+            regressions.append(name)
+            flag = "  ← 退化"
+        print(
+            f"{name:<20} {format_seconds(current):>10} {format_seconds(base):>10} "
+            f"{change:>+8.0%}{flag}"
+        )
+    return regressions
+
+
+def format_seconds(seconds):
+    if seconds < 1:
+        return f"{seconds * 1000:.1f} ms"
+    return f"{seconds:.2f} s"
+
+
+def parse_stages(value):
+    """解析 --stages 参数，如 "markdown,layout"。"""
+    stages = set()
+    for stage in value.split(","):
+        stage = stage.strip()
+        if not stage:
+            continue
+        if stage not in STAGE_NAMES:
+            raise argparse.ArgumentTypeError(
+                f"不支持的阶段: {stage}（可选: {', '.join(STAGE_NAMES)}）"
+            )
+        stages.add(stage)
+    if not stages:
+        raise argparse.ArgumentTypeError("至少指定一个阶段")
+    return stages
+
+
+def save_results(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="导出流程的分阶段基准测试")
+    parser.add_argument(
+        "--formats",
+        type=parse_formats,
+        default=list(FORMATS),
+        help="要测试的格式，逗号分隔 (默认: pdf,epub,docx)",
+    )
+    parser.add_argument(
+        "--stages",
+        type=parse_stages,
+        default=set(STAGE_NAMES),
+        help=f"要计时的阶段，逗号分隔 (默认全部: {','.join(STAGE_NAMES)})",
+    )
+    parser.add_argument("-n", "--repeat", type=int, default=3, help="每个阶段重复次数 (默认: 3)")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=1,
+        help="生成衍生图的进程数 (默认: 1，便于不同机器间比较)",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=DEFAULT_THRESHOLD,
+        help=f"比基线慢多少视为退化 (默认: {DEFAULT_THRESHOLD})",
+    )
+    parser.add_argument("--baseline", default=BASELINE_FILE, help=f"基线文件 (默认: {BASELINE_FILE})")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果存为基线")
+    args = parser.parse_args()
+
+    print(f"基准测试（每个阶段 {args.repeat} 次，取中位数）...")
+    results = run_benchmarks(args.formats, args.stages, repeat=args.repeat, jobs=args.jobs)
+    data = {
+        "version": BENCH_VERSION,
+        "created": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "environment": environment(book_size()),
+        "repeat": args.repeat,
+        "stages": results,
+    }
+    save_results(LATEST_FILE, data)
+
+    if args.save_baseline:
+        save_results(args.baseline, data)
+        print(f"\n基线已保存: {args.baseline}")
+        return
+
+    try:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = json.load(f)
+    except (OSError, ValueError):
+        print(f"\n没有基线，用 --save-baseline 保存: {args.baseline}")
+        return
+    if baseline.get("version") != BENCH_VERSION:
+        print("\n基线格式已过期，请重新保存", file=sys.stderr)
+        return
+
+    base_env, env = baseline["environment"], data["environment"]
+    for key in ("machine", "cpus", "python", "book_bytes"):
+        if base_env.get(key) != env.get(key):
+            print(f"\n注意：基线的运行环境不同（{key}: {base_env.get(key)} → {env.get(key)}），结果仅供参考")
+            break
+
+    regressions = compare(results, baseline["stages"], args.threshold)
+    if regressions:
+        print(f"\n{len(regressions)} 个阶段退化超过 {args.threshold:.0%}: {', '.join(regressions)}")
+        sys.exit(1)
+    print("\n没有退化")
+
+
+if __name__ == "__main__":
+    main()
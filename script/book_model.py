@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+"""
+《夹缝生长》的书籍结构模型。
+
+三个导出脚本共用这里的目录解析、章节编号、引导问题提取和标题大纲
+（scan_chapter 一次扫描完成），保证 PDF、EPUB、DOCX 的编号永远一致。
+
+解析结果缓存在 output/.cache/book_model.json：
+    - 以 index.md 和各章节文件的 mtime/大小 作为快速校验；
+    - mtime 变了但内容哈希没变（如 git checkout、touch），缓存依然有效；
+    - 任一文件内容变化或 MODEL_VERSION 变化时重新解析。
+
+用法：
+    from book_model import load_book
+    book = load_book()
+    book["title"], book["chapters"], book["parts"]
+
+    python script/book_model.py   # 打印书籍结构
+"""
+
+import hashlib
+import json
+import os
+import re
+import sys
+
+# 项目根目录；环境变量 BOOK_ROOT 可指向另一份书稿（含 index.md 和 book/），
+# 如 synth_book.py 生成的测试书稿，输出和缓存也随之写到那里的 output/
+ROOT_DIR = os.path.abspath(
+    os.environ.get("BOOK_ROOT") or os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+)
+BOOK_DIR = os.path.join(ROOT_DIR, "book")
+INDEX_FILE = os.path.join(ROOT_DIR, "index.md")
+CACHE_DIR = os.path.join(ROOT_DIR, "output", ".cache")
+MODEL_CACHE_FILE = os.path.join(CACHE_DIR, "book_model.json")
+
+# 模型结构或解析规则变化时递增，使旧缓存失效
+MODEL_VERSION = 2
+
+# 不需要问题页的文件（前言、后记等直接以标题开头）
+SKIP_QUESTION_FILES = {"restart.md", "crack.md", "flomo.md", "wuma.md", "scys.md", "acknowledgments.md"}
+
+# 不参与编号的特殊文件
+SPECIAL_FILES = {"restart.md", "crack.md", "acknowledgments.md"}
+
+
+def parse_index(index_content=None):
+    """从 index.md 解析书籍结构，返回 (书名, 章节列表)。"""
+    if index_content is None:
+        with open(INDEX_FILE, "r", encoding="utf-8") as f:
+            index_content = f.read()
+
+    # 提取书名
+    title_match = re.search(r"^#\s+(.+)", index_content, re.MULTILINE)
+    book_title = title_match.group(1).strip() if title_match else "夹缝生长"
+
+    chapters = []
+    current_part = None
+    current_section = None
+
+    for line in index_content.split("\n"):
+        line = line.rstrip()
+
+        # 匹配部分标题：- 第一部分：xxx 或 - 前言：xxx 或 - 后记：xxx
+        part_match = re.match(r"^-\s+(第.+部分：.+|前言：|后记：|第.+部分：)", line)
+        if part_match:
+            part_text = part_match.group(1).rstrip("：").rstrip(":")
+            # 检查这一行本身是否包含链接
+            link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
+            if link_match:
+                # 前言/后记这种自带链接的行
+                label = link_match.group(1)
+                path = link_match.group(2)
+                current_part = part_text
+                current_section = None
+                chapters.append({
+                    "part": current_part,
+                    "section": None,
+                    "title": label,
+                    "file": path,
+                    "is_part_header": True,
+                })
+            else:
+                current_part = part_text
+                current_section = None
+            continue
+
+        # 匹配子分类标题（不含链接）
+        section_match = re.match(r"^\s*-\s+(.+?)$", line)
+        if section_match and "[" not in line:
+            current_section = section_match.group(1).strip()
+            continue
+
+        # 匹配章节链接：  - [标题](path)
+        link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
+        if link_match:
+            chapters.append({
+                "part": current_part,
+                "section": current_section,
+                "title": link_match.group(1),
+                "file": link_match.group(2),
+                "is_part_header": False,
+            })
+
+    return book_title, chapters
+
+
+def assign_chapter_numbers(chapters):
+    """为每个常规章节分配编号。前言、后记、致谢不编号。"""
+    num = 0
+    for ch in chapters:
+        basename = os.path.basename(ch["file"])
+        if basename in SPECIAL_FILES or ch.get("is_part_header"):
+            ch["chapter_num"] = None
+        elif ch["part"] and re.match(r"第.+部分", ch["part"]):
+            num += 1
+            ch["chapter_num"] = num
+        else:
+            ch["chapter_num"] = None
+
+
+def read_chapter(file_path):
+    """读取章节 markdown 内容。"""
+    full_path = os.path.join(ROOT_DIR, file_path)
+    if not os.path.exists(full_path):
+        print(f"  警告：文件不存在，跳过 {file_path}", file=sys.stderr)
+        return None
+    with open(full_path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+def scan_chapter(content, file_path, chapter_num):
+    """一次扫描章节内容，提取引导问题、添加标题编号并收集标题大纲。
+
+    大多数章节格式为：
+        问题文本
+
+        ---
+        # 标题
+        ...
+
+    第一个 "空行 + ---" 之前的内容为引导问题（SKIP_QUESTION_FILES 中的文件除外）。
+    正文中的 h1、h2、h3 按 "1."、"1.1"、"1.1.1" 编号（chapter_num 为 None 时不编号）。
+    围栏代码块（``` 或 ~~~）中的行原样保留，不参与编号和大纲。
+
+    返回 dict：
+        question  引导问题，没有则为 None
+        body      去掉问题后、已添加编号的正文
+        outline   [(级别, 标题)]，标题为原始标题（不含编号）
+    """
+    allow_question = os.path.basename(file_path) not in SKIP_QUESTION_FILES
+    lines = content.split("\n")
+    last = len(lines) - 1
+    question = None
+    body = []
+    outline = []
+    h2_counter = 0
+    h3_counter = 0
+    fence = None
+
+    for i, line in enumerate(lines):
+        if fence is not None:
+            if line.lstrip().startswith(fence):
+                fence = None
+            body.append(line)
+            continue
+
+        first = line[:1]
+        if first == "#":
+            if line.startswith("# ") and len(line) > 2:
+                outline.append((1, line[2:].strip()))
+                if chapter_num is not None:
+                    line = f"# {chapter_num}. {line[2:]}"
+            elif line.startswith("## "):
+                h2_counter += 1
+                h3_counter = 0
+                if len(line) > 3:
+                    outline.append((2, line[3:].strip()))
+                    if chapter_num is not None:
+                        line = f"## {chapter_num}.{h2_counter} {line[3:]}"
+            elif line.startswith("### "):
+                h3_counter += 1
+                if len(line) > 4:
+                    outline.append((3, line[4:].strip()))
+                    if chapter_num is not None:
+                        line = f"### {chapter_num}.{h2_counter}.{h3_counter} {line[4:]}"
+        elif first in ("`", "~") or first == " ":
+            stripped = line.lstrip()
+            if stripped.startswith(("```", "~~~")):
+                fence = stripped[:3]
+        elif (
+            line == "---"
+            and allow_question
+            and question is None
+            and 2 <= i < last
+            and lines[i - 1] == ""
+            and (i > 2 or lines[0] != "")
+        ):
+            # 问题与正文的分隔线：之前收集的内容都属于问题
+            question = "\n".join(lines[:i - 1]).strip()
+            body = []
+            outline = []
+            h2_counter = 0
+            h3_counter = 0
+            continue
+
+        body.append(line)
+
+    return {"question": question, "body": "\n".join(body), "outline": outline}
+
+
+def chapter_id_for(file_path):
+    """章节文件对应的锚点 ID（如 book/pivot.md -> pivot）。"""
+    return os.path.splitext(os.path.basename(file_path))[0]
+
+
+# ---------------------------------------------------------------------------
+# 书籍模型
+# ---------------------------------------------------------------------------
+
+def build_book():
+    """解析 index.md 和全部章节，构建书籍模型（不读缓存）。
+
+    返回 dict：
+        title:    书名
+        parts:    [{"title", "id", "sections": [{"title", "id"}]}]
+        chapters: 章节 dict 列表，除 parse_index 的字段外还包含
+            chapter_num    章节编号（前言、后记、致谢为 None）
+            chapter_id     锚点 ID
+            display_title  带编号的标题，如 "1. 分形思维"
+            missing        章节文件是否缺失
+            part_id        所属部分的 ID（part-N）
+            new_part       是否为该部分的第一章（导出时在它之前插入部分标题页）
+            section_id     所属子分类的 ID（section-K-N）
+            new_section    是否为该子分类的第一章
+            question       引导问题，没有则为 None
+            h2_headings    h2 标题（原始标题，不含编号）
+            outline        h1/h2/h3 大纲 [(级别, 标题)]
+        sources:  {相对路径: [mtime_ns, 大小, sha1]}，用于缓存校验
+    """
+    with open(INDEX_FILE, "rb") as f:
+        index_bytes = f.read()
+    book_title, chapters = parse_index(_decode(index_bytes))
+    assign_chapter_numbers(chapters)
+
+    sources = {"index.md": _source_stamp(INDEX_FILE, index_bytes)}
+    parts = []
+    part_counter = 0
+    section_id = None
+    seen_parts = set()
+    seen_sections = set()
+
+    for ch in chapters:
+        ch["chapter_id"] = chapter_id_for(ch["file"])
+        chapter_num = ch["chapter_num"]
+        ch["display_title"] = f"{chapter_num}. {ch['title']}" if chapter_num else ch["title"]
+        ch["part_id"] = None
+        ch["new_part"] = False
+        ch["section_id"] = None
+        ch["new_section"] = False
+        ch["question"] = None
+        ch["h2_headings"] = []
+        ch["outline"] = []
+
+        full_path = os.path.join(ROOT_DIR, ch["file"])
+        if not os.path.exists(full_path):
+            print(f"  警告：文件不存在，跳过 {ch['file']}", file=sys.stderr)
+            ch["missing"] = True
+            continue
+        ch["missing"] = False
+        with open(full_path, "rb") as f:
+            raw = f.read()
+        sources[ch["file"]] = _source_stamp(full_path, raw)
+
+        # 部分、子分类只在第一个存在的章节上开始
+        if ch["part"] and ch["part"] not in seen_parts:
+            seen_parts.add(ch["part"])
+            part_counter += 1
+            parts.append({"title": ch["part"], "id": f"part-{part_counter}", "sections": []})
+            ch["new_part"] = True
+            seen_sections.clear()
+        if ch["part"]:
+            ch["part_id"] = f"part-{part_counter}"
+
+        if ch["section"] and ch["section"] not in seen_sections:
+            seen_sections.add(ch["section"])
+            ch["new_section"] = True
+            section_id = f"section-{len(seen_sections)}-{part_counter}"
+            if parts:
+                parts[-1]["sections"].append({"title": ch["section"], "id": section_id})
+        if ch["section"]:
+            ch["section_id"] = section_id
+
+        scan = scan_chapter(_decode(raw), ch["file"], chapter_num)
+        ch["question"] = scan["question"]
+        ch["outline"] = scan["outline"]
+        ch["h2_headings"] = [title for level, title in scan["outline"] if level == 2]
+
+    return {
+        "version": MODEL_VERSION,
+        "title": book_title,
+        "parts": parts,
+        "chapters": chapters,
+        "sources": sources,
+    }
+
+
+def load_book(use_cache=True):
+    """加载书籍模型，优先使用磁盘缓存。"""
+    if use_cache:
+        book = _load_cached_book()
+        if book is not None:
+            return book
+
+    book = build_book()
+    if use_cache:
+        _save_cached_book(book)
+    return book
+
+
+def _decode(data):
+    """与文本模式 open() 一致：UTF-8 解码并统一换行符。"""
+    return data.decode("utf-8").replace("\r\n", "\n").replace("\r", "\n")
+
+
+def _source_stamp(path, data):
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size, hashlib.sha1(data).hexdigest()]
+
+
+def _load_cached_book():
+    """读取缓存；任一源文件内容变化则返回 None。"""
+    try:
+        with open(MODEL_CACHE_FILE, "r", encoding="utf-8") as f:
+            book = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if book.get("version") != MODEL_VERSION or book.get("root") != ROOT_DIR:
+        return None
+
+    refreshed = False
+    for rel_path, (mtime_ns, size, digest) in book["sources"].items():
+        full_path = os.path.join(ROOT_DIR, rel_path)
+        try:
+            st = os.stat(full_path)
+        except OSError:
+            return None
+        if st.st_mtime_ns == mtime_ns and st.st_size == size:
+            continue
+        # mtime 变化时比对内容哈希
+        with open(full_path, "rb") as f:
+            data = f.read()
+        if hashlib.sha1(data).hexdigest() != digest:
+            return None
+        book["sources"][rel_path] = _source_stamp(full_path, data)
+        refreshed = True
+
+    # 之前缺失的章节文件出现了
+    for ch in book["chapters"]:
+        if ch["missing"] and os.path.exists(os.path.join(ROOT_DIR, ch["file"])):
+            return None
+
+    for ch in book["chapters"]:
+        ch["outline"] = [tuple(item) for item in ch["outline"]]
+        if ch["missing"]:
+            print(f"  警告：文件不存在，跳过 {ch['file']}", file=sys.stderr)
+
+    if refreshed:
+        _save_cached_book(book)
+    return book
+
+
+def _save_cached_book(book):
+    book["root"] = ROOT_DIR
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    tmp_path = MODEL_CACHE_FILE + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(book, f, ensure_ascii=False)
+    os.replace(tmp_path, MODEL_CACHE_FILE)
+
+
+def main():
+    book = load_book()
+    print(f"书名: {book['title']}")
+    for ch in book["chapters"]:
+        if ch["new_part"]:
+            print(f"\n{ch['part']}")
+        if ch["new_section"]:
+            print(f"  {ch['section']}")
+        marker = "  (缺失)" if ch["missing"] else ""
+        print(f"    {ch['display_title']}  [{ch['file']}]{marker}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,277 @@
+#!/usr/bin/env python3
+"""
+一次性导出《夹缝生长》的多种格式。
+
+目录只解析一次、Markdown 只转换一次，然后在进程池中并行运行 PDF、EPUB、DOCX
+三个导出后端，完整构建的耗时约等于最慢的那个后端。
+
+构建完成后在输出目录写入构建清单 build-manifest.json（见 reproducible.py）；
+输入和选项都没有变化、产物也没有被改动时，再次构建直接复用上次的产物。
+
+用法：
+    python script/build.py
+    python script/build.py --formats pdf,epub
+    python script/build.py --formats epub,docx -o output/release
+    python script/build.py --force   # 忽略构建清单，总是重新构建
+"""
+
+import argparse
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import profiling
+from book_model import ROOT_DIR, load_book
+from epub_split import DEFAULT_MAX_DOCUMENT_KB, max_document_size, parse_document_kb
+from images import chapter_images, prepare_images
+from render import default_jobs, render_chapters
+from reproducible import (
+    MANIFEST_NAME,
+    fingerprint,
+    hash_inputs,
+    load_manifest,
+    save_manifest,
+    source_date_epoch,
+    up_to_date,
+)
+
+FORMATS = ("pdf", "epub", "docx")
+OUTPUT_BASENAME = "夹缝生长"
+DEFAULT_OUTPUT_DIR = os.path.join(ROOT_DIR, "output")
+
+
+def parse_formats(value):
+    """解析 --formats 参数，如 "pdf,epub"。"""
+    formats = []
+    for fmt in value.split(","):
+        fmt = fmt.strip().lower()
+        if not fmt:
+            continue
+        if fmt not in FORMATS:
+            raise argparse.ArgumentTypeError(f"不支持的格式: {fmt}（可选: {', '.join(FORMATS)}）")
+        if fmt not in formats:
+            formats.append(fmt)
+    if not formats:
+        raise argparse.ArgumentTypeError("至少指定一种格式")
+    return formats
+
+
+def image_profiles(formats, pdf_images):
+    """所选格式需要的图片衍生图 profile。"""
+    profiles = []
+    for fmt in formats:
+        if fmt == "pdf":
+            if pdf_images != "original":
+                profiles.append(f"pdf-{pdf_images}")
+        else:
+            profiles.append(fmt)
+    return profiles
+
+
+def run_backend(fmt, book_title, chapters, rendered, output, save_html=False,
+                fragments=False, use_cache=True, jobs=1, images="print", low_memory=False,
+                profile=None, preset=None, max_document_size=None):
+    """在独立进程中运行单个导出后端，返回耗时（秒）。
+
+    后端模块在这里才导入，缺少某个后端的依赖（如 WeasyPrint）只影响该格式。
+    profile 不为 None 时记录该后端的各阶段耗时（保存为 build-{格式}），值为
+    profiling.start() 的 cprofile、memory 参数。preset 为 PDF 的输出版本（见 export_pdf.PDF_PRESETS）。
+    max_document_size 为 EPUB 拆分章节后单个文档的大小上限（见 epub_split.py）。
+    """
+    start = time.perf_counter()
+    if profile is not None:
+        profiling.start(f"build-{fmt}", **profile)
+    if fmt == "pdf":
+        import export_pdf
+        options = export_pdf.PDF_PRESETS[preset]["options"] if preset else None
+        export_pdf.export(book_title, chapters, rendered, output, save_html=save_html,
+                          fragments=fragments, use_cache=use_cache, jobs=jobs,
+                          images=images, options=options)
+    elif fmt == "epub":
+        import export_epub
+        export_epub.export(book_title, chapters, rendered, output,
+                           use_cache=use_cache, jobs=jobs, low_memory=low_memory,
+                           max_document_size=max_document_size)
+    elif fmt == "docx":
+        import export_docx
+        export_docx.export(book_title, chapters, rendered, output,
+                           use_cache=use_cache, jobs=jobs, low_memory=low_memory)
+    # 并行的后端只保存结果，摘要由 build.json / build-{格式}.json 查看
+    profiling.finish(report=False)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser(description="一次性导出《夹缝生长》的多种格式")
+    parser.add_argument(
+        "--formats",
+        type=parse_formats,
+        default=list(FORMATS),
+        help="要导出的格式，逗号分隔 (默认: pdf,epub,docx)",
+    )
+    parser.add_argument(
+        "-o", "--output-dir",
+        default=DEFAULT_OUTPUT_DIR,
+        help=f"输出目录 (默认: {DEFAULT_OUTPUT_DIR})",
+    )
+    parser.add_argument(
+        "--html",
+        action="store_true",
+        help="导出 PDF 时同时保存中间 HTML 文件",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="并行的进程数：转换章节、生成图片时全部使用，导出时由各后端平分 (默认: CPU 核数)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略并不写入 output/.cache 中的解析、渲染和图片缓存",
+    )
+    parser.add_argument(
+        "--images",
+        choices=("print", "screen", "ebook", "original"),
+        default=None,
+        help="PDF 图片质量：print 300 dpi、screen 150 dpi、ebook 96 dpi、original 原图 "
+             "(默认: print，或 --preset 对应的图片)",
+    )
+    parser.add_argument(
+        "--preset",
+        choices=("screen", "ebook", "print"),
+        default=None,
+        help="PDF 输出版本，见 export_pdf.py --preset",
+    )
+    parser.add_argument(
+        "--fragments",
+        action="store_true",
+        help="PDF 按章节分片并行排版并缓存，只重排修改过的章节（需要 pypdf）",
+    )
+    parser.add_argument(
+        "--split-chapters",
+        action="store_true",
+        help="EPUB 的章节按 h2 小节拆成多个 XHTML 文档，见 export_epub.py --split-chapters",
+    )
+    parser.add_argument(
+        "--max-document-kb",
+        type=parse_document_kb,
+        default=None,
+        help=f"EPUB 拆分后单个文档的大小上限（KB），指定时自动启用 --split-chapters "
+             f"(默认: {DEFAULT_MAX_DOCUMENT_KB})",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="低内存模式：DOCX 的图片写入时才读取，EPUB 的压缩队列更短（PDF 的 HTML 总是逐章写入文件）",
+    )
+    parser.add_argument(
+        "--force",
+        action="store_true",
+        help="即使输入没有变化也重新构建（--no-cache 时同样如此）",
+    )
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    # 各 preset 使用同名的衍生图（见 export_pdf.PDF_PRESETS）
+    if args.images is None:
+        args.images = args.preset or "print"
+    epub_max_document_size = max_document_size(args.split_chapters, args.max_document_kb)
+    profiling.start_from_args("build", args)
+    backend_profile = None
+    if profiling.enabled():
+        backend_profile = {"cprofile": args.cprofile, "memory": args.memory}
+
+    build_start = time.perf_counter()
+
+    outputs = {
+        fmt: os.path.join(args.output_dir, f"{OUTPUT_BASENAME}.{fmt}")
+        for fmt in args.formats
+    }
+    # 影响产物的选项（--jobs、--low-memory 等只影响速度和内存）
+    options = {
+        "formats": args.formats,
+        "images": args.images,
+        "preset": args.preset,
+        "fragments": args.fragments,
+        "html": args.html,
+        "max_document_size": epub_max_document_size,
+        "source_date_epoch": source_date_epoch(),
+    }
+    manifest_path = os.path.join(args.output_dir, MANIFEST_NAME)
+    manifest = load_manifest(manifest_path)
+    with profiling.stage("fingerprint"):
+        inputs = hash_inputs(manifest["inputs"] if manifest else None)
+        build_fingerprint = fingerprint(inputs, options)
+    if not (args.force or args.no_cache) and up_to_date(manifest, build_fingerprint, manifest_path):
+        print(f"输入没有变化，复用上次的产物（构建指纹 {build_fingerprint[:16]}）:")
+        for fmt, output in outputs.items():
+            print(f"  {fmt.upper()}: {output}")
+        profiling.finish()
+        return
+    # 构建中途失败时不能留下指向旧产物的清单
+    if manifest is not None:
+        os.remove(manifest_path)
+
+    print("解析目录结构...")
+    with profiling.stage("index"):
+        book = load_book(use_cache=not args.no_cache)
+    book_title, chapters = book["title"], book["chapters"]
+    print(f"  书名: {book_title}")
+    print(f"  章节数: {len(chapters)}")
+
+    print("转换章节内容...")
+    with profiling.stage("render"):
+        rendered = render_chapters(chapters, use_cache=not args.no_cache, jobs=args.jobs)
+
+    # 各后端需要的衍生图在这里一次并行生成，后端中直接命中缓存
+    # （--no-cache 时衍生图只存在于各自进程的临时目录，由后端自己生成）
+    profiles = image_profiles(args.formats, args.images)
+    if profiles and not args.no_cache:
+        print("准备图片...")
+        with profiling.stage("images"):
+            prepare_images(chapter_images(rendered), profiles, jobs=args.jobs)
+
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    # 各后端本身并行运行，进程数由它们平分，总数不超过 --jobs
+    backend_jobs = max(1, args.jobs // len(args.formats))
+    print(f"并行导出: {', '.join(args.formats)}（每个后端 {backend_jobs} 个进程）")
+    failed = []
+    with ProcessPoolExecutor(max_workers=len(args.formats)) as pool:
+        futures = {
+            pool.submit(
+                run_backend, fmt, book_title, chapters, rendered, outputs[fmt],
+                save_html=args.html, fragments=args.fragments,
+                use_cache=not args.no_cache, jobs=backend_jobs, images=args.images,
+                low_memory=args.low_memory, profile=backend_profile, preset=args.preset,
+                max_document_size=epub_max_document_size,
+            ): fmt
+            for fmt in args.formats
+        }
+        for future in as_completed(futures):
+            fmt = futures[future]
+            try:
+                elapsed = future.result()
+            except Exception as e:
+                failed.append(fmt)
+                print(f"  {fmt.upper()} 失败: {e}", file=sys.stderr)
+            else:
+                size = os.path.getsize(outputs[fmt]) / 1e6
+                print(f"  {fmt.upper()} 完成 ({elapsed:.1f}s, {size:.1f} MB): {outputs[fmt]}")
+
+    if not failed:
+        artifacts = dict(outputs)
+        if args.html and "pdf" in outputs:
+            artifacts["pdf-html"] = outputs["pdf"].rsplit(".", 1)[0] + ".html"
+        save_manifest(manifest_path, build_fingerprint, inputs, options, artifacts)
+        print(f"构建清单: {manifest_path}")
+
+    print(f"总耗时: {time.perf_counter() - build_start:.1f}s")
+    profiling.finish()
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+"""
+把长章节拆成多个 XHTML 文档。
+
+不少阅读器（尤其是墨水屏设备）要一次解析、排版整个 XHTML 文档：文档越大，翻到这一章
+时等待越久，超过几百 KB 还可能直接打不开（Adobe RMSDK 的上限约为 300 KB）。拆分后：
+    - 每个 h2 小节从新文档开始，文档名与小节的锚点相同（{章节 ID}-h2-{序号}.xhtml）；
+      第一个 h2 之前的内容（章节标题、引言等）留在 {章节 ID}.xhtml，指向章节的链接不变；
+    - 拆完仍超过 max_size 字节的文档，再在顶层块元素（段落、列表、表格等）之间
+      拆开，续接的文档名加上 -2、-3……；标题不与其后的内容分开，单个块元素本身
+      超过上限时不再拆；
+    - 页内链接（href="#..."，如脚注）指向的 ID 落在别的文档时，改为指向那个文档。
+
+用法：
+    documents = split_chapter_html(chapter_id, html, max_size=256 * 1024)
+    anchors = anchor_files(documents)   # {元素 ID: 所在文档}
+"""
+
+import argparse
+import re
+from html.parser import HTMLParser
+
+# 默认的单个文档大小上限（KB），低于常见阅读器的 300 KB 限制
+DEFAULT_MAX_DOCUMENT_KB = 256
+
+# 没有结束标签的元素
+VOID_TAGS = {
+    "area", "base", "br", "col", "embed", "hr", "img", "input",
+    "link", "meta", "source", "track", "wbr",
+}
+
+ID_RE = re.compile(r'\bid="([^"]+)"')
+LOCAL_HREF_RE = re.compile(r'\bhref="#([^"]+)"')
+HEADING_RE = re.compile(r"\s*<h[1-6]\b")
+
+
+def max_document_size(split_chapters, max_document_kb):
+    """由 --split-chapters、--max-document-kb 选项得到单个文档的大小上限（字节）；
+    不拆分时为 None。"""
+    if not split_chapters and max_document_kb is None:
+        return None
+    if max_document_kb is None:
+        max_document_kb = DEFAULT_MAX_DOCUMENT_KB
+    return max_document_kb * 1024
+
+
+def parse_document_kb(value):
+    """解析 --max-document-kb 参数：正整数。"""
+    try:
+        kb = int(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"无效的大小: {value}") from None
+    if kb <= 0:
+        raise argparse.ArgumentTypeError(f"大小应为正整数: {value}")
+    return kb
+
+
+class _TopLevelBlocks(HTMLParser):
+    """找出 HTML 片段中各顶层元素的起始位置：blocks 为 [(字符偏移, 标签名)]。"""
+
+    def __init__(self, html):
+        super().__init__(convert_charrefs=False)
+        # getpos() 给出的是 (行号, 列号)，换算成字符偏移
+        self._line_starts = [0] + [m.end() for m in re.finditer("\n", html)]
+        self._depth = 0
+        self.blocks = []
+        self.feed(html)
+        self.close()
+
+    def _offset(self):
+        line, column = self.getpos()
+        return self._line_starts[line - 1] + column
+
+    def handle_starttag(self, tag, attrs):
+        if self._depth == 0:
+            self.blocks.append((self._offset(), tag))
+        if tag not in VOID_TAGS:
+            self._depth += 1
+
+    def handle_startendtag(self, tag, attrs):
+        if self._depth == 0:
+            self.blocks.append((self._offset(), tag))
+
+    def handle_endtag(self, tag):
+        if tag not in VOID_TAGS:
+            self._depth = max(0, self._depth - 1)
+
+
+def split_chapter_html(chapter_id, html, max_size=None):
+    """把章节正文 HTML 拆成 [(文档名, HTML 片段)]，文档名含 .xhtml 后缀。
+
+    在每个顶层 h2 前拆开；max_size（字节）不为 None 时，超过上限的文档再在顶层块元素
+    之间拆开。各片段中指向其他片段的页内链接已改写。
+    """
+    blocks = _TopLevelBlocks(html).blocks
+
+    # 按 h2 分成小节：[(文档名, 起始偏移)]
+    sections = [(chapter_id, 0)]
+    h2_count = 0
+    for offset, tag in blocks:
+        if tag != "h2":
+            continue
+        h2_count += 1
+        if html[:offset].strip():
+            sections.append((f"{chapter_id}-h2-{h2_count}", offset))
+    bounds = [start for _, start in sections[1:]] + [len(html)]
+
+    documents = []
+    for (name, start), end in zip(sections, bounds):
+        section = html[start:end]
+        if max_size is None or len(section.encode("utf-8")) <= max_size:
+            documents.append((f"{name}.xhtml", section))
+            continue
+        inner = [(offset - start, tag) for offset, tag in blocks if start < offset < end]
+        for k, piece in enumerate(_split_by_size(section, inner, max_size), 1):
+            suffix = "" if k == 1 else f"-{k}"
+            documents.append((f"{name}{suffix}.xhtml", piece))
+
+    if len(documents) > 1:
+        documents = _relink(documents)
+    return documents
+
+
+def _split_by_size(html, blocks, max_size):
+    """在块元素之间把 html 拆成不超过 max_size 字节的若干段。
+
+    blocks 为 html 中各顶层块元素的 [(起始偏移, 标签名)]（不含位于开头的第一个）。
+    标题不与其后的内容分开。
+    """
+    pieces = []
+    start = previous = size = 0
+    heading_only = False  # 当前段目前只有一个标题
+    for offset, tag in blocks + [(len(html), None)]:
+        block_size = len(html[previous:offset].encode("utf-8"))
+        # 加上这个块会超过上限，且当前段不为空：在块之前拆开
+        if size and size + block_size > max_size and not heading_only:
+            pieces.append(html[start:previous])
+            start = previous
+            size = 0
+        heading_only = size == 0 and HEADING_RE.match(html, previous) is not None
+        size += block_size
+        previous = offset
+    pieces.append(html[start:])
+    return pieces
+
+
+def anchor_files(documents):
+    """{元素 ID: 所在文档名}。"""
+    files = {}
+    for name, fragment in documents:
+        for anchor in ID_RE.findall(fragment):
+            files.setdefault(anchor, name)
+    return files
+
+
+def _relink(documents):
+    """把指向其他文档中元素的页内链接改为 {文档名}#{ID}。"""
+    files = anchor_files(documents)
+    result = []
+    for name, fragment in documents:
+        def replace(match, name=name):
+            target = files.get(match.group(1))
+            if target is None or target == name:
+                return match.group(0)
+            return f'href="{target}#{match.group(1)}"'
+        result.append((name, LOCAL_HREF_RE.sub(replace, fragment)))
+    return result
@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+"""
+流式 EPUB 写入：条目在生成时就写入 zip，压缩在线程中并行进行（见 zip_writer.py）。
+
+ebooklib 的 write_epub() 要等整本书在内存中组装完毕，再逐个条目串行压缩写出。
+这里改为：
+    - 打开文件时先写入不压缩的 mimetype（EPUB 规范要求它是第一个条目）；
+    - 各章节、图片组装好就写入，之后不再保留内容；
+    - 目录（nav.xhtml、toc.ncx）、content.opf 和 container.xml 仍由 ebooklib
+      根据 EpubBook 生成，在所有章节写完之后写入（见 finish_epub()）。
+
+输出是可复现的：条目时间戳和 content.opf 的 dcterms:modified 都取
+reproducible.source_date_epoch()，书的标识符由全部条目的内容哈希生成。
+
+用法：
+    with EpubZipWriter(output, jobs=4) as out:
+        write_item(out, book, item)
+        ...
+        finish_epub(out, book)
+"""
+
+import uuid
+from datetime import datetime, timezone
+
+from ebooklib import epub
+
+from reproducible import source_date_epoch
+from zip_writer import ZipStreamWriter
+
+
+class EpubZipWriter(ZipStreamWriter):
+    """EPUB 的 zip 写入：第一个条目为不压缩的 mimetype。"""
+
+    def __init__(self, path, jobs=1, max_pending=None, timestamp=None):
+        super().__init__(path, jobs, max_pending, timestamp)
+        self.write("mimetype", b"application/epub+zip", compress=False)
+
+    # 供 ebooklib 的 EpubWriter 调用（见 finish_epub()）
+    writestr = ZipStreamWriter.write
+
+
+class _IndexWriter(epub.EpubWriter):
+    """借用 ebooklib 生成目录、content.opf 和 container.xml，写入 EpubZipWriter。"""
+
+    def __init__(self, out, book):
+        # epub3_pages 要扫描各章节内容中的 pagebreak 标记生成页码列表，而章节内容
+        # 写入后已经释放；书稿中没有这种标记，关掉不影响输出
+        mtime = datetime.fromtimestamp(source_date_epoch(), timezone.utc)
+        super().__init__(out.path, book, {"epub3_pages": False, "mtime": mtime})
+        self.out = out
+
+    def write(self):
+        folder = self.book.FOLDER_NAME
+        for item in self.book.get_items():
+            if isinstance(item, epub.EpubNcx):
+                self.out.write(f"{folder}/{item.file_name}", self._get_ncx())
+            elif isinstance(item, epub.EpubNav):
+                self.out.write(f"{folder}/{item.file_name}", self._get_nav(item))
+        self._write_container()
+        self._write_opf()
+
+
+def entry_name(book, item):
+    """条目在 zip 中的路径（与 ebooklib 一致）。"""
+    return f"{book.FOLDER_NAME}/{item.file_name}" if item.manifest else item.file_name
+
+
+def write_item(out, book, item, compress=True):
+    """把 EpubBook 中的一个条目写入 out，之后不再保留其内容。"""
+    out.write(entry_name(book, item), item.get_content(), compress)
+    item.content = b""
+
+
+def finish_epub(out, book):
+    """写入 book 的目录、content.opf 和 container.xml，以及尚未写入的条目。
+
+    book 中已经用 write_item() 写入过的条目不再写入；manifest 和书脊只需要条目的
+    文件名、ID 和媒体类型，已写入的条目可以不保留内容。book 的标识符改为由此前
+    写入的全部条目的内容哈希生成（ebooklib 默认的是随机 UUID）：内容不变，标识符就不变。
+    """
+    writer = _IndexWriter(out, book)
+    writer.process()
+    for item in book.get_items():
+        if isinstance(item, (epub.EpubNcx, epub.EpubNav)):
+            continue
+        if entry_name(book, item) not in out:
+            write_item(out, book, item)
+    digest = bytes.fromhex(out.content_digest())
+    book.set_identifier(str(uuid.UUID(bytes=digest[:16], version=5)))
+    writer.write()
@@ -3,196 +3,138 @@
 导出《夹缝生长》为 DOCX。
 
 依赖安装：
-    pip install markdown python-docx
+    pip install markdown python-docx Pillow
 
 用法：
     python script/export_docx.py
     python script/export_docx.py -o output/my_book.docx
     python script/export_docx.py --chapter 1
+    python script/export_docx.py --profile   # 记录各阶段、各章节耗时（见 profiling.py）
 """
 
 import argparse
-import io
 import os
-import re
 import sys
+import zipfile
+from collections import Counter
 from html.parser import HTMLParser
 
-import markdown
 from docx import Document
-from docx.shared import Pt, Cm, RGBColor
-from docx.enum.text import WD_ALIGN_PARAGRAPH
+from docx.shared import Pt, Cm, Emu, RGBColor
+from docx.enum.style import WD_STYLE_TYPE
+from docx.enum.text import WD_ALIGN_PARAGRAPH, WD_BREAK
+from docx.image.image import Image as DocxImage
+from docx.opc.constants import RELATIONSHIP_TYPE as RT
+from docx.opc.packuri import PackURI
+from docx.oxml import OxmlElement
 from docx.oxml.ns import qn
-from PIL import Image
+from docx.oxml.shape import CT_Inline
+from docx.parts.image import ImagePart
+from docx.text.paragraph import Paragraph
+
+import profiling
+from book_model import BOOK_DIR, ROOT_DIR, load_book
+from images import chapter_images, image_map
+from render import default_jobs, image_path_from_src, render_chapters
+from zip_writer import COMPRESSED_EXTS, ZipStreamWriter
 
 # 中文字体配置
 CJK_FONT = "PingFang SC"       # macOS 苹方
 LATIN_FONT = "PingFang SC"     # 西文也用苹方保持一致
 CODE_FONT = "Menlo"            # 代码字体
 
-# 项目根目录
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-BOOK_DIR = os.path.join(ROOT_DIR, "book")
-INDEX_FILE = os.path.join(ROOT_DIR, "index.md")
+# 封面、部分标题页、问题页的文字距页顶的距离（约等于 12 个空段落的高度）
+PAGE_TITLE_OFFSET = Pt(340)
+
 DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "output", "夹缝生长.docx")
 
-# 不需要问题页的文件
-SKIP_QUESTION_FILES = {"restart.md", "crack.md", "flomo.md", "wuma.md", "scys.md", "acknowledgments.md"}
-
-# 不参与编号的特殊文件
-SPECIAL_FILES = {"restart.md", "crack.md", "acknowledgments.md"}
-
-
-def parse_index():
-    """从 index.md 解析书籍结构，返回章节列表。"""
-    with open(INDEX_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    title_match = re.search(r"^#\s+(.+)", content, re.MULTILINE)
-    book_title = title_match.group(1).strip() if title_match else "夹缝生长"
-
-    chapters = []
-    current_part = None
-    current_section = None
-
-    for line in content.split("\n"):
-        line = line.rstrip()
-
-        part_match = re.match(r"^-\s+(第.+部分：.+|前言：|后记：|第.+部分：)", line)
-        if part_match:
-            part_text = part_match.group(1).rstrip("：").rstrip(":")
-            link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-            if link_match:
-                label = link_match.group(1)
-                path = link_match.group(2)
-                current_part = part_text
-                current_section = None
-                chapters.append({
-                    "part": current_part,
-                    "section": None,
-                    "title": label,
-                    "file": path,
-                    "is_part_header": True,
-                })
-            else:
-                current_part = part_text
-                current_section = None
-            continue
 
-        section_match = re.match(r"^\s*-\s+(.+?)$", line)
-        if section_match and "[" not in line:
-            current_section = section_match.group(1).strip()
-            continue
+# ---------------------------------------------------------------------------
+# 段落写入
+# ---------------------------------------------------------------------------
 
-        link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-        if link_match:
-            chapters.append({
-                "part": current_part,
-                "section": current_section,
-                "title": link_match.group(1),
-                "file": link_match.group(2),
-                "is_part_header": False,
-            })
+class BodyWriter:
+    """按顺序向文档正文追加段落，每个段落的开销与文档长度无关。
 
-    return book_title, chapters
+    python-docx 的 doc.add_paragraph() 每次都要在正文中查找末尾的 sectPr，
+    按样式名设置样式时还要遍历全部样式；插入图片时要扫描全文找最大的 ID，
+    并重新计算已有每张图片的哈希来去重。篇幅一长，构建时间随之平方增长。
+    这里缓存 sectPr、样式 ID、图片和下一个 ID，新段落直接插在 sectPr 之前。
+    须在 setup_styles() 之后创建。
 
+    lazy_images=True 时图片部件只记录文件路径，保存文档时才逐个读取，
+    内存中不保留全部图片的内容。
+    """
 
-def assign_chapter_numbers(chapters):
-    """为每个常规章节分配编号。前言、后记、致谢不编号。"""
-    num = 0
-    for ch in chapters:
-        basename = os.path.basename(ch["file"])
-        if basename in SPECIAL_FILES or ch.get("is_part_header"):
-            ch["chapter_num"] = None
-        elif ch["part"] and re.match(r"第.+部分", ch["part"]):
-            num += 1
-            ch["chapter_num"] = num
+    def __init__(self, doc, lazy_images=False):
+        self.doc = doc
+        self.lazy_images = lazy_images
+        self._container = doc._body
+        self._body = doc.element.body
+        self._sect_pr = self._body.sectPr
+        self._style_ids = {style.name: style.style_id for style in doc.styles}
+        self._images = {}  # {图片 SHA1: (关系 ID, 文件名, 原始宽度, 原始高度)}
+        self._shape_id = doc.part.next_id - 1
+
+    def paragraph(self, style=None, text=""):
+        """追加一个段落，style 为样式名。"""
+        p = OxmlElement("w:p")
+        if self._sect_pr is not None:
+            self._sect_pr.addprevious(p)
         else:
-            ch["chapter_num"] = None
-
-
-def add_numbering_to_content(content, chapter_num):
-    """为章节内容的 h1、h2、h3 添加编号。"""
-    if chapter_num is None:
-        return content
-    h2_counter = 0
-    h3_counter = 0
-    lines = content.split("\n")
-    result = []
-    for line in lines:
-        if re.match(r"^# ", line):
-            line = re.sub(r"^# (.+)", f"# {chapter_num}. \\1", line)
-        elif re.match(r"^## ", line):
-            h2_counter += 1
-            h3_counter = 0
-            line = re.sub(r"^## (.+)", f"## {chapter_num}.{h2_counter} \\1", line)
-        elif re.match(r"^### ", line):
-            h3_counter += 1
-            line = re.sub(r"^### (.+)", f"### {chapter_num}.{h2_counter}.{h3_counter} \\1", line)
-        result.append(line)
-    return "\n".join(result)
-
-
-def extract_h2_headings(content):
-    """从 markdown 内容中提取 h2 标题列表（原始标题，不含编号）。"""
-    headings = []
-    for line in content.split("\n"):
-        match = re.match(r"^## (.+)", line)
-        if match:
-            headings.append(match.group(1).strip())
-    return headings
-
-
-def read_chapter(file_path):
-    """读取章节 markdown 内容。"""
-    full_path = os.path.join(ROOT_DIR, file_path)
-    if not os.path.exists(full_path):
-        print(f"  警告：文件不存在，跳过 {file_path}", file=sys.stderr)
-        return None
-    with open(full_path, "r", encoding="utf-8") as f:
-        return f.read()
-
-
-def extract_question(content, file_path):
-    """从章节内容中提取引导问题。"""
-    basename = os.path.basename(file_path)
-    if basename in SKIP_QUESTION_FILES:
-        return None, content
-
-    match = re.match(r"^(.+?)\n\n---\n", content, re.DOTALL)
-    if match:
-        question = match.group(1).strip()
-        body = content[match.end():]
-        return question, body
-
-    return None, content
+            self._body.append(p)
+        if style:
+            p.style = self._style_ids[style]
+        paragraph = Paragraph(p, self._container)
+        if text:
+            paragraph.add_run(text)
+        return paragraph
+
+    def set_run_style(self, run, style):
+        """为 run 设置字符样式。"""
+        run._r.style = self._style_ids[style]
+
+    def page_break(self):
+        """添加分页符。"""
+        self.paragraph().add_run().add_break(WD_BREAK.PAGE)
+
+    def add_picture(self, paragraph, image_file, width):
+        """在段落末尾插入图片，按 width 等比缩放。同一张图片在文档中只存一份。"""
+        image = DocxImage.from_file(image_file)
+        cached = self._images.get(image.sha1)
+        if cached is None:
+            package = self.doc.part.package
+            partname = PackURI(f"/word/media/image{len(package.image_parts) + 1}.{image.ext}")
+            if self.lazy_images:
+                path = getattr(image_file, "name", image_file)
+                image_part = FileImagePart(partname, image.content_type, path)
+            else:
+                image_part = ImagePart.from_image(image, partname)
+            package.image_parts.append(image_part)
+            rId = self.doc.part.relate_to(image_part, RT.IMAGE)
+            # 只保留尺寸，不保留图片对象（其中有图片的全部内容）
+            cached = (rId, image.filename, image.width, image.height)
+            self._images[image.sha1] = cached
+        rId, filename, native_width, native_height = cached
 
+        # 与 Image.scaled_dimensions(width, None) 相同的换算
+        cx, cy = Emu(width), Emu(round(native_height * (float(width) / float(native_width))))
+        self._shape_id += 1
+        inline = CT_Inline.new_pic_inline(self._shape_id, rId, filename, cx, cy)
+        paragraph.add_run()._r.add_drawing(inline)
 
-# ---------------------------------------------------------------------------
-# 图片处理
-# ---------------------------------------------------------------------------
 
-def _prepare_image(abs_path):
-    """将图片转为 Word 兼容的 JPEG 字节流。
+class FileImagePart(ImagePart):
+    """只记录文件路径的图片部件，保存文档时才读取内容。"""
 
-    macOS 上的 PNG（Display P3、alpha 通道等）在 Word 中经常渲染异常，
-    统一转为 sRGB 的 JPEG 可以解决兼容性问题。
-    """
-    img = Image.open(abs_path)
-    # 转为 RGB（去掉 alpha 通道），白色背景
-    if img.mode in ("RGBA", "LA", "P"):
-        background = Image.new("RGB", img.size, (255, 255, 255))
-        if img.mode == "P":
-            img = img.convert("RGBA")
-        background.paste(img, mask=img.split()[-1] if "A" in img.mode else None)
-        img = background
-    elif img.mode != "RGB":
-        img = img.convert("RGB")
-
-    buf = io.BytesIO()
-    img.save(buf, format="JPEG", quality=90)
-    buf.seek(0)
-    return buf
+    def __init__(self, partname, content_type, path):
+        super().__init__(partname, content_type, b"")
+        self._path = path
+
+    @property
+    def blob(self):
+        with open(self._path, "rb") as f:
+            return f.read()
 
 
 # ---------------------------------------------------------------------------
@@ -200,51 +142,65 @@ def _prepare_image(abs_path):
 # ---------------------------------------------------------------------------
 
 class HTMLToDocxConverter(HTMLParser):
-    """将 Markdown 转出的 HTML 写入 python-docx Document。"""
+    """将 Markdown 转出的 HTML 写入 python-docx Document。
 
-    def __init__(self, doc, book_dir, file_path):
+    字体、字号、颜色都由 setup_styles() 中定义的样式决定，段落和文字只引用样式名，
+    不逐个 run 写格式（只有加粗、斜体直接设置）。
+    """
+
+    def __init__(self, writer, book_dir, file_path, image_paths=None):
         super().__init__()
-        self.doc = doc
+        self.writer = writer
         self.book_dir = book_dir
         self.file_path = file_path
+        self.image_paths = image_paths or {}
 
         # 状态跟踪
         self._paragraph = None
         self._tag_stack = []
+        self._open_tags = Counter()  # 与 _tag_stack 同步的计数，判断加粗等无需搜索整个栈
         self._list_stack = []  # 嵌套列表跟踪: [("ul"|"ol", counter)]
         self._in_blockquote = False
         self._is_epigraph = False
         self._in_code_block = False
+        self._code_lines = []  # 代码块内容，</pre> 时合成一个段落
         self._skip_content = False  # 跳过 <img> 等空元素的内容
-
-    def _current_tag(self):
-        return self._tag_stack[-1] if self._tag_stack else None
+        self._in_quote_paragraph = False  # 当前段落是否为引用/引言样式
 
     def _ensure_paragraph(self):
         if self._paragraph is None:
-            self._paragraph = self.doc.add_paragraph()
+            self._paragraph = self._add_paragraph()
         return self._paragraph
 
+    def _add_paragraph(self, style=None):
+        return self.writer.paragraph(style)
+
     def _finish_paragraph(self):
         self._paragraph = None
+        self._in_quote_paragraph = False
 
     def handle_starttag(self, tag, attrs):
         attrs_dict = dict(attrs)
         self._tag_stack.append(tag)
+        self._open_tags[tag] += 1
 
         if tag in ("h1", "h2", "h3"):
             self._finish_paragraph()
             level = int(tag[1])
-            self._paragraph = self.doc.add_heading(level=level)
+            self._paragraph = self._add_paragraph(f"Heading {level}")
             return
 
         if tag == "p":
             self._finish_paragraph()
-            if self._in_blockquote:
-                p = self.doc.add_paragraph(style="Quote")
-                self._paragraph = p
+            if "img-caption" in attrs_dict.get("class", ""):
+                # 图片说明（渲染时已标记）：居中、小字、灰色
+                self._paragraph = self._add_paragraph("Image Caption")
+            elif self._in_blockquote:
+                style = "Epigraph" if self._is_epigraph else "Quote"
+                self._paragraph = self._add_paragraph(style)
+                self._in_quote_paragraph = True
             else:
-                self._paragraph = self.doc.add_paragraph()
+                self._paragraph = self._add_paragraph()
             return
 
         if tag == "blockquote":
@@ -266,19 +222,20 @@ class HTMLToDocxConverter(HTMLParser):
                     self._list_stack[-1] = (list_type, counter)
                 indent_level = len(self._list_stack) - 1
                 if list_type == "ul":
-                    p = self.doc.add_paragraph(style="List Bullet")
+                    p = self._add_paragraph("List Bullet")
                 else:
-                    p = self.doc.add_paragraph(style="List Number")
+                    p = self._add_paragraph("List Number")
                 # 设置缩进层级
                 if indent_level > 0:
                     p.paragraph_format.left_indent = Cm(1.27 * indent_level)
                 self._paragraph = p
             else:
-                self._paragraph = self.doc.add_paragraph(style="List Bullet")
+                self._paragraph = self._add_paragraph("List Bullet")
             return
 
         if tag == "pre":
             self._in_code_block = True
+            self._code_lines = []
             self._finish_paragraph()
             return
 
@@ -293,11 +250,7 @@ class HTMLToDocxConverter(HTMLParser):
 
         if tag == "hr":
             self._finish_paragraph()
-            p = self.doc.add_paragraph()
-            p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-            run = p.add_run("* * *")
-            run.font.color.rgb = RGBColor(0x99, 0x99, 0x99)
-            run.font.size = Pt(11)
+            self._add_paragraph("Separator").add_run("* * *")
             self._finish_paragraph()
             return
 
@@ -313,20 +266,13 @@ class HTMLToDocxConverter(HTMLParser):
     def handle_endtag(self, tag):
         if self._tag_stack and self._tag_stack[-1] == tag:
             self._tag_stack.pop()
+            self._open_tags[tag] -= 1
 
         if tag in ("h1", "h2", "h3"):
             self._finish_paragraph()
             return
 
         if tag == "p":
-            # 图片说明居中 + 小字灰色
-            if self._paragraph is not None:
-                text = self._paragraph.text.strip()
-                if re.match(r"^图\s+\d+-\d+", text):
-                    self._paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                    for run in self._paragraph.runs:
-                        run.font.size = Pt(9.5)
-                        run.font.color.rgb = RGBColor(0x66, 0x66, 0x66)
             self._finish_paragraph()
             return
 
@@ -347,6 +293,10 @@ class HTMLToDocxConverter(HTMLParser):
         if tag == "pre":
             self._in_code_block = False
             self._finish_paragraph()
+            code = "".join(self._code_lines).strip("\n")
+            if code:
+                self._add_paragraph("Code Block").add_run(code)
+            self._code_lines = []
             return
 
     def handle_data(self, data):
@@ -356,88 +306,64 @@ class HTMLToDocxConverter(HTMLParser):
                 self._paragraph.add_run(" ")
             return
 
-        current = self._current_tag()
-
-        # 代码块
+        # 代码块：先收集，</pre> 时一次写入（文本中的换行由 python-docx 转为换行符）
         if self._in_code_block:
-            self._finish_paragraph()
-            p = self.doc.add_paragraph()
-            run = p.add_run(data)
-            set_run_font(run, font_name=CODE_FONT, cjk_font=CJK_FONT)
-            run.font.size = Pt(9)
-            run.font.color.rgb = RGBColor(0x33, 0x33, 0x33)
-            p.paragraph_format.space_before = Pt(2)
-            p.paragraph_format.space_after = Pt(2)
-            pf = p.paragraph_format
-            pf.left_indent = Cm(1)
-            self._paragraph = p
+            self._code_lines.append(data)
             return
 
         p = self._ensure_paragraph()
 
-        # 判断是否加粗/斜体
-        is_bold = "strong" in self._tag_stack or "b" in self._tag_stack
-        is_italic = ("em" in self._tag_stack or "i" in self._tag_stack
-                     or self._in_blockquote)
-        is_code = "code" in self._tag_stack and not self._in_code_block
+        # 判断是否加粗/斜体（引用段落的斜体、灰色由 Quote 样式提供）
+        open_tags = self._open_tags
+        is_bold = open_tags["strong"] > 0 or open_tags["b"] > 0
+        is_italic = open_tags["em"] > 0 or open_tags["i"] > 0
+        is_code = open_tags["code"] > 0
 
         run = p.add_run(data)
-        set_run_font(run)
 
         if is_bold:
             run.bold = True
         if is_italic:
             run.italic = True
         if is_code:
-            set_run_font(run, font_name=CODE_FONT, cjk_font=CJK_FONT)
-            run.font.size = Pt(9.5)
-            run.font.color.rgb = RGBColor(0x55, 0x55, 0x55)
-        if self._in_blockquote:
-            run.font.color.rgb = RGBColor(0x66, 0x66, 0x66)
+            self.writer.set_run_style(run, "Inline Code")
+        elif self._in_blockquote and not self._in_quote_paragraph:
+            # 引用块中的列表等非引用段落
+            self.writer.set_run_style(run, "Quote Text")
 
     def _add_image(self, src):
         """添加图片到文档。"""
-        if src.startswith(("http://", "https://")):
+        abs_path = image_path_from_src(src)
+        if abs_path is None:
             return
-        chapter_dir = os.path.dirname(os.path.join(ROOT_DIR, self.file_path))
-        abs_path = os.path.abspath(os.path.join(chapter_dir, src))
-        if not os.path.exists(abs_path):
-            abs_path = os.path.abspath(os.path.join(self.book_dir, src))
+        if not os.path.isabs(abs_path):
+            chapter_dir = os.path.dirname(os.path.join(ROOT_DIR, self.file_path))
+            abs_path = os.path.abspath(os.path.join(chapter_dir, src))
+            if not os.path.exists(abs_path):
+                abs_path = os.path.abspath(os.path.join(self.book_dir, src))
         if os.path.exists(abs_path):
             self._finish_paragraph()
             try:
-                # 用 Pillow 转为 JPEG 字节流，确保 Word 兼容
-                img_stream = _prepare_image(abs_path)
-                self.doc.add_picture(img_stream, width=Cm(12))
-                last_paragraph = self.doc.paragraphs[-1]
-                last_paragraph.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                # 使用 docx profile 的衍生图（白底 JPEG），确保 Word 兼容；
+                # 以文件对象传入，文档中的图片名不带缓存文件名
+                p = self._add_paragraph()
+                p.alignment = WD_ALIGN_PARAGRAPH.CENTER
+                with open(self.image_paths.get(abs_path, abs_path), "rb") as f:
+                    self.writer.add_picture(p, f, Cm(12))
             except Exception as e:
-                p = self.doc.add_paragraph()
+                p = self._add_paragraph()
                 p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-                run = p.add_run(f"[图片: {os.path.basename(abs_path)}]")
-                set_run_font(run)
+                p.add_run(f"[图片: {os.path.basename(abs_path)}]")
                 print(f"  警告：图片插入失败 {abs_path}: {e}", file=sys.stderr)
             self._finish_paragraph()
 
 
-def markdown_to_docx(doc, md_content, book_dir, file_path):
-    """将 Markdown 内容转为 DOCX 段落，写入 doc。"""
-    md_extensions = ["extra", "toc", "sane_lists", "smarty"]
-    html_content = markdown.markdown(md_content, extensions=md_extensions)
-
-    # 标记 epigraph
-    html_content = re.sub(
-        r'(</h1>\s*)((?:<blockquote>\s*.*?</blockquote>\s*)+)',
-        lambda m: m.group(1) + re.sub(
-            r'<blockquote>',
-            '<blockquote class="epigraph">',
-            m.group(2),
-        ),
-        html_content,
-        flags=re.DOTALL,
-    )
+def html_to_docx(writer, html_content, book_dir, file_path, image_paths=None):
+    """将渲染好的章节 HTML 转为 DOCX 段落，通过 writer（BodyWriter）写入文档。
 
-    converter = HTMLToDocxConverter(doc, book_dir, file_path)
+    image_paths 为 {原图路径: 衍生图路径}，见 images.image_map()。
+    """
+    converter = HTMLToDocxConverter(writer, book_dir, file_path, image_paths)
     converter.feed(html_content)
 
 
@@ -445,31 +371,70 @@ def markdown_to_docx(doc, md_content, book_dir, file_path):
 # 样式配置
 # ---------------------------------------------------------------------------
 
-def set_run_font(run, font_name=LATIN_FONT, cjk_font=CJK_FONT):
-    """为 run 同时设置西文和中文字体。"""
-    run.font.name = font_name
-    r = run._element
-    rPr = r.get_or_add_rPr()
-    rFonts = rPr.find(qn("w:rFonts"))
-    if rFonts is None:
-        rFonts = rPr.makeelement(qn("w:rFonts"), {})
-        rPr.insert(0, rFonts)
-    rFonts.set(qn("w:eastAsia"), cjk_font)
-
-
 def set_style_font(style, font_name=LATIN_FONT, cjk_font=CJK_FONT):
     """为样式同时设置西文和中文字体。"""
-    style.font.name = font_name
-    rPr = style.element.get_or_add_rPr()
+    _set_fonts(style.element.get_or_add_rPr(), font_name, cjk_font)
+
+
+def _set_fonts(rPr, font_name, cjk_font):
+    """在 rPr 中写入西文和中文字体，并去掉主题字体。
+
+    Word 中主题字体（asciiTheme 等）优先于显式字体；默认模板的标题样式和文档
+    默认值都带主题字体，不去掉的话样式里指定的字体不会生效。
+    """
     rFonts = rPr.find(qn("w:rFonts"))
     if rFonts is None:
         rFonts = rPr.makeelement(qn("w:rFonts"), {})
         rPr.insert(0, rFonts)
+    for attr in ("w:asciiTheme", "w:hAnsiTheme", "w:eastAsiaTheme", "w:cstheme"):
+        rFonts.attrib.pop(qn(attr), None)
+    rFonts.set(qn("w:ascii"), font_name)
+    rFonts.set(qn("w:hAnsi"), font_name)
     rFonts.set(qn("w:eastAsia"), cjk_font)
 
 
+def add_style(doc, name, style_type=WD_STYLE_TYPE.PARAGRAPH, base="Normal", size=None,
+              color=None, bold=None, italic=None, alignment=None, left_indent=None,
+              space_before=None, space_after=None):
+    """定义（或覆盖）一个段落/字符样式，返回该样式。"""
+    if name in doc.styles:
+        style = doc.styles[name]
+    else:
+        style = doc.styles.add_style(name, style_type)
+    if style_type == WD_STYLE_TYPE.PARAGRAPH and base:
+        style.base_style = doc.styles[base]
+
+    if size is not None:
+        style.font.size = size
+    if color is not None:
+        style.font.color.rgb = color
+    if bold is not None:
+        style.font.bold = bold
+    if italic is not None:
+        style.font.italic = italic
+
+    if style_type == WD_STYLE_TYPE.PARAGRAPH:
+        pf = style.paragraph_format
+        if alignment is not None:
+            pf.alignment = alignment
+        if left_indent is not None:
+            pf.left_indent = left_indent
+        if space_before is not None:
+            pf.space_before = space_before
+        if space_after is not None:
+            pf.space_after = space_after
+    return style
+
+
 def setup_styles(doc):
-    """配置文档默认样式。"""
+    """配置文档样式。正文、目录中用到的格式都在这里定义一次，段落和文字只引用样式名。"""
+    # 文档默认字体（去掉模板中的主题字体）
+    doc_defaults = doc.styles.element.find(qn("w:docDefaults"))
+    if doc_defaults is not None:
+        rPr = doc_defaults.find(qn("w:rPrDefault") + "/" + qn("w:rPr"))
+        if rPr is not None:
+            _set_fonts(rPr, LATIN_FONT, CJK_FONT)
+
     style = doc.styles["Normal"]
     set_style_font(style)
     style.font.size = Pt(11)
@@ -496,6 +461,50 @@ def setup_styles(doc):
     quote_style.font.color.rgb = RGBColor(0x66, 0x66, 0x66)
     quote_style.paragraph_format.left_indent = Cm(1.5)
 
+    # 章节开头的引言：与引用相同，单独成样式便于在 Word 中调整
+    add_style(doc, "Epigraph", base="Quote")
+
+    # 引用块中非引用段落（如列表）里的文字
+    add_style(doc, "Quote Text", WD_STYLE_TYPE.CHARACTER,
+              italic=True, color=RGBColor(0x66, 0x66, 0x66))
+
+    # 行内代码
+    code_style = add_style(doc, "Inline Code", WD_STYLE_TYPE.CHARACTER,
+                           size=Pt(9.5), color=RGBColor(0x55, 0x55, 0x55))
+    set_style_font(code_style, font_name=CODE_FONT)
+
+    # 代码块
+    code_block_style = add_style(doc, "Code Block", size=Pt(9), color=RGBColor(0x33, 0x33, 0x33),
+                                 left_indent=Cm(1), space_before=Pt(2), space_after=Pt(2))
+    set_style_font(code_block_style, font_name=CODE_FONT)
+
+    # 图片说明：居中、小字、灰色
+    add_style(doc, "Image Caption", size=Pt(9.5), color=RGBColor(0x66, 0x66, 0x66),
+              alignment=WD_ALIGN_PARAGRAPH.CENTER)
+
+    # 分隔线（<hr>）：居中的 * * *
+    add_style(doc, "Separator", size=Pt(11), color=RGBColor(0x99, 0x99, 0x99),
+              alignment=WD_ALIGN_PARAGRAPH.CENTER)
+
+    # 独立成页的标题：部分标题页，以及在它基础上的封面、子分类标题页、问题页
+    add_style(doc, "Title Page", size=Pt(26), color=RGBColor(0x22, 0x22, 0x22), bold=True,
+              alignment=WD_ALIGN_PARAGRAPH.CENTER, space_before=PAGE_TITLE_OFFSET)
+    add_style(doc, "Cover Title", base="Title Page", size=Pt(32))
+    add_style(doc, "Section Title Page", base="Title Page", size=Pt(20),
+              color=RGBColor(0x44, 0x44, 0x44))
+    add_style(doc, "Question Page", base="Title Page", size=Pt(16),
+              color=RGBColor(0x55, 0x55, 0x55), bold=False, italic=True)
+
+    # 目录条目
+    add_style(doc, "TOC Part", size=Pt(12), color=RGBColor(0x22, 0x22, 0x22), bold=True,
+              space_before=Pt(12), space_after=Pt(2))
+    add_style(doc, "TOC Section", size=Pt(10.5), color=RGBColor(0x55, 0x55, 0x55), bold=True,
+              left_indent=Cm(1), space_before=Pt(6), space_after=Pt(2))
+    add_style(doc, "TOC Chapter", size=Pt(10.5), color=RGBColor(0x44, 0x44, 0x44),
+              left_indent=Cm(2), space_before=Pt(1), space_after=Pt(1))
+    add_style(doc, "TOC Subheading", size=Pt(9.5), color=RGBColor(0x66, 0x66, 0x66),
+              left_indent=Cm(3), space_before=Pt(0), space_after=Pt(0))
+
     # 列表样式
     for list_style_name in ("List Bullet", "List Number"):
         if list_style_name in doc.styles:
@@ -511,125 +520,55 @@ def setup_styles(doc):
     section.right_margin = Cm(2)
 
 
-def add_page_break(doc):
-    """添加分页符。"""
-    doc.add_page_break()
+def add_title_page(writer, text, style="Title Page"):
+    """添加居中文字的独立页面，文字位于页面中部偏上（见 setup_styles() 中的 Title Page 样式）。"""
+    writer.paragraph(style, text)
+    writer.page_break()
 
 
-def add_cover_page(doc, title):
+def add_cover_page(writer, title):
     """添加封面页。"""
-    for _ in range(12):
-        doc.add_paragraph()
-
-    p = doc.add_paragraph()
-    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = p.add_run(title)
-    set_run_font(run)
-    run.font.size = Pt(32)
-    run.font.color.rgb = RGBColor(0x22, 0x22, 0x22)
-    run.bold = True
-
-    add_page_break(doc)
+    add_title_page(writer, title, "Cover Title")
 
 
-def add_centered_page(doc, text, font_size=Pt(26), color=RGBColor(0x22, 0x22, 0x22)):
+def add_centered_page(writer, text, style="Title Page"):
     """添加居中文字的独立页面（部分标题、子分类标题等）。"""
-    for _ in range(12):
-        doc.add_paragraph()
+    add_title_page(writer, text, style)
 
-    p = doc.add_paragraph()
-    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = p.add_run(text)
-    set_run_font(run)
-    run.font.size = font_size
-    run.font.color.rgb = color
-    run.bold = True
 
-    add_page_break(doc)
-
-
-def add_question_page(doc, question):
+def add_question_page(writer, question):
     """添加问题页（独立一页，居中斜体）。"""
-    for _ in range(12):
-        doc.add_paragraph()
-
-    p = doc.add_paragraph()
-    p.alignment = WD_ALIGN_PARAGRAPH.CENTER
-    run = p.add_run(question)
-    set_run_font(run)
-    run.font.size = Pt(16)
-    run.font.color.rgb = RGBColor(0x55, 0x55, 0x55)
-    run.italic = True
-
-    add_page_break(doc)
+    add_title_page(writer, question, "Question Page")
 
 
 # ---------------------------------------------------------------------------
 # 目录生成
 # ---------------------------------------------------------------------------
 
-def add_toc_page(doc, chapters):
-    """添加目录页，包含章节编号和 h2 子标题。"""
-    doc.add_heading("目录", level=1).alignment = WD_ALIGN_PARAGRAPH.CENTER
-
-    seen_parts = set()
-    seen_sections = set()
+def add_toc_page(writer, chapters):
+    """添加目录页，包含章节编号和 h2 子标题（来自书籍模型，不读取章节文件）。"""
+    writer.paragraph("Heading 1", "目录").alignment = WD_ALIGN_PARAGRAPH.CENTER
 
     for ch in chapters:
-        chapter_num = ch.get("chapter_num")
-
-        if ch["part"] and ch["part"] not in seen_parts:
-            seen_parts.add(ch["part"])
-            seen_sections.clear()
-            p = doc.add_paragraph()
-            p.paragraph_format.space_before = Pt(12)
-            p.paragraph_format.space_after = Pt(2)
-            run = p.add_run(ch["part"])
-            set_run_font(run)
-            run.font.size = Pt(12)
-            run.bold = True
-            run.font.color.rgb = RGBColor(0x22, 0x22, 0x22)
-
-        if ch["section"] and ch["section"] not in seen_sections:
-            seen_sections.add(ch["section"])
-            p = doc.add_paragraph()
-            p.paragraph_format.left_indent = Cm(1)
-            p.paragraph_format.space_before = Pt(6)
-            p.paragraph_format.space_after = Pt(2)
-            run = p.add_run(ch["section"])
-            set_run_font(run)
-            run.font.size = Pt(10.5)
-            run.font.color.rgb = RGBColor(0x55, 0x55, 0x55)
-            run.bold = True
+        if ch["missing"]:
+            continue
+        chapter_num = ch["chapter_num"]
+
+        if ch["new_part"]:
+            writer.paragraph("TOC Part", ch["part"])
+
+        if ch["new_section"]:
+            writer.paragraph("TOC Section", ch["section"])
 
         # 章节标题（带编号）
-        display_title = f"{chapter_num}. {ch['title']}" if chapter_num else ch["title"]
-        p = doc.add_paragraph()
-        p.paragraph_format.left_indent = Cm(2)
-        p.paragraph_format.space_before = Pt(1)
-        p.paragraph_format.space_after = Pt(1)
-        run = p.add_run(display_title)
-        set_run_font(run)
-        run.font.size = Pt(10.5)
-        run.font.color.rgb = RGBColor(0x44, 0x44, 0x44)
-
-        # h2 子标题
+        writer.paragraph("TOC Chapter", ch["display_title"])
+
+        # h2 子标题（来自书籍模型，无需重新读取章节）
         if chapter_num:
-            content = read_chapter(ch["file"])
-            if content:
-                _, body = extract_question(content, ch["file"])
-                h2_headings = extract_h2_headings(body)
-                for i, heading in enumerate(h2_headings, 1):
-                    p = doc.add_paragraph()
-                    p.paragraph_format.left_indent = Cm(3)
-                    p.paragraph_format.space_before = Pt(0)
-                    p.paragraph_format.space_after = Pt(0)
-                    run = p.add_run(f"{chapter_num}.{i} {heading}")
-                    set_run_font(run)
-                    run.font.size = Pt(9.5)
-                    run.font.color.rgb = RGBColor(0x66, 0x66, 0x66)
-
-    add_page_break(doc)
+            for i, heading in enumerate(ch["h2_headings"], 1):
+                writer.paragraph("TOC Subheading", f"{chapter_num}.{i} {heading}")
+
+    writer.page_break()
 
 
 # ---------------------------------------------------------------------------
@@ -649,11 +588,30 @@ def main():
         default=None,
         help="导出指定章节（按编号，如 --chapter 1）",
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="并行转换章节、处理图片的进程数 (默认: CPU 核数)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略并不写入 output/.cache 中的解析、渲染和图片缓存",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="低内存模式：图片在保存时才逐个读取，不全部留在内存中",
+    )
+    profiling.add_profile_arguments(parser)
     args = parser.parse_args()
+    profiling.start_from_args("export_docx", args)
 
     print("解析目录结构...")
-    book_title, chapters = parse_index()
-    assign_chapter_numbers(chapters)
+    with profiling.stage("index"):
+        book = load_book(use_cache=not args.no_cache)
+    book_title, chapters = book["title"], book["chapters"]
     print(f"  书名: {book_title}")
     print(f"  章节数: {len(chapters)}")
 
@@ -677,63 +635,90 @@ def main():
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
 
+    print("合并章节内容...")
+    with profiling.stage("render"):
+        rendered = render_chapters(chapters, use_cache=not args.no_cache, jobs=args.jobs)
+    export(book_title, chapters, rendered, args.output, single_chapter=args.chapter is not None,
+           use_cache=not args.no_cache, jobs=args.jobs, low_memory=args.low_memory)
+    profiling.finish()
+
+
+def export(book_title, chapters, rendered, output, single_chapter=False, use_cache=True, jobs=1,
+           low_memory=False):
+    """由已渲染的章节生成 DOCX。也供 build.py 在独立进程中调用。
+
+    low_memory=True 时图片在保存文档时才逐个读取（见 BodyWriter）。
+    """
+    print("准备图片...")
+    with profiling.stage("images"):
+        image_paths = image_map(chapter_images(rendered), "docx", use_cache=use_cache, jobs=jobs)
+
+    with profiling.stage("assemble"):
+        doc = build_docx(book_title, chapters, rendered, image_paths, single_chapter,
+                         lazy_images=low_memory)
+
+    print("生成 DOCX...")
+    with profiling.stage("write"):
+        save_docx(doc, output, jobs=jobs)
+    print(f"完成: {output}")
+
+
+def save_docx(doc, output, jobs=1):
+    """保存文档：先用 doc.save() 写出临时文件，再把各条目按原顺序重新写入
+    ZipStreamWriter。条目时间戳固定（见 reproducible.py），同样的输入得到逐字节相同的
+    文件；条目由 jobs 个线程并行压缩，图片不再压缩。"""
+    tmp_path = f"{output}.{os.getpid()}.docx.tmp"
+    try:
+        doc.save(tmp_path)
+        with zipfile.ZipFile(tmp_path) as package, ZipStreamWriter(output, jobs=jobs) as out:
+            for name in package.namelist():
+                compress = os.path.splitext(name)[1].lower() not in COMPRESSED_EXTS
+                out.write(name, package.read(name), compress=compress)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def build_docx(book_title, chapters, rendered, image_paths, single_chapter=False,
+               lazy_images=False):
+    """构建 DOCX 文档（不写入文件）。image_paths 为 {原图路径: 衍生图路径}。"""
     # 创建文档
     doc = Document()
     setup_styles(doc)
+    writer = BodyWriter(doc, lazy_images)
 
-    if args.chapter is None:
+    if not single_chapter:
         # 封面
-        add_cover_page(doc, book_title)
+        add_cover_page(writer, book_title)
 
         # 目录
-        add_toc_page(doc, chapters)
-
-    print("合并章节内容...")
-
-    seen_parts = set()
-    seen_sections = set()
+        add_toc_page(writer, chapters)
 
     for ch in chapters:
-        content = read_chapter(ch["file"])
-        if content is None:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
             continue
 
-        chapter_num = ch.get("chapter_num")
-
         # 部分标题页（单章导出时跳过）
-        if args.chapter is None and ch["part"] and ch["part"] not in seen_parts:
-            seen_parts.add(ch["part"])
-            add_centered_page(doc, ch["part"], font_size=Pt(26))
-            seen_sections.clear()
+        if not single_chapter and ch["new_part"]:
+            add_centered_page(writer, ch["part"])
 
         # 子分类标题页（单章导出时跳过）
-        if args.chapter is None and ch["section"] and ch["section"] not in seen_sections:
-            seen_sections.add(ch["section"])
-            add_centered_page(
-                doc, ch["section"],
-                font_size=Pt(20),
-                color=RGBColor(0x44, 0x44, 0x44),
-            )
-
-        # 提取引导问题
-        question, content = extract_question(content, ch["file"])
-
-        # 添加编号
-        content = add_numbering_to_content(content, chapter_num)
+        if not single_chapter and ch["new_section"]:
+            add_centered_page(writer, ch["section"], "Section Title Page")
 
         # 问题页（独立一页，在章节最前面）
-        if question:
-            add_question_page(doc, question)
+        if chapter["question"]:
+            add_question_page(writer, chapter["question"])
 
         # 章节内容
-        markdown_to_docx(doc, content, BOOK_DIR, ch["file"])
+        with profiling.stage("assemble", chapter=ch["file"]):
+            html_to_docx(writer, chapter["html"], BOOK_DIR, ch["file"], image_paths)
 
         # 章节结束后分页
-        add_page_break(doc)
+        writer.page_break()
 
-    print("生成 DOCX...")
-    doc.save(args.output)
-    print(f"完成: {args.output}")
+    return doc
 
 
 if __name__ == "__main__":
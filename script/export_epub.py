@@ -3,197 +3,48 @@
 导出《夹缝生长》为 EPUB。
 
 依赖安装：
-    pip install markdown ebooklib
+    pip install markdown ebooklib Pillow
 
 用法：
     python script/export_epub.py
     python script/export_epub.py -o output/my_book.epub
     python script/export_epub.py --chapter 1
+    python script/export_epub.py --split-chapters   # 长章节按 h2 拆成多个文档（见 epub_split.py）
+    python script/export_epub.py --profile   # 记录各阶段、各章节耗时（见 profiling.py）
 """
 
 import argparse
+import hashlib
 import os
-import re
 import sys
-import uuid
 
-import markdown
 from ebooklib import epub
 
-# 项目根目录
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-BOOK_DIR = os.path.join(ROOT_DIR, "book")
-INDEX_FILE = os.path.join(ROOT_DIR, "index.md")
-DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "output", "夹缝生长.epub")
-
-# 不需要问题页的文件
-SKIP_QUESTION_FILES = {"restart.md", "crack.md", "flomo.md", "wuma.md", "scys.md", "acknowledgments.md"}
-
-# 不参与编号的特殊文件
-SPECIAL_FILES = {"restart.md", "crack.md", "acknowledgments.md"}
-
-
-def parse_index():
-    """从 index.md 解析书籍结构，返回章节列表。"""
-    with open(INDEX_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    title_match = re.search(r"^#\s+(.+)", content, re.MULTILINE)
-    book_title = title_match.group(1).strip() if title_match else "夹缝生长"
-
-    chapters = []
-    current_part = None
-    current_section = None
-
-    for line in content.split("\n"):
-        line = line.rstrip()
-
-        part_match = re.match(r"^-\s+(第.+部分：.+|前言：|后记：|第.+部分：)", line)
-        if part_match:
-            part_text = part_match.group(1).rstrip("：").rstrip(":")
-            link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-            if link_match:
-                label = link_match.group(1)
-                path = link_match.group(2)
-                current_part = part_text
-                current_section = None
-                chapters.append({
-                    "part": current_part,
-                    "section": None,
-                    "title": label,
-                    "file": path,
-                    "is_part_header": True,
-                })
-            else:
-                current_part = part_text
-                current_section = None
-            continue
+import profiling
+from book_model import ROOT_DIR, load_book
+from epub_split import (
+    DEFAULT_MAX_DOCUMENT_KB,
+    anchor_files,
+    max_document_size,
+    parse_document_kb,
+    split_chapter_html,
+)
+from epub_writer import EpubZipWriter, finish_epub, write_item
+from images import chapter_images, image_map, rewrite_image_srcs
+from render import default_jobs, render_chapters
+from zip_writer import COMPRESSED_EXTS
 
-        section_match = re.match(r"^\s*-\s+(.+?)$", line)
-        if section_match and "[" not in line:
-            current_section = section_match.group(1).strip()
-            continue
-
-        link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-        if link_match:
-            chapters.append({
-                "part": current_part,
-                "section": current_section,
-                "title": link_match.group(1),
-                "file": link_match.group(2),
-                "is_part_header": False,
-            })
-
-    return book_title, chapters
-
-
-def assign_chapter_numbers(chapters):
-    """为每个常规章节分配编号。前言、后记、致谢不编号。"""
-    num = 0
-    for ch in chapters:
-        basename = os.path.basename(ch["file"])
-        if basename in SPECIAL_FILES or ch.get("is_part_header"):
-            ch["chapter_num"] = None
-        elif ch["part"] and re.match(r"第.+部分", ch["part"]):
-            num += 1
-            ch["chapter_num"] = num
-        else:
-            ch["chapter_num"] = None
-
-
-def add_numbering_to_content(content, chapter_num):
-    """为章节内容的 h1、h2、h3 添加编号。"""
-    if chapter_num is None:
-        return content
-    h2_counter = 0
-    h3_counter = 0
-    lines = content.split("\n")
-    result = []
-    for line in lines:
-        if re.match(r"^# ", line):
-            line = re.sub(r"^# (.+)", f"# {chapter_num}. \\1", line)
-        elif re.match(r"^## ", line):
-            h2_counter += 1
-            h3_counter = 0
-            line = re.sub(r"^## (.+)", f"## {chapter_num}.{h2_counter} \\1", line)
-        elif re.match(r"^### ", line):
-            h3_counter += 1
-            line = re.sub(r"^### (.+)", f"### {chapter_num}.{h2_counter}.{h3_counter} \\1", line)
-        result.append(line)
-    return "\n".join(result)
-
-
-def extract_h2_headings(content):
-    """从 markdown 内容中提取 h2 标题列表（原始标题，不含编号）。"""
-    headings = []
-    for line in content.split("\n"):
-        match = re.match(r"^## (.+)", line)
-        if match:
-            headings.append(match.group(1).strip())
-    return headings
-
-
-def read_chapter(file_path):
-    """读取章节 markdown 内容。"""
-    full_path = os.path.join(ROOT_DIR, file_path)
-    if not os.path.exists(full_path):
-        print(f"  警告：文件不存在，跳过 {file_path}", file=sys.stderr)
-        return None
-    with open(full_path, "r", encoding="utf-8") as f:
-        return f.read()
-
-
-def extract_question(content, file_path):
-    """从章节内容中提取引导问题。"""
-    basename = os.path.basename(file_path)
-    if basename in SKIP_QUESTION_FILES:
-        return None, content
-
-    match = re.match(r"^(.+?)\n\n---\n", content, re.DOTALL)
-    if match:
-        question = match.group(1).strip()
-        body = content[match.end():]
-        return question, body
-
-    return None, content
-
-
-def mark_epigraphs(html_content):
-    """将紧跟在 <h1> 后面的连续 <blockquote> 标记为 epigraph。"""
-    return re.sub(
-        r'(</h1>\s*)((?:<blockquote>\s*.*?</blockquote>\s*)+)',
-        lambda m: m.group(1) + re.sub(
-            r'<blockquote>',
-            '<blockquote class="epigraph">',
-            m.group(2),
-        ),
-        html_content,
-        flags=re.DOTALL,
-    )
-
-
-def mark_image_captions(html_content):
-    """将图片说明段落（如"图 1-1 说明"）标记为 caption。"""
-    return re.sub(
-        r'(<p>)(图\s+\d+-\d+)',
-        r'<p class="img-caption">\2',
-        html_content,
-    )
+DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "output", "夹缝生长.epub")
 
 
-def collect_images(html_content, file_path):
-    """收集章节中引用的本地图片路径，返回 {原始src: 文件名} 映射。"""
-    images = {}
-    for match in re.finditer(r'src="([^"]+)"', html_content):
-        src = match.group(1)
-        if src.startswith(("http://", "https://")):
-            continue
-        chapter_dir = os.path.dirname(os.path.join(ROOT_DIR, file_path))
-        abs_path = os.path.abspath(os.path.join(chapter_dir, src))
-        if os.path.exists(abs_path):
-            filename = os.path.basename(abs_path)
-            images[src] = {"abs_path": abs_path, "filename": f"images/{filename}"}
-    return images
+MEDIA_TYPES = {
+    ".png": "image/png",
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".gif": "image/gif",
+    ".svg": "image/svg+xml",
+    ".webp": "image/webp",
+}
 
 
 def get_css():
@@ -402,11 +253,42 @@ def main():
         default=None,
         help="导出指定章节（按编号，如 --chapter 1）",
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="并行转换章节、处理图片的进程数 (默认: CPU 核数)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略并不写入 output/.cache 中的解析、渲染和图片缓存",
+    )
+    parser.add_argument(
+        "--low-memory",
+        action="store_true",
+        help="低内存模式：压缩队列中最多保留 jobs 个条目",
+    )
+    parser.add_argument(
+        "--split-chapters",
+        action="store_true",
+        help="把章节按 h2 小节拆成多个 XHTML 文档，便于阅读器快速打开长章节",
+    )
+    parser.add_argument(
+        "--max-document-kb",
+        type=parse_document_kb,
+        default=None,
+        help=f"拆分后单个文档的大小上限（KB），超过时再按段落拆开；"
+             f"指定时自动启用 --split-chapters (默认: {DEFAULT_MAX_DOCUMENT_KB})",
+    )
+    profiling.add_profile_arguments(parser)
     args = parser.parse_args()
+    profiling.start_from_args("export_epub", args)
 
     print("解析目录结构...")
-    book_title, chapters = parse_index()
-    assign_chapter_numbers(chapters)
+    with profiling.stage("index"):
+        model = load_book(use_cache=not args.no_cache)
+    book_title, chapters = model["title"], model["chapters"]
     print(f"  书名: {book_title}")
     print(f"  章节数: {len(chapters)}")
 
@@ -430,9 +312,50 @@ def main():
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
 
+    print("合并章节内容...")
+    with profiling.stage("render"):
+        rendered = render_chapters(chapters, use_cache=not args.no_cache, jobs=args.jobs)
+    export(book_title, chapters, rendered, args.output, single_chapter=args.chapter is not None,
+           use_cache=not args.no_cache, jobs=args.jobs, low_memory=args.low_memory,
+           max_document_size=max_document_size(args.split_chapters, args.max_document_kb))
+    profiling.finish()
+
+
+def export(book_title, chapters, rendered, output, single_chapter=False, use_cache=True, jobs=1,
+           low_memory=False, max_document_size=None):
+    """由已渲染的章节生成 EPUB。也供 build.py 在独立进程中调用。
+
+    各章节、图片在组装时就写入文件，由 jobs 个线程并行压缩（见 epub_writer.py）；
+    low_memory=True 时压缩队列更短，同一时刻内存中的条目更少。
+    max_document_size（字节）不为 None 时，章节按 h2 拆成多个不超过该大小的文档。
+    """
+    print("准备图片...")
+    with profiling.stage("images"):
+        image_paths = image_map(chapter_images(rendered), "epub", use_cache=use_cache, jobs=jobs)
+
+    print("生成 EPUB...")
+    with EpubZipWriter(output, jobs=jobs, max_pending=jobs if low_memory else None) as out:
+        with profiling.stage("assemble"):
+            book = build_epub(book_title, chapters, rendered, image_paths, out, single_chapter,
+                              max_document_size)
+        with profiling.stage("write"):
+            finish_epub(out, book)
+            out.close()
+    print(f"完成: {output}")
+
+
+def build_epub(book_title, chapters, rendered, image_paths, out, single_chapter=False,
+               max_document_size=None):
+    """构建 EpubBook，各章节和图片在组装时就写入 out（EpubZipWriter），之后不再保留内容；
+    返回的 EpubBook 用于生成目录和 content.opf（见 epub_writer.finish_epub()）。
+
+    image_paths 为 {原图路径: 衍生图路径}。图片按内容哈希命名（images/{哈希}.jpg），
+    内容相同的图片只存一份，不同目录下的同名图片也不会冲突。
+    max_document_size 不为 None 时，章节拆成多个文档（见 epub_split.py），
+    目录中的小节链接指向各自所在的文档。
+    """
     # 创建 EPUB
     book = epub.EpubBook()
-    book.set_identifier(str(uuid.uuid4()))
     book.set_title(book_title)
     book.set_language("zh-CN")
     book.add_author("吴鲁加")
@@ -445,33 +368,26 @@ def main():
         content=get_css(),
     )
     book.add_item(css)
+    write_item(out, book, css)
 
-    md_extensions = ["extra", "toc", "sane_lists", "smarty"]
     spine = ["nav"]
     toc = []
-    all_images = {}
+    image_names_by_path = {}  # {衍生图路径: EPUB 中的路径}
 
-    seen_parts = set()
-    seen_sections = set()
-    part_counter = 0
     current_toc_part = None
     current_toc_section = None
 
-    print("合并章节内容...")
-
     for ch in chapters:
-        content = read_chapter(ch["file"])
-        if content is None:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
             continue
 
-        chapter_num = ch.get("chapter_num")
-        chapter_id = os.path.splitext(os.path.basename(ch["file"]))[0]
+        chapter_num = ch["chapter_num"]
+        chapter_id = ch["chapter_id"]
 
         # 部分标题页（单章导出时跳过）
-        if args.chapter is None and ch["part"] and ch["part"] not in seen_parts:
-            seen_parts.add(ch["part"])
-            part_counter += 1
-            part_id = f"part-{part_counter}"
+        if not single_chapter and ch["new_part"]:
+            part_id = ch["part_id"]
 
             part_html = build_chapter_html(
                 ch["part"],
@@ -485,17 +401,16 @@ def main():
             part_item.set_content(part_html)
             part_item.add_item(css)
             book.add_item(part_item)
+            write_item(out, book, part_item)
             spine.append(part_item)
 
             current_toc_part = (epub.Link(f"{part_id}.xhtml", ch["part"], part_id), [])
             toc.append(current_toc_part)
             current_toc_section = None
-            seen_sections.clear()
 
         # 子分类标题页（单章导出时跳过）
-        if args.chapter is None and ch["section"] and ch["section"] not in seen_sections:
-            seen_sections.add(ch["section"])
-            section_id = f"section-{len(seen_sections)}-{part_counter}"
+        if not single_chapter and ch["new_section"]:
+            section_id = ch["section_id"]
 
             section_html = build_chapter_html(
                 ch["section"],
@@ -509,6 +424,7 @@ def main():
             section_item.set_content(section_html)
             section_item.add_item(css)
             book.add_item(section_item)
+            write_item(out, book, section_item)
             spine.append(section_item)
 
             current_toc_section = (
@@ -518,16 +434,8 @@ def main():
             if current_toc_part:
                 current_toc_part[1].append(current_toc_section)
 
-        # 提取引导问题
-        question, content = extract_question(content, ch["file"])
-
-        # 提取 h2 标题（在添加编号之前）
-        h2_headings = extract_h2_headings(content)
-
-        # 添加编号
-        content = add_numbering_to_content(content, chapter_num)
-
         # 问题页
+        question = chapter["question"]
         if question:
             q_id = f"question-{chapter_id}"
             q_html = build_chapter_html(
@@ -542,56 +450,58 @@ def main():
             q_item.set_content(q_html)
             q_item.add_item(css)
             book.add_item(q_item)
+            write_item(out, book, q_item)
             spine.append(q_item)
 
-        # 章节内容
-        html_content = markdown.markdown(content, extensions=md_extensions)
-        html_content = mark_epigraphs(html_content)
-        html_content = mark_image_captions(html_content)
-
-        # 为 h2 添加可链接的 ID
-        h2_idx = [0]
-
-        def replace_h2_tag(match, _idx=h2_idx, _cid=chapter_id):
-            _idx[0] += 1
-            return f'<h2 id="{_cid}-h2-{_idx[0]}">'
-
-        html_content = re.sub(r'<h2[^>]*>', replace_h2_tag, html_content)
-
-        # 收集并处理图片
-        images = collect_images(html_content, ch["file"])
-        for src, info in images.items():
-            epub_path = info["filename"]
-            if epub_path not in all_images:
-                all_images[epub_path] = info["abs_path"]
-            html_content = html_content.replace(f'src="{src}"', f'src="{epub_path}"')
-
-        # 构建显示标题
-        display_title = f"{chapter_num}. {ch['title']}" if chapter_num else ch["title"]
-
-        chapter_html = build_chapter_html(display_title, html_content)
-        chapter_item = epub.EpubHtml(
-            title=display_title,
-            file_name=f"{chapter_id}.xhtml",
-            lang="zh-CN",
-        )
-        chapter_item.set_content(chapter_html)
-        chapter_item.add_item(css)
-        book.add_item(chapter_item)
-        spine.append(chapter_item)
+        with profiling.stage("assemble", chapter=ch["file"]):
+            html_content = chapter["html"]
+
+            # 收集并处理图片（渲染时已记录本章引用的图片，打包 epub profile 的衍生图）
+            image_names = {}
+            for abs_path in chapter["images"]:
+                image_path = image_paths.get(abs_path)
+                if image_path is None:
+                    continue
+                if image_path not in image_names_by_path:
+                    image_names_by_path[image_path] = add_image(book, out, image_path)
+                image_names[abs_path] = image_names_by_path[image_path]
+            if image_names:
+                html_content = rewrite_image_srcs(html_content, image_names)
+
+            display_title = ch["display_title"]
+
+            if max_document_size is None:
+                documents = [(f"{chapter_id}.xhtml", html_content)]
+            else:
+                documents = split_chapter_html(chapter_id, html_content, max_document_size)
+            anchors = anchor_files(documents)
+
+            for file_name, body_html in documents:
+                chapter_html = build_chapter_html(display_title, body_html)
+                chapter_item = epub.EpubHtml(
+                    title=display_title,
+                    file_name=file_name,
+                    lang="zh-CN",
+                )
+                chapter_item.set_content(chapter_html)
+                chapter_item.add_item(css)
+                book.add_item(chapter_item)
+                write_item(out, book, chapter_item)
+                spine.append(chapter_item)
 
         # 构建目录条目（含 h2 子标题）
         chapter_link = epub.Link(f"{chapter_id}.xhtml", display_title, chapter_id)
 
         sub_links = []
-        if chapter_num and h2_headings:
-            for i, heading in enumerate(h2_headings, 1):
+        if chapter_num:
+            for i, heading in enumerate(ch["h2_headings"], 1):
                 sub_title = f"{chapter_num}.{i} {heading}"
+                anchor = f"{chapter_id}-h2-{i}"
                 sub_links.append(
                     epub.Link(
-                        f"{chapter_id}.xhtml#{chapter_id}-h2-{i}",
+                        f"{anchors.get(anchor, f'{chapter_id}.xhtml')}#{anchor}",
                         sub_title,
-                        f"{chapter_id}-h2-{i}",
+                        anchor,
                     )
                 )
 
@@ -609,36 +519,32 @@ def main():
         else:
             toc.append(chapter_entry)
 
-    # 添加图片到 EPUB
-    for epub_path, abs_path in all_images.items():
-        ext = os.path.splitext(abs_path)[1].lower()
-        media_types = {
-            ".png": "image/png",
-            ".jpg": "image/jpeg",
-            ".jpeg": "image/jpeg",
-            ".gif": "image/gif",
-            ".svg": "image/svg+xml",
-            ".webp": "image/webp",
-        }
-        media_type = media_types.get(ext, "application/octet-stream")
-        with open(abs_path, "rb") as f:
-            img_content = f.read()
-        img_item = epub.EpubItem(
-            file_name=epub_path,
-            media_type=media_type,
-            content=img_content,
-        )
-        book.add_item(img_item)
-
     # 设置目录和书脊
     book.toc = toc
     book.add_item(epub.EpubNcx())
     book.add_item(epub.EpubNav())
     book.spine = spine
+    return book
 
-    print("生成 EPUB...")
-    epub.write_epub(args.output, book)
-    print(f"完成: {args.output}")
+
+def add_image(book, out, image_path):
+    """读取图片，按内容哈希命名并写入 out，返回它在 EPUB 中的路径。
+
+    同样内容的图片已经写入过时只返回路径，不重复存储。
+    """
+    with open(image_path, "rb") as f:
+        content = f.read()
+    ext = os.path.splitext(image_path)[1].lower()
+    epub_path = f"images/{hashlib.sha256(content).hexdigest()[:16]}{ext}"
+    if book.get_item_with_href(epub_path) is None:
+        img_item = epub.EpubItem(
+            file_name=epub_path,
+            media_type=MEDIA_TYPES.get(ext, "application/octet-stream"),
+            content=content,
+        )
+        book.add_item(img_item)
+        write_item(out, book, img_item, compress=ext not in COMPRESSED_EXTS)
+    return epub_path
 
 
 if __name__ == "__main__":
@@ -3,315 +3,133 @@
 导出《夹缝生长》为 PDF。
 
 依赖安装：
-    pip install markdown weasyprint
+    pip install markdown weasyprint Pillow
 
 用法：
     python script/export_pdf.py
     python script/export_pdf.py -o output/my_book.pdf
     python script/export_pdf.py --chapter 1
+    python script/export_pdf.py --chapter 1,3,5-8   # 多个章节合为一个 PDF
+    python script/export_pdf.py --split             # 整本书排版一次，另按章节、部分拆分
+    python script/export_pdf.py --split --chapter 5-8
+    python script/export_pdf.py --images screen   # 屏幕版，图片 150 dpi
+    python script/export_pdf.py --preset ebook    # 轻量分发版：96 dpi 图片、WeasyPrint 图片优化
+    python script/export_pdf.py --preset ebook,print   # Markdown 只转换一次，依次输出两个版本
+    python script/export_pdf.py --fragments   # 按章节分片并行排版并缓存（需要 pypdf）
+    python script/export_pdf.py --profile     # 记录各阶段、各章节耗时（见 profiling.py）
 """
 
 import argparse
 import os
-import re
 import sys
+import tempfile
 
-import markdown
-from weasyprint import HTML
+import profiling
+from book_model import BOOK_DIR, ROOT_DIR, load_book
+from images import chapter_images, image_map, use_derivatives
+from render import default_jobs, render_chapters
 
-# 项目根目录
-ROOT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
-BOOK_DIR = os.path.join(ROOT_DIR, "book")
-INDEX_FILE = os.path.join(ROOT_DIR, "index.md")
 DEFAULT_OUTPUT = os.path.join(ROOT_DIR, "output", "夹缝生长.pdf")
 
-# 不需要问题页的文件（前言、后记等直接以标题开头）
-SKIP_QUESTION_FILES = {"restart.md", "crack.md", "flomo.md", "wuma.md", "scys.md", "acknowledgments.md"}
-
-# 不参与编号的特殊文件
-SPECIAL_FILES = {"restart.md", "crack.md", "acknowledgments.md"}
-
-
-def parse_index():
-    """从 index.md 解析书籍结构，返回章节列表。"""
-    with open(INDEX_FILE, "r", encoding="utf-8") as f:
-        content = f.read()
-
-    # 提取书名
-    title_match = re.search(r"^#\s+(.+)", content, re.MULTILINE)
-    book_title = title_match.group(1).strip() if title_match else "夹缝生长"
-
-    chapters = []
-    current_part = None
-    current_section = None
-
-    for line in content.split("\n"):
-        line = line.rstrip()
-
-        # 匹配部分标题：- 第一部分：xxx 或 - 前言：xxx 或 - 后记：xxx
-        part_match = re.match(r"^-\s+(第.+部分：.+|前言：|后记：|第.+部分：)", line)
-        if part_match:
-            part_text = part_match.group(1).rstrip("：").rstrip(":")
-            # 检查这一行本身是否包含链接
-            link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-            if link_match:
-                # 前言/后记这种自带链接的行
-                label = link_match.group(1)
-                path = link_match.group(2)
-                current_part = part_text
-                current_section = None
-                chapters.append({
-                    "part": current_part,
-                    "section": None,
-                    "title": label,
-                    "file": path,
-                    "is_part_header": True,
-                })
-            else:
-                current_part = part_text
-                current_section = None
-            continue
-
-        # 匹配子分类标题（不含链接）
-        section_match = re.match(r"^\s*-\s+(.+?)$", line)
-        if section_match and "[" not in line:
-            current_section = section_match.group(1).strip()
-            continue
-
-        # 匹配章节链接：  - [标题](path)
-        link_match = re.search(r"\[(.+?)\]\((.+?)\)", line)
-        if link_match:
-            chapters.append({
-                "part": current_part,
-                "section": current_section,
-                "title": link_match.group(1),
-                "file": link_match.group(2),
-                "is_part_header": False,
-            })
-
-    return book_title, chapters
-
-
-def assign_chapter_numbers(chapters):
-    """为每个常规章节分配编号。前言、后记、致谢不编号。"""
-    num = 0
-    for ch in chapters:
-        basename = os.path.basename(ch["file"])
-        if basename in SPECIAL_FILES or ch.get("is_part_header"):
-            ch["chapter_num"] = None
-        elif ch["part"] and re.match(r"第.+部分", ch["part"]):
-            num += 1
-            ch["chapter_num"] = num
-        else:
-            ch["chapter_num"] = None
-
-
-def add_numbering_to_content(content, chapter_num):
-    """为章节内容的 h1、h2、h3 添加编号。"""
-    if chapter_num is None:
-        return content
-    h2_counter = 0
-    h3_counter = 0
-    lines = content.split("\n")
-    result = []
-    for line in lines:
-        if re.match(r"^# ", line):
-            line = re.sub(r"^# (.+)", f"# {chapter_num}. \\1", line)
-        elif re.match(r"^## ", line):
-            h2_counter += 1
-            h3_counter = 0
-            line = re.sub(r"^## (.+)", f"## {chapter_num}.{h2_counter} \\1", line)
-        elif re.match(r"^### ", line):
-            h3_counter += 1
-            line = re.sub(r"^### (.+)", f"### {chapter_num}.{h2_counter}.{h3_counter} \\1", line)
-        result.append(line)
-    return "\n".join(result)
-
-
-def extract_h2_headings(content):
-    """从 markdown 内容中提取 h2 标题列表（原始标题，不含编号）。"""
-    headings = []
-    for line in content.split("\n"):
-        match = re.match(r"^## (.+)", line)
-        if match:
-            headings.append(match.group(1).strip())
-    return headings
-
-
-def read_chapter(file_path):
-    """读取章节 markdown 内容。"""
-    full_path = os.path.join(ROOT_DIR, file_path)
-    if not os.path.exists(full_path):
-        print(f"  警告：文件不存在，跳过 {file_path}", file=sys.stderr)
-        return None
-    with open(full_path, "r", encoding="utf-8") as f:
-        return f.read()
-
-
-def extract_question(content, file_path):
-    """从章节内容中提取引导问题。
-
-    大多数章节格式为：
-        问题文本
-        ---
-        # 标题
-        ...
-
-    返回 (question, body)，如果没有问题则返回 (None, content)。
-    """
-    basename = os.path.basename(file_path)
-    if basename in SKIP_QUESTION_FILES:
-        return None, content
-
-    # 匹配开头的问题 + --- 分隔线
-    match = re.match(r"^(.+?)\n\n---\n", content, re.DOTALL)
-    if match:
-        question = match.group(1).strip()
-        body = content[match.end():]
-        return question, body
-
-    return None, content
-
-
-def mark_epigraphs(html_content):
-    """将紧跟在 <h1> 后面的连续 <blockquote> 标记为 epigraph。"""
-    return re.sub(
-        r'(</h1>\s*)((?:<blockquote>\s*.*?</blockquote>\s*)+)',
-        lambda m: m.group(1) + re.sub(
-            r'<blockquote>',
-            '<blockquote class="epigraph">',
-            m.group(2),
-        ),
-        html_content,
-        flags=re.DOTALL,
-    )
-
-
-def mark_image_captions(html_content):
-    """将图片说明段落（如"图 1-1 说明"）标记为 caption。"""
-    return re.sub(
-        r'(<p>)(图\s+\d+-\d+)',
-        r'<p class="img-caption">\2',
-        html_content,
-    )
-
-
-def fix_image_paths(html_content, base_dir):
-    """将图片的相对路径转为绝对路径（file:// URI）。"""
-    def replace_src(match):
-        src = match.group(1)
-        if src.startswith(("http://", "https://", "file://")):
-            return match.group(0)
-        abs_path = os.path.abspath(os.path.join(base_dir, src))
-        return f'src="file://{abs_path}"'
-
-    return re.sub(r'src="([^"]+)"', replace_src, html_content)
-
-
-def build_html(book_title, chapters):
-    """将所有章节合并为完整 HTML。"""
-    md_extensions = ["extra", "toc", "sane_lists", "smarty"]
+# --images 的取值：印刷版、屏幕版、轻量版衍生图，或原图
+IMAGE_CHOICES = ("print", "screen", "ebook", "original")
+
+# --preset 的取值：衍生图（见 images.PROFILES）加上传给 WeasyPrint 的选项。
+#   dpi              嵌入图片的分辨率上限，超出的在写出时降采样（主要针对 --images original）
+#   optimize_images  写出时重新压缩图片；jpeg_quality 与衍生图一致，避免按 Pillow 默认的 75 重压
+#   hinting          保留字体的 hinting 信息，低分辨率屏幕上字形更清晰，文件略大
+# 印刷版用 WeasyPrint 的默认选项：图片原样嵌入，字体子集化。
+PDF_PRESETS = {
+    "screen": {
+        "images": "screen",
+        "options": {"dpi": 150, "optimize_images": True, "jpeg_quality": 80, "hinting": True},
+    },
+    "ebook": {
+        "images": "ebook",
+        "options": {"dpi": 96, "optimize_images": True, "jpeg_quality": 70},
+    },
+    "print": {
+        "images": "print",
+        "options": {},
+    },
+}
+
+
+def build_html(book_title, chapters, rendered, extra_css=""):
+    """将所有章节合并为完整 HTML。rendered 为 render_chapters() 的结果，extra_css 见 wrap_html()。
+    导出 PDF 时用 write_html() 逐章写入文件，这里供预览服务器等需要字符串的地方使用。"""
+    toc_items = build_toc_items(chapters, rendered)
+    body_parts = [
+        build_chapter_body(ch, rendered[ch["file"]])
+        for ch in chapters
+        if ch["file"] in rendered
+    ]
+
+    body = f"""
+{build_cover_html(book_title)}
+
+{build_toc_page_html(toc_items)}
 
+{"".join(body_parts)}
+"""
+    return wrap_html(book_title, body, extra_css)
+
+
+def write_html(path, book_title, chapters, rendered, extra_css=""):
+    """与 build_html() 相同的 HTML，逐章写入 path，内存中不拼出整本书的字符串。"""
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(html_head(book_title, extra_css))
+        f.write(f"\n{build_cover_html(book_title)}\n\n")
+        f.write(build_toc_page_html(build_toc_items(chapters, rendered)))
+        f.write("\n\n")
+        for ch in chapters:
+            chapter = rendered.get(ch["file"])
+            if chapter is not None:
+                f.write(build_chapter_body(ch, chapter))
+        f.write("\n")
+        f.write(HTML_TAIL)
+
+
+def build_toc_items(chapters, rendered):
+    """构建目录树：部分 -> 子分类 -> 章节 -> h2 子标题。"""
     toc_items = []
-    body_parts = []
-    part_counter = 0
-    seen_parts = set()
-    seen_sections = set()
 
     for ch in chapters:
-        content = read_chapter(ch["file"])
-        if content is None:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
             continue
 
-        chapter_num = ch.get("chapter_num")
-        chapter_id = os.path.splitext(os.path.basename(ch["file"]))[0]
+        chapter_num = ch["chapter_num"]
+        chapter_id = ch["chapter_id"]
 
-        # 在每个部分前插入部分标题页
-        if ch["part"] and ch["part"] not in seen_parts:
-            seen_parts.add(ch["part"])
-            part_counter += 1
-            part_id = f"part-{part_counter}"
+        if ch["new_part"]:
             toc_items.append({
                 "type": "part",
                 "title": ch["part"],
-                "id": part_id,
+                "id": ch["part_id"],
                 "children": [],
             })
-            body_parts.append(
-                f'<div class="part-page" id="{part_id}">'
-                f"<h1>{ch['part']}</h1>"
-                f"</div>"
-            )
-            seen_sections.clear()
 
-        # 子分类标题页（独立一页，大字居中）
-        if ch["section"] and ch["section"] not in seen_sections:
-            seen_sections.add(ch["section"])
-            section_id = f"section-{len(seen_sections)}-{part_counter}"
+        if ch["new_section"]:
             if toc_items and toc_items[-1]["type"] == "part":
                 toc_items[-1]["children"].append({
                     "type": "section",
                     "title": ch["section"],
-                    "id": section_id,
+                    "id": ch["section_id"],
                     "children": [],
                 })
-            body_parts.append(
-                f'<div class="section-page" id="{section_id}">'
-                f'<p class="section-page-title">{ch["section"]}</p>'
-                f'</div>'
-            )
-
-        # 提取引导问题
-        question, content = extract_question(content, ch["file"])
-
-        # 提取 h2 标题（在添加编号之前）
-        h2_headings = extract_h2_headings(content)
-
-        # 添加编号
-        content = add_numbering_to_content(content, chapter_num)
-
-        # 章节内容
-        html_content = markdown.markdown(content, extensions=md_extensions)
-        html_content = fix_image_paths(html_content, BOOK_DIR)
-        html_content = mark_epigraphs(html_content)
-        html_content = mark_image_captions(html_content)
-
-        # 为 h2 添加可链接的 ID
-        h2_idx = [0]
-
-        def replace_h2_tag(match, _idx=h2_idx, _cid=chapter_id):
-            _idx[0] += 1
-            return f'<h2 id="{_cid}-h2-{_idx[0]}">'
-
-        html_content = re.sub(r'<h2[^>]*>', replace_h2_tag, html_content)
-
-        # 插入问题页（独立一页，显示在章节正文之前）
-        if question:
-            body_parts.append(
-                f'<div class="question-page">'
-                f'<p class="question-text">{question}</p>'
-                f'</div>'
-            )
-
-        # 为章节的第一个 h1 替换 ID
-        html_content = re.sub(
-            r'<h1[^>]*>',
-            f'<h1 id="{chapter_id}">',
-            html_content,
-            count=1,
-        )
 
         # 构建目录条目
-        display_title = f"{chapter_num}. {ch['title']}" if chapter_num else ch["title"]
         chapter_entry = {
             "type": "chapter",
-            "title": display_title,
+            "title": ch["display_title"],
             "id": chapter_id,
             "subheadings": [],
         }
 
-        # 添加 h2 子标题到目录
-        if chapter_num and h2_headings:
+        # 添加 h2 子标题到目录（来自渲染结果的大纲，与正文编号一致）
+        if chapter_num:
+            h2_headings = [title for level, title in chapter["outline"] if level == 2]
             for i, heading in enumerate(h2_headings, 1):
                 chapter_entry["subheadings"].append({
                     "title": f"{chapter_num}.{i} {heading}",
@@ -328,100 +146,120 @@ def build_html(book_title, chapters):
         else:
             toc_items.append(chapter_entry)
 
-        body_parts.append(f'<div class="chapter">{html_content}</div>')
+    return toc_items
+
+
+def build_chapter_body(ch, chapter):
+    """构建一章的正文 HTML：部分标题页、子分类标题页、问题页和章节内容。"""
+    body_parts = []
+
+    # 在每个部分前插入部分标题页
+    if ch["new_part"]:
+        body_parts.append(
+            f'<div class="part-page" id="{ch["part_id"]}">'
+            f"<h1>{ch['part']}</h1>"
+            f"</div>"
+        )
 
-    # 构建目录 HTML
-    toc_html = build_toc_html(toc_items)
+    # 子分类标题页（独立一页，大字居中）
+    if ch["new_section"]:
+        body_parts.append(
+            f'<div class="section-page" id="{ch["section_id"]}">'
+            f'<p class="section-page-title">{ch["section"]}</p>'
+            f'</div>'
+        )
 
-    # 组装完整 HTML
-    html = f"""<!DOCTYPE html>
+    # 插入问题页（独立一页，显示在章节正文之前）
+    if chapter["question"]:
+        body_parts.append(
+            f'<div class="question-page" id="question-{ch["chapter_id"]}">'
+            f'<p class="question-text">{chapter["question"]}</p>'
+            f'</div>'
+        )
+
+    body_parts.append(f'<div class="chapter">{chapter["html"]}</div>')
+    return "".join(body_parts)
+
+
+def build_cover_html(book_title):
+    """封面页 HTML。"""
+    return f"""<div class="cover-page">
+    <h1 class="cover-title">{book_title}</h1>
+</div>"""
+
+
+def build_toc_page_html(toc_items, page_numbers=None):
+    """目录页 HTML。page_numbers 见 build_toc_html()。"""
+    return f"""<div class="toc-page">
+    <h1 class="toc-heading">目录</h1>
+    {build_toc_html(toc_items, page_numbers)}
+</div>"""
+
+
+def wrap_html(book_title, body, extra_css=""):
+    """将正文包装为完整的 HTML 文档。extra_css 追加在默认样式之后。"""
+    return html_head(book_title, extra_css) + body + HTML_TAIL
+
+
+def html_head(book_title, extra_css=""):
+    """HTML 文档中正文之前的部分（到 <body> 为止），见 wrap_html()。"""
+    return f"""<!DOCTYPE html>
 <html lang="zh-CN">
 <head>
 <meta charset="utf-8">
 <title>{book_title}</title>
 <style>
-{get_css()}
+{get_css()}{extra_css}
 </style>
 </head>
 <body>
+"""
 
-<div class="cover-page">
-    <h1 class="cover-title">{book_title}</h1>
-</div>
-
-<div class="toc-page">
-    <h1 class="toc-heading">目录</h1>
-    {toc_html}
-</div>
-
-{"".join(body_parts)}
 
+HTML_TAIL = """
 </body>
 </html>"""
 
-    return html
-
 
-def build_chapter_html_standalone(book_title, chapters):
+def build_chapter_html_standalone(book_title, chapters, rendered):
     """构建单个章节的 HTML（用于单章节导出）。"""
-    md_extensions = ["extra", "toc", "sane_lists", "smarty"]
-
     body_parts = []
 
     for ch in chapters:
-        content = read_chapter(ch["file"])
-        if content is None:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
             continue
 
-        chapter_num = ch.get("chapter_num")
-
-        # 提取引导问题
-        question, content = extract_question(content, ch["file"])
-
-        # 添加编号
-        content = add_numbering_to_content(content, chapter_num)
-
-        # 章节内容
-        html_content = markdown.markdown(content, extensions=md_extensions)
-        html_content = fix_image_paths(html_content, BOOK_DIR)
-        html_content = mark_epigraphs(html_content)
-        html_content = mark_image_captions(html_content)
-
         # 插入问题页
-        if question:
+        if chapter["question"]:
             body_parts.append(
                 f'<div class="question-page">'
-                f'<p class="question-text">{question}</p>'
+                f'<p class="question-text">{chapter["question"]}</p>'
                 f'</div>'
             )
 
-        body_parts.append(f'<div class="chapter">{html_content}</div>')
+        body_parts.append(f'<div class="chapter">{chapter["html"]}</div>')
+
+    return wrap_html(book_title, "".join(body_parts))
 
-    html = f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-<meta charset="utf-8">
-<title>{book_title}</title>
-<style>
-{get_css()}
-</style>
-</head>
-<body>
-{"".join(body_parts)}
-</body>
-</html>"""
 
-    return html
+def build_toc_html(toc_items, page_numbers=None):
+    """构建目录 HTML，包含章节编号和 h2 子标题。
 
+    默认由 CSS 的 target-counter() 生成页码；分片导出时整本书不在同一个文档中，
+    改为传入 page_numbers（{锚点 ID: 页码}），页码写在链接的 data-page 属性里。
+    """
+    def link(item):
+        page = ""
+        if page_numbers is not None and item["id"] in page_numbers:
+            page = f' data-page="{page_numbers[item["id"]]}"'
+        return f'<a href="#{item["id"]}"{page}>{item["title"]}</a>'
 
-def build_toc_html(toc_items):
-    """构建目录 HTML，包含章节编号和 h2 子标题。"""
     lines = ['<nav class="toc">']
     for item in toc_items:
         if item["type"] == "part":
             lines.append(
-                f'<div class="toc-part">'
-                f'<a href="#{item["id"]}">{item["title"]}</a>'
+                f'<div class="toc-part">{link(item)}'
             )
             for child in item.get("children", []):
                 if child["type"] == "section":
@@ -430,40 +268,28 @@ def build_toc_html(toc_items):
                     )
                     for ch in child.get("children", []):
                         lines.append(
-                            f'<div class="toc-chapter">'
-                            f'<a href="#{ch["id"]}">{ch["title"]}</a>'
-                            f"</div>"
+                            f'<div class="toc-chapter">{link(ch)}</div>'
                         )
                         for sub in ch.get("subheadings", []):
                             lines.append(
-                                f'<div class="toc-subheading">'
-                                f'<a href="#{sub["id"]}">{sub["title"]}</a>'
-                                f"</div>"
+                                f'<div class="toc-subheading">{link(sub)}</div>'
                             )
                 elif child["type"] == "chapter":
                     lines.append(
-                        f'<div class="toc-chapter">'
-                        f'<a href="#{child["id"]}">{child["title"]}</a>'
-                        f"</div>"
+                        f'<div class="toc-chapter">{link(child)}</div>'
                     )
                     for sub in child.get("subheadings", []):
                         lines.append(
-                            f'<div class="toc-subheading">'
-                            f'<a href="#{sub["id"]}">{sub["title"]}</a>'
-                            f"</div>"
+                            f'<div class="toc-subheading">{link(sub)}</div>'
                         )
             lines.append("</div>")
         elif item["type"] == "chapter":
             lines.append(
-                f'<div class="toc-chapter toc-top">'
-                f'<a href="#{item["id"]}">{item["title"]}</a>'
-                f"</div>"
+                f'<div class="toc-chapter toc-top">{link(item)}</div>'
             )
             for sub in item.get("subheadings", []):
                 lines.append(
-                    f'<div class="toc-subheading toc-top-sub">'
-                    f'<a href="#{sub["id"]}">{sub["title"]}</a>'
-                    f"</div>"
+                    f'<div class="toc-subheading toc-top-sub">{link(sub)}</div>'
                 )
     lines.append("</nav>")
     return "\n".join(lines)
@@ -779,6 +605,111 @@ th {
 """
 
 
+def parse_chapter_numbers(value):
+    """解析 --chapter 参数：编号、列表和范围，如 "3"、"1,3,5-8"。返回排好序的编号列表。"""
+    numbers = set()
+    for item in value.split(","):
+        item = item.strip()
+        if not item:
+            continue
+        first, sep, last = item.partition("-")
+        try:
+            first = int(first)
+            last = int(last) if sep else first
+        except ValueError:
+            raise argparse.ArgumentTypeError(f"无效的章节编号: {item}") from None
+        if first > last:
+            raise argparse.ArgumentTypeError(f"无效的章节范围: {item}")
+        numbers.update(range(first, last + 1))
+    if not numbers:
+        raise argparse.ArgumentTypeError("至少指定一个章节")
+    return sorted(numbers)
+
+
+def format_chapter_numbers(numbers):
+    """parse_chapter_numbers() 的逆操作：[1, 3, 5, 6, 7] -> "1,3,5-7"。"""
+    items = []
+    for n in numbers:
+        if items and items[-1][1] == n - 1:
+            items[-1][1] = n
+        else:
+            items.append([n, n])
+    return ",".join(str(a) if a == b else f"{a}-{b}" for a, b in items)
+
+
+def parse_presets(value):
+    """解析 --preset 参数，如 "ebook,print"。"""
+    presets = []
+    for preset in value.split(","):
+        preset = preset.strip()
+        if preset not in PDF_PRESETS:
+            raise argparse.ArgumentTypeError(
+                f"不支持的 preset: {preset}（可选: {', '.join(PDF_PRESETS)}）"
+            )
+        if preset not in presets:
+            presets.append(preset)
+    return presets
+
+
+def preset_output(output, preset):
+    """按 preset 区分的输出路径：output/夹缝生长.pdf -> output/夹缝生长-ebook.pdf"""
+    stem, ext = os.path.splitext(output)
+    return f"{stem}-{preset}{ext}"
+
+
+def format_size(size):
+    return f"{size / 1e6:.1f} MB" if size >= 1e5 else f"{size / 1e3:.0f} KB"
+
+
+def split_ranges(chapters, rendered, first_pages, page_count, output, numbers=None):
+    """按章节、部分划分整本书的页码范围，返回 [(输出路径, 起始页序号, 结束页序号)]。
+
+    first_pages 为 {锚点 ID: 所在页序号}，页序号从 0 开始，结束页序号不含。
+    每章从问题页（没有问题页时从章节标题）开始，每个部分从部分标题页开始，
+    都到下一个章节、子分类或部分之前为止。输出写在 output 同名目录下的
+    chapters/、parts/ 中；numbers 为章节编号列表时只拆出这些章节，不拆部分。
+    """
+    # 每章一组页面：部分标题页、子分类标题页、问题页、正文。下一组的第一页即本章的结束
+    blocks = []  # [(章节, 本组起始页, 本章起始页)]
+    for ch in chapters:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
+            continue
+        question_id = f"question-{ch['chapter_id']}" if chapter["question"] else None
+        anchors = [
+            ch["part_id"] if ch["new_part"] else None,
+            ch["section_id"] if ch["new_section"] else None,
+            question_id,
+            ch["chapter_id"],
+        ]
+        pages = [first_pages[name] for name in anchors if name in first_pages]
+        if not pages:
+            continue
+        start = first_pages.get(question_id, first_pages.get(ch["chapter_id"], pages[0]))
+        blocks.append((ch, pages[0], start))
+    ends = [block_start for _, block_start, _ in blocks[1:]] + [page_count]
+
+    base_dir = os.path.splitext(output)[0]
+    ranges = []
+    for (ch, _, start), end in zip(blocks, ends):
+        if numbers is not None and ch["chapter_num"] not in numbers:
+            continue
+        prefix = f"{ch['chapter_num']:02d}-" if ch["chapter_num"] else ""
+        path = os.path.join(base_dir, "chapters", f"{prefix}{ch['title']}.pdf")
+        ranges.append((path, start, end))
+
+    if numbers is None:
+        parts = [(ch, block_start) for ch, block_start, _ in blocks if ch["new_part"]]
+        part_ends = [start for _, start in parts[1:]] + [page_count]
+        for i, ((ch, start), end) in enumerate(zip(parts, part_ends), 1):
+            path = os.path.join(base_dir, "parts", f"{i:02d}-{ch['part']}.pdf")
+            ranges.append((path, start, end))
+
+    for path, _, _ in ranges:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+    return ranges
+
+
 def main():
     parser = argparse.ArgumentParser(description="导出《夹缝生长》为 PDF")
     parser.add_argument(
@@ -788,38 +719,85 @@ def main():
     )
     parser.add_argument(
         "--chapter",
-        type=int,
+        type=parse_chapter_numbers,
         default=None,
-        help="导出指定章节（按编号，如 --chapter 1）",
+        help="导出指定章节（按编号，可为列表和范围，如 --chapter 1 或 --chapter 1,3,5-8）",
     )
     parser.add_argument(
         "--html",
         action="store_true",
         help="同时保存中间 HTML 文件",
     )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="并行转换（分片模式下也并行排版）章节的进程数 (默认: CPU 核数)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略并不写入 output/.cache 中的解析、渲染和图片缓存",
+    )
+    parser.add_argument(
+        "--images",
+        choices=IMAGE_CHOICES,
+        default=None,
+        help="图片质量：print 300 dpi、screen 150 dpi、ebook 96 dpi、original 原图 "
+             "(默认: print，或 --preset 对应的图片)",
+    )
+    parser.add_argument(
+        "--preset",
+        type=parse_presets,
+        default=None,
+        help=f"输出版本：{'、'.join(PDF_PRESETS)}，逗号分隔可一次输出多个版本，"
+             "文件名加上版本后缀（如 夹缝生长-ebook.pdf）",
+    )
+    parser.add_argument(
+        "--fragments",
+        action="store_true",
+        help="按章节分片并行排版并缓存，只重排修改过的章节（需要 pypdf）",
+    )
+    parser.add_argument(
+        "--split",
+        action="store_true",
+        help="整本书只排版一次，另按页码范围拆出每章、每个部分的 PDF（页码与整本书一致）；"
+             "与 --chapter 同用时只拆出指定章节",
+    )
+    profiling.add_profile_arguments(parser)
     args = parser.parse_args()
+    profiling.start_from_args("export_pdf", args)
 
     print("解析目录结构...")
-    book_title, chapters = parse_index()
-    assign_chapter_numbers(chapters)
+    with profiling.stage("index"):
+        book = load_book(use_cache=not args.no_cache)
+    book_title, chapters = book["title"], book["chapters"]
     print(f"  书名: {book_title}")
     print(f"  章节数: {len(chapters)}")
 
-    # 按章节过滤
+    # 只有一个 preset 且指定了 -o 时原样使用，否则按 preset 加后缀，各版本互不覆盖
+    suffix_presets = args.preset is not None and (args.output is None or len(args.preset) > 1)
+
+    # 按章节过滤（--split 时整本书照常排版，只拆出指定章节）
     if args.chapter is not None:
-        target = [ch for ch in chapters if ch.get("chapter_num") == args.chapter]
-        if not target:
-            print(f"错误：找不到第 {args.chapter} 章", file=sys.stderr)
+        target = [ch for ch in chapters if ch.get("chapter_num") in args.chapter]
+        missing = sorted(set(args.chapter) - {ch["chapter_num"] for ch in target})
+        if missing:
+            print(f"错误：找不到第 {format_chapter_numbers(missing)} 章", file=sys.stderr)
             sys.exit(1)
+        for ch in target:
+            print(f"  导出章节: {ch['chapter_num']}. {ch['title']}")
+    if args.chapter is not None and not args.split:
         chapters = target
-        ch = target[0]
         if args.output is None:
             output_dir = os.path.join(ROOT_DIR, "output")
-            args.output = os.path.join(output_dir, f"{args.chapter:02d}-{ch['title']}.pdf")
-        print(f"  导出章节: {args.chapter}. {ch['title']}")
-    else:
-        if args.output is None:
-            args.output = DEFAULT_OUTPUT
+            if len(target) == 1:
+                name = f"{target[0]['chapter_num']:02d}-{target[0]['title']}.pdf"
+            else:
+                name = f"第{format_chapter_numbers(args.chapter)}章.pdf"
+            args.output = os.path.join(output_dir, name)
+    elif args.output is None:
+        args.output = DEFAULT_OUTPUT
 
     # 确保输出目录存在
     output_dir = os.path.dirname(args.output)
@@ -827,20 +805,135 @@ def main():
         os.makedirs(output_dir, exist_ok=True)
 
     print("合并章节内容...")
-    if args.chapter is not None:
-        html = build_chapter_html_standalone(book_title, chapters)
-    else:
-        html = build_html(book_title, chapters)
-
-    if args.html:
-        html_path = args.output.rsplit(".", 1)[0] + ".html"
-        with open(html_path, "w", encoding="utf-8") as f:
-            f.write(html)
-        print(f"  HTML 已保存: {html_path}")
-
-    print("生成 PDF...")
-    HTML(string=html, base_url=BOOK_DIR).write_pdf(args.output)
-    print(f"完成: {args.output}")
+    with profiling.stage("render"):
+        rendered = render_chapters(chapters, use_cache=not args.no_cache, jobs=args.jobs)
+
+    if args.preset is None:
+        export(book_title, chapters, rendered, args.output,
+               single_chapter=args.chapter is not None and not args.split, save_html=args.html,
+               fragments=args.fragments, use_cache=not args.no_cache, jobs=args.jobs,
+               images=args.images or "print", split=args.split, split_chapters=args.chapter)
+        profiling.finish()
+        return
+
+    # 多个版本共用同一份解析和渲染结果；图片不同，排版要各做一次
+    outputs = []
+    for preset in args.preset:
+        settings = PDF_PRESETS[preset]
+        output = preset_output(args.output, preset) if suffix_presets else args.output
+        print(f"[{preset}]")
+        with profiling.stage(f"preset:{preset}"):
+            export(book_title, chapters, rendered, output,
+                   single_chapter=args.chapter is not None and not args.split,
+                   save_html=args.html, fragments=args.fragments,
+                   use_cache=not args.no_cache, jobs=args.jobs,
+                   images=args.images or settings["images"], split=args.split,
+                   split_chapters=args.chapter, options=settings["options"])
+        outputs.append((preset, output))
+    if len(outputs) > 1:
+        print("各版本大小:")
+        for preset, output in outputs:
+            print(f"  {preset:<8} {format_size(os.path.getsize(output)):>9}  {output}")
+    profiling.finish()
+
+
+def export(book_title, chapters, rendered, output, single_chapter=False, save_html=False,
+           fragments=False, use_cache=True, jobs=1, images="print", split=False,
+           split_chapters=None, options=None):
+    """由已渲染的章节生成 PDF。也供 build.py 在独立进程中调用。
+
+    fragments=True 时整本书按章节分片、用 jobs 个进程并行排版（见 pdf_fragments.py），
+    单章导出不受影响。images 为 IMAGE_CHOICES 之一，决定嵌入哪种衍生图；options 为
+    传给 WeasyPrint 排版和写出的选项（见 PDF_PRESETS），默认为 WeasyPrint 的默认值。
+
+    split=True 时在整本书之外，按页码范围从同一次排版中拆出每章、每个部分的 PDF
+    （见 split_ranges()），页码与整本书一致；split_chapters 为章节编号列表时只拆这些章节。
+
+    中间 HTML 逐章写入文件（save_html 时即保存的 HTML 文件，否则为临时文件），
+    WeasyPrint 从文件读取：内存中不拼出整本书的 HTML，--html 的文件在排版开始前
+    就已写好，可以先打开预览。
+    """
+    options = options or {}
+    if images != "original":
+        print("准备图片...")
+        with profiling.stage("images"):
+            image_paths = image_map(
+                chapter_images(rendered), f"pdf-{images}", use_cache=use_cache, jobs=jobs,
+            )
+        rendered = use_derivatives(rendered, image_paths)
+
+    html_path = output.rsplit(".", 1)[0] + ".html" if save_html else None
+
+    if fragments and not single_chapter:
+        # 分片各自排版，只在 --html 时写出整本书的 HTML
+        if html_path:
+            with profiling.stage("html"):
+                write_html(html_path, book_title, chapters, rendered)
+            print(f"  HTML 已保存: {html_path}")
+        from pdf_fragments import export_fragments, split_pdf
+        first_pages, page_count = export_fragments(
+            book_title, chapters, rendered, output, use_cache=use_cache, jobs=jobs,
+            options=options,
+        )
+        _print_done(output)
+        if split:
+            ranges = split_ranges(chapters, rendered, first_pages, page_count, output,
+                                  split_chapters)
+            with profiling.stage("split"):
+                split_pdf(output, ranges)
+            _print_split(output, ranges)
+        return
+
+    temporary = html_path is None
+    if temporary:
+        fd, html_path = tempfile.mkstemp(suffix=".html")
+        os.close(fd)
+    try:
+        with profiling.stage("html"):
+            if single_chapter:
+                with open(html_path, "w", encoding="utf-8") as f:
+                    f.write(build_chapter_html_standalone(book_title, chapters, rendered))
+            else:
+                write_html(html_path, book_title, chapters, rendered)
+        if save_html:
+            print(f"  HTML 已保存: {html_path}")
+
+        # 在这里才导入：serve.py 等只用到上面的 HTML 构建函数，不需要 WeasyPrint
+        from weasyprint import HTML
+
+        print("生成 PDF...")
+        with profiling.stage("layout"):
+            document = HTML(filename=html_path, base_url=BOOK_DIR).render(**options)
+        with profiling.stage("write"):
+            document.write_pdf(output, **options)
+        _print_done(output)
+
+        if split:
+            first_pages = {}
+            for index, page in enumerate(document.pages):
+                for name in page.anchors:
+                    first_pages.setdefault(name, index)
+            ranges = split_ranges(chapters, rendered, first_pages, len(document.pages), output,
+                                  split_chapters)
+            with profiling.stage("split"):
+                for path, start, end in ranges:
+                    document.copy(document.pages[start:end]).write_pdf(path, **options)
+            _print_split(output, ranges)
+    finally:
+        if temporary:
+            os.remove(html_path)
+
+
+def _print_done(output):
+    print(f"完成: {output}（{format_size(os.path.getsize(output))}）")
+
+
+def _print_split(output, ranges):
+    total = sum(os.path.getsize(path) for path, _, _ in ranges)
+    print(f"拆分: {len(ranges)} 个文件，共 {format_size(total)} -> {os.path.splitext(output)[0]}/")
+    for path, start, end in ranges:
+        print(f"  {os.path.relpath(path, os.path.dirname(output))}  第 {start + 1}-{end} 页  "
+              f"{format_size(os.path.getsize(path))}")
 
 
 if __name__ == "__main__":
@@ -6,125 +6,309 @@
 1. 左引号用了 U+201D（"）而非 U+201C（"），导致开口闭口方向一样
 2. 中文语境下误用了英文直引号（"）
 
+扫描只在引号处停下：用正则定位每行中的三种引号，直引号前后是否为中文语境
+查预先生成的字符类查找表；改动的行在扫描时顺带记录，不再事后逐行比对。
+各文件互不依赖，文本量大时分发到多个进程并行处理，结果按目录顺序输出。
+
+检查通过（无需修改且引号配对）的文件记录在 output/.cache/fix_quotes.json，
+键为文件的 mtime/大小 和内容哈希。--changed 只检查上次通过之后修改过的文件，
+--staged 只检查 git 暂存区中的章节文件，检查的是暂存区中的内容（即将提交的版本，
+而不是工作区中的文件），适合放在 pre-commit 钩子中。--staged 只能与 --check 一起用：
+修复只能写回工作区，不能代替重新暂存。
+
+    python script/fix_quotes.py --check --staged
+
+退出码：0 没有问题；1 有需要修复的引号（--check）或引号不配对；2 运行出错。
+
 用法：
-    python script/fix_quotes.py          # 修复并写入文件
-    python script/fix_quotes.py --check  # 仅检查，不修改
+    python script/fix_quotes.py                    # 修复并写入文件
+    python script/fix_quotes.py --check            # 仅检查，不修改
+    python script/fix_quotes.py --check --changed  # 只检查上次通过后修改过的文件
+    python script/fix_quotes.py --check --staged   # 只检查 git 暂存的文件
+    python script/fix_quotes.py -j 1               # 单进程
+    python script/fix_quotes.py --check --profile  # 记录逐个文件的耗时（见 profiling.py）
 """
 import argparse
+import hashlib
+import json
 import os
 import re
 import sys
 
+import profiling
+from book_model import CACHE_DIR, ROOT_DIR
 
-def fix_chinese_quotes(filepath, dry_run=False):
-    with open(filepath, "r") as f:
-        content = f.read()
+LEFT_QUOTE = "\u201c"
+RIGHT_QUOTE = "\u201d"
+
+QUOTE_RE = re.compile('["\u201c\u201d]')
+
+# 中文字符、CJK 标点、全角字符
+CJK_RANGES = ((0x4E00, 0x9FFF), (0x3000, 0x303F), (0xFF00, 0xFFEF))
+
+# 检查规则变化时递增，使状态文件中记录的"已通过"失效
+STATE_VERSION = 1
+
+STATE_FILE = os.path.join(CACHE_DIR, "fix_quotes.json")
+
+EXIT_OK = 0
+EXIT_PROBLEMS = 1
+EXIT_ERROR = 2
 
-    original = content
+# 文本总量小于此值时单进程处理：全书约 0.6 MB，扫描只要十几毫秒，
+# 启动进程池反而更慢
+POOL_MIN_BYTES = 4 * 1024 * 1024
+
+# 查找表覆盖基本多文种平面，之外的字符都不算中文语境
+TABLE_SIZE = 0x10000
+
+
+def _context_table(punctuation):
+    """生成查找表：table[ord(c)] 为真表示 c 属于中文语境。"""
+    table = bytearray(TABLE_SIZE)
+    for start, end in CJK_RANGES:
+        table[start:end + 1] = b"\x01" * (end - start + 1)
+    for c in punctuation:
+        table[ord(c)] = 1
+    return bytes(table)
+
+
+# 直引号前一个字符 / 后一个字符为中文语境时，视为中文引号
+CONTEXT_BEFORE = _context_table("，。；：、—…）】》")
+CONTEXT_AFTER = _context_table("，。；：、—…（【《")
+
+
+def fix_line(line, quote_depth):
+    """修复一行中的引号，返回 (修复后的行, 新的引号深度)。未改动时原样返回 line。"""
+    pieces = []
+    last = 0
+    for m in QUOTE_RE.finditer(line):
+        i = m.start()
+        c = line[i]
+        if c == LEFT_QUOTE:
+            quote_depth += 1
+            continue
+        if c == RIGHT_QUOTE:
+            if quote_depth > 0:
+                quote_depth -= 1
+                continue
+            # 没有未闭合的左引号，应为左引号
+            new = LEFT_QUOTE
+            quote_depth += 1
+        else:
+            # 直引号：前后字符都不是中文语境时保持不变
+            prev_code = ord(line[i - 1]) if i > 0 else TABLE_SIZE
+            next_code = ord(line[i + 1]) if i + 1 < len(line) else TABLE_SIZE
+            if not (
+                (prev_code < TABLE_SIZE and CONTEXT_BEFORE[prev_code])
+                or (next_code < TABLE_SIZE and CONTEXT_AFTER[next_code])
+            ):
+                continue
+            if quote_depth <= 0:
+                new = LEFT_QUOTE
+                quote_depth += 1
+            else:
+                new = RIGHT_QUOTE
+                quote_depth -= 1
+        pieces.append(line[last:i])
+        pieces.append(new)
+        last = i + 1
+
+    if not pieces:
+        return line, quote_depth
+    pieces.append(line[last:])
+    return "".join(pieces), quote_depth
+
+
+def fix_text(content):
+    """修复全文的引号，返回 (修复后的文本, [(行号, 修复后的行), ...])。
+
+    代码块内不处理；引号深度跨行累计（引号内的段落可以换行）。
+    """
     lines = content.split("\n")
-    fixed_lines = []
+    changes = []
     in_code_block = False
     quote_depth = 0
 
-    for line in lines:
+    for idx, line in enumerate(lines):
         if line.strip().startswith("```"):
             in_code_block = not in_code_block
-            fixed_lines.append(line)
             continue
-
         if in_code_block:
-            fixed_lines.append(line)
             continue
+        fixed, quote_depth = fix_line(line, quote_depth)
+        if fixed is not line:
+            lines[idx] = fixed
+            changes.append((idx + 1, fixed))
 
-        chars = list(line)
-        i = 0
-        while i < len(chars):
-            c = chars[i]
+    if not changes:
+        return content, changes
+    return "\n".join(lines), changes
 
-            if c == "\u201c":  # correct left quote
-                quote_depth += 1
-            elif c == "\u201d":  # right quote - but should it be left?
-                if quote_depth <= 0:
-                    chars[i] = "\u201c"
-                    quote_depth += 1
-                else:
-                    quote_depth -= 1
-            elif c == '"':  # straight double quote
-                prev_char = chars[i - 1] if i > 0 else "\n"
-                next_char = chars[i + 1] if i + 1 < len(chars) else "\n"
-
-                is_chinese_context = False
-                if prev_char and re.match(
-                    r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", prev_char
-                ):
-                    is_chinese_context = True
-                if next_char and re.match(
-                    r"[\u4e00-\u9fff\u3000-\u303f\uff00-\uffef]", next_char
-                ):
-                    is_chinese_context = True
-                if prev_char in "，。；：、—…）】》":
-                    is_chinese_context = True
-                if next_char in "，。；：、—…（【《":
-                    is_chinese_context = True
-
-                if is_chinese_context:
-                    if quote_depth <= 0:
-                        chars[i] = "\u201c"
-                        quote_depth += 1
-                    else:
-                        chars[i] = "\u201d"
-                        quote_depth -= 1
-
-            i += 1
-
-        fixed_lines.append("".join(chars))
-
-    result = "\n".join(fixed_lines)
-
-    if result != original:
-        changes = []
-        orig_lines = original.split("\n")
-        res_lines = result.split("\n")
-        for idx, (ol, rl) in enumerate(zip(orig_lines, res_lines), 1):
-            if ol != rl:
-                changes.append(f"  L{idx}: {rl.strip()[:120]}")
 
+def fix_file(filepath, dry_run=False, staged=False):
+    """修复单个文件，返回 (改动行数, 是否通过, 报告)。
+
+    引号不配对时改动行数为 -1（有改动时仍为改动行数）；修复后（或 dry_run 时
+    无需修改）且引号配对即为通过。报告为要打印的文本，无需报告时为 None。
+    staged=True 时检查 git 暂存区中的内容，须与 dry_run 一起使用。
+    也在工作进程中运行。
+    """
+    content = read_text(filepath, staged)
+
+    result, changes = fix_text(content)
+
+    left = result.count(LEFT_QUOTE)
+    right = result.count(RIGHT_QUOTE)
+    passed = left == right and not (changes and dry_run)
+
+    if changes:
         if not dry_run:
             with open(filepath, "w") as f:
                 f.write(result)
 
-        left = result.count("\u201c")
-        right = result.count("\u201d")
         balance = "BALANCED" if left == right else f"UNBALANCED left={left} right={right}"
         action = "would fix" if dry_run else "fixed"
 
-        print(f"\n=== {filepath} ({len(changes)} lines {action}, {balance}) ===")
-        for c in changes[:20]:
-            print(c)
+        report = [f"\n=== {filepath} ({len(changes)} lines {action}, {balance}) ==="]
+        for idx, line in changes[:20]:
+            report.append(f"  L{idx}: {line.strip()[:120]}")
         if len(changes) > 20:
-            print(f"  ... and {len(changes) - 20} more")
-        return len(changes)
+            report.append(f"  ... and {len(changes) - 20} more")
+        return len(changes), passed, "\n".join(report)
+
+    if left != right:
+        return -1, passed, f"\n=== {filepath} (UNBALANCED left={left} right={right}) ==="
+    return 0, passed, None
+
+
+def fix_chinese_quotes(filepath, dry_run=False):
+    """修复单个文件并打印报告，返回改动行数（引号不配对时为 -1）。"""
+    n, _, report = fix_file(filepath, dry_run)
+    if report:
+        print(report)
+    return n
+
+
+def fix_files(filepaths, dry_run=False, jobs=1, staged=False):
+    """并行修复多个文件，按 filepaths 的顺序返回 fix_file() 的结果列表。"""
+    return map_files(fix_file, filepaths, jobs, dry_run, staged)
+
+
+def read_text(filepath, staged=False, project_root=ROOT_DIR):
+    """读取文件内容；staged=True 时读取 git 暂存区中的版本。"""
+    if not staged:
+        with open(filepath, "r") as f:
+            return f.read()
+    import subprocess
+
+    rel_path = os.path.relpath(filepath, project_root).replace(os.sep, "/")
+    blob = subprocess.run(
+        ["git", "show", f":./{rel_path}"],
+        cwd=project_root,
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+    # 与文本模式读取文件一样统一换行符
+    return blob.decode("utf-8").replace("\r\n", "\n")
+
+
+def map_files(func, filepaths, jobs=1, *args):
+    """对每个文件调用 func(文件路径, *args)，按 filepaths 的顺序返回结果列表。
+
+    文本总量小于 POOL_MIN_BYTES 时不启动进程池。func 需可在工作进程中运行。
+    --profile 时逐个文件记录耗时，阶段名为 func 的函数名。
+    """
+    name, func = func.__name__, profiling.wrap(func)
+    if (
+        jobs > 1
+        and len(filepaths) > 1
+        and sum(os.path.getsize(fpath) for fpath in filepaths) >= POOL_MIN_BYTES
+    ):
+        # 在这里才导入：进程池模块的导入开销与检查整本书相当，钩子中通常用不到
+        from concurrent.futures import ProcessPoolExecutor
+
+        workers = min(jobs, len(filepaths))
+        chunksize = max(1, len(filepaths) // (workers * 4))
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(
+                func, filepaths, *([arg] * len(filepaths) for arg in args),
+                chunksize=chunksize,
+            ))
     else:
-        left = result.count("\u201c")
-        right = result.count("\u201d")
-        if left != right:
-            print(f"\n=== {filepath} (UNBALANCED left={left} right={right}) ===")
-            return -1
-        return 0
+        results = [func(fpath, *args) for fpath in filepaths]
+    return profiling.unwrap(name, filepaths, results)
 
 
-def main():
-    parser = argparse.ArgumentParser(description="修复全书中文双引号方向")
-    parser.add_argument("--check", action="store_true", help="仅检查，不修改文件")
-    args = parser.parse_args()
+def load_state(path=STATE_FILE, version=STATE_VERSION):
+    """读取上次运行的状态：{相对路径: [mtime_ns, 大小, sha1]}，只含检查通过的文件。"""
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            state = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    if state.get("version") != version or state.get("root") != ROOT_DIR:
+        return {}
+    return state["files"]
+
+
+def save_state(files, path=STATE_FILE, version=STATE_VERSION):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump({"version": version, "root": ROOT_DIR, "files": files}, f)
+    os.replace(tmp_path, path)
+
+
+def file_stamp(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    st = os.stat(path)
+    return [st.st_mtime_ns, st.st_size, hashlib.sha1(data).hexdigest()]
+
+
+def is_unchanged(path, stamp):
+    """文件是否与上次通过时相同：mtime/大小 一致，或内容哈希一致（如 git checkout、touch）。"""
+    try:
+        st = os.stat(path)
+    except OSError:
+        return False
+    mtime_ns, size, digest = stamp
+    if st.st_mtime_ns == mtime_ns and st.st_size == size:
+        return True
+    if st.st_size != size:
+        return False
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest() == digest
+
+
+def staged_files(project_root):
+    """git 暂存区中新增或修改的文件（绝对路径），读取失败时返回 None。"""
+    import subprocess
+
+    try:
+        output = subprocess.run(
+            ["git", "diff", "--cached", "--name-only", "--relative", "--diff-filter=ACMR", "-z"],
+            cwd=project_root,
+            stdout=subprocess.PIPE,
+            check=True,
+        ).stdout
+    except (OSError, subprocess.CalledProcessError) as e:
+        print(f"Error: 无法读取 git 暂存区: {e}", file=sys.stderr)
+        return None
+    return {
+        os.path.join(project_root, name)
+        for name in output.decode("utf-8").split("\0")
+        if name
+    }
 
-    script_dir = os.path.dirname(os.path.abspath(__file__))
-    project_root = os.path.dirname(script_dir)
-    index_path = os.path.join(project_root, "index.md")
 
+def index_files(project_root=ROOT_DIR):
+    """index.md 中列出的章节文件（绝对路径，含不存在的），index.md 不存在时返回 None。"""
+    index_path = os.path.join(project_root, "index.md")
     if not os.path.exists(index_path):
         print(f"Error: {index_path} not found", file=sys.stderr)
-        sys.exit(1)
+        return None
 
     book_files = []
     with open(index_path, "r") as f:
@@ -132,15 +316,98 @@ def main():
             m = re.search(r"\((book/\S+\.md)\)", line)
             if m:
                 book_files.append(os.path.join(project_root, m.group(1)))
+    return book_files
+
+
+def select_files(filepaths, state, changed=False, staged=False, project_root=ROOT_DIR):
+    """按 --changed / --staged 筛选要检查的文件，读取 git 暂存区失败时返回 None。"""
+    if staged:
+        staged_paths = staged_files(project_root)
+        if staged_paths is None:
+            return None
+        return [fpath for fpath in filepaths if fpath in staged_paths]
+    if changed:
+        return [
+            fpath for fpath in filepaths
+            if not is_unchanged(fpath, state.get(os.path.relpath(fpath, project_root), (0, -1, "")))
+        ]
+    return filepaths
+
+
+def record_result(state, fpath, passed, project_root=ROOT_DIR):
+    """在状态中记录（或移除）文件的检查结果。"""
+    rel_path = os.path.relpath(fpath, project_root)
+    if passed:
+        state[rel_path] = file_stamp(fpath)
+    else:
+        state.pop(rel_path, None)
+
+
+def add_scope_arguments(parser):
+    """--jobs、--changed、--staged 参数，fix_quotes 和 lint 共用。"""
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="并行处理文件的进程数 (默认: CPU 核数)",
+    )
+    scope = parser.add_mutually_exclusive_group()
+    scope.add_argument(
+        "--changed",
+        action="store_true",
+        help="只检查上次检查通过之后修改过的文件",
+    )
+    scope.add_argument(
+        "--staged",
+        action="store_true",
+        help="只检查 git 暂存区中的文件，检查暂存的内容（pre-commit 钩子，须与 --check 一起用）",
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="修复全书中文双引号方向")
+    parser.add_argument("--check", action="store_true", help="仅检查，不修改文件")
+    add_scope_arguments(parser)
+    profiling.add_profile_arguments(parser)
+    args = parser.parse_args()
+    if args.staged and not args.check:
+        parser.error("--staged 只能与 --check 一起使用：修复写回工作区，暂存区中的内容不会变")
+    profiling.start_from_args("fix_quotes", args)
+
+    book_files = index_files()
+    if book_files is None:
+        sys.exit(EXIT_ERROR)
+
+    existing = [fpath for fpath in book_files if os.path.exists(fpath)]
+    state = load_state()
+    targets = select_files(existing, state, changed=args.changed, staged=args.staged)
+    if targets is None:
+        sys.exit(EXIT_ERROR)
+
+    with profiling.stage("fix"):
+        results = fix_files(targets, dry_run=args.check, jobs=args.jobs, staged=args.staged)
 
     total_fixed = 0
-    for fpath in book_files:
-        if os.path.exists(fpath):
-            n = fix_chinese_quotes(fpath, dry_run=args.check)
-            if n and n > 0:
-                total_fixed += n
+    problems = False
+    for fpath, (n, passed, report) in zip(targets, results):
+        if report:
+            print(report)
+        if n and n > 0:
+            total_fixed += n
+        # 暂存区中的内容不一定是工作区中的文件，不记录
+        if not args.staged:
+            record_result(state, fpath, passed)
+        problems = problems or not passed
+
+    if targets and not args.staged:
+        save_state(state)
 
-    print(f"\n--- {'Check' if args.check else 'Fix'} complete: {total_fixed} lines across {len(book_files)} files ---")
+    summary = f"{total_fixed} lines across {len(book_files)} files"
+    if args.changed or args.staged:
+        summary = f"{total_fixed} lines across {len(targets)} of {len(book_files)} files"
+    print(f"\n--- {'Check' if args.check else 'Fix'} complete: {summary} ---")
+    profiling.finish()
+    sys.exit(EXIT_PROBLEMS if problems else EXIT_OK)
 
 
 if __name__ == "__main__":
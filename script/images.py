@@ -0,0 +1,291 @@
+#!/usr/bin/env python3
+"""
+图片衍生图：按导出目标缩放、转码并缓存。
+
+book/img 中多是 1600px 的 RGBA PNG，原样嵌入 PDF、EPUB 既慢又大。这里为每种
+输出目标（profile）生成一份合适尺寸的白底 JPEG 衍生图：
+    pdf-print   PDF 印刷版，版心内 300 dpi
+    pdf-screen  PDF 屏幕版，版心内 150 dpi
+    pdf-ebook   PDF 轻量版，版心内 96 dpi
+    epub        阅读器屏幕尺寸
+    docx        Word 中 12cm 宽（Word 对 P3 色域、alpha 通道的 PNG 渲染常出错）
+
+衍生图缓存在 output/.cache/img/{profile}/，键为原图内容哈希和 profile 参数；
+未命中的图片分发到多个进程并行生成。修改转换逻辑时记得递增 IMAGE_VERSION。
+
+用法：
+    python script/images.py                     # 预生成全部 profile 的衍生图
+    python script/images.py --profiles epub,docx
+"""
+
+import argparse
+import atexit
+import hashlib
+import json
+import os
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+from PIL import Image
+
+from book_model import BOOK_DIR, CACHE_DIR
+from render import default_jobs, image_path_from_src
+
+# 转换逻辑变化时递增，使旧缓存失效
+IMAGE_VERSION = 1
+
+IMAGE_CACHE_DIR = os.path.join(CACHE_DIR, "img")
+
+# 可以处理的位图格式，其余（SVG、GIF 等）原样使用
+RASTER_EXTS = (".png", ".jpg", ".jpeg", ".webp")
+
+
+def _cm_to_px(cm, dpi):
+    return round(cm / 2.54 * dpi)
+
+
+# PDF 中图片最大 14.45cm × 13.2cm（版心 17cm 宽的 85%，高 500px）
+PDF_BOX_CM = (14.45, 13.2)
+
+PROFILES = {
+    "pdf-print": {
+        "max_size": (_cm_to_px(PDF_BOX_CM[0], 300), _cm_to_px(PDF_BOX_CM[1], 300)),
+        "quality": 90,
+    },
+    "pdf-screen": {
+        "max_size": (_cm_to_px(PDF_BOX_CM[0], 150), _cm_to_px(PDF_BOX_CM[1], 150)),
+        "quality": 80,
+    },
+    "pdf-ebook": {
+        "max_size": (_cm_to_px(PDF_BOX_CM[0], 96), _cm_to_px(PDF_BOX_CM[1], 96)),
+        "quality": 70,
+    },
+    "epub": {
+        "max_size": (1200, 1600),
+        "quality": 85,
+    },
+    "docx": {
+        "max_size": (_cm_to_px(12, 220), None),
+        "quality": 90,
+    },
+}
+
+IMG_SRC_RE = re.compile(r'(<img\b[^>]*?\bsrc=")([^"]+)(")')
+
+_temp_dir = None
+
+
+def rewrite_image_srcs(html_content, image_names):
+    """一次扫描，按 {原图路径: 新 src} 替换 img 的 src（渲染结果中为 file:// 路径）。"""
+    def replace_src(match):
+        abs_path = image_path_from_src(match.group(2))
+        name = image_names.get(abs_path)
+        if name is None:
+            return match.group(0)
+        return f"{match.group(1)}{name}{match.group(3)}"
+
+    return IMG_SRC_RE.sub(replace_src, html_content)
+
+
+def use_derivatives(rendered, image_paths):
+    """返回一份新的渲染结果，图片 src 和 images 都指向衍生图（仍为 file:// 路径）。"""
+    srcs = {abs_path: f"file://{path}" for abs_path, path in image_paths.items()}
+    result = {}
+    for file_path, chapter in rendered.items():
+        result[file_path] = dict(
+            chapter,
+            html=rewrite_image_srcs(chapter["html"], srcs),
+            images=[image_paths.get(abs_path, abs_path) for abs_path in chapter["images"]],
+        )
+    return result
+
+
+def chapter_images(rendered):
+    """全部已渲染章节引用的图片，去重并保持顺序。"""
+    paths = []
+    seen = set()
+    for chapter in rendered.values():
+        for abs_path in chapter["images"]:
+            if abs_path not in seen:
+                seen.add(abs_path)
+                paths.append(abs_path)
+    return paths
+
+
+def prepare_images(paths, profiles, use_cache=True, jobs=1, cache_dir=None):
+    """为 paths 生成各 profile 的衍生图，返回 {profile: {原图路径: 衍生图路径}}。
+
+    不存在的图片不在结果中；无法处理的格式或转换失败时映射到原图。
+    use_cache=False 时衍生图写入进程结束即删除的临时目录；cache_dir 指定时
+    写入该目录（如基准测试每轮用一个空目录）。
+    """
+    if cache_dir is None:
+        cache_dir = IMAGE_CACHE_DIR if use_cache else _get_temp_dir()
+    results = {profile: {} for profile in profiles}
+    pending = []
+
+    for abs_path in paths:
+        if not os.path.isfile(abs_path):
+            continue
+        if os.path.splitext(abs_path)[1].lower() not in RASTER_EXTS:
+            for profile in profiles:
+                results[profile][abs_path] = abs_path
+            continue
+        source_hash = _file_hash(abs_path)
+        for profile in profiles:
+            key = derivative_key(source_hash, profile)
+            path = os.path.join(cache_dir, profile, key + ".jpg")
+            if os.path.exists(path):
+                results[profile][abs_path] = path
+            else:
+                pending.append((abs_path, profile, path))
+
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+            derived = list(pool.map(_make_derivative, *zip(*pending)))
+    else:
+        derived = [_make_derivative(*args) for args in pending]
+
+    for (abs_path, profile, _), path in zip(pending, derived):
+        if path is None:
+            path = abs_path
+        results[profile][abs_path] = path
+    return results
+
+
+def image_map(paths, profile, use_cache=True, jobs=1, cache_dir=None):
+    """单个 profile 的 prepare_images()：返回 {原图路径: 衍生图路径}。"""
+    return prepare_images(paths, [profile], use_cache=use_cache, jobs=jobs, cache_dir=cache_dir)[profile]
+
+
+def derivative_key(source_hash, profile):
+    """衍生图的缓存键：原图内容哈希 + profile 参数。"""
+    h = hashlib.sha256()
+    for part in (
+        str(IMAGE_VERSION),
+        source_hash,
+        profile,
+        json.dumps(PROFILES[profile], sort_keys=True),
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def _file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def _get_temp_dir():
+    global _temp_dir
+    if _temp_dir is None:
+        _temp_dir = tempfile.mkdtemp(prefix="book-img-")
+        atexit.register(shutil.rmtree, _temp_dir, True)
+    return _temp_dir
+
+
+def _make_derivative(abs_path, profile, path):
+    """生成一张衍生图，返回其路径，失败时返回 None。也在工作进程中运行。"""
+    settings = PROFILES[profile]
+    try:
+        img = Image.open(abs_path)
+        source_format = img.format
+        img.load()
+
+        max_width, max_height = settings["max_size"]
+        width, height = img.size
+        scale = min(
+            1.0,
+            max_width / width if max_width else 1.0,
+            max_height / height if max_height else 1.0,
+        )
+        resized = scale < 1.0
+        if resized:
+            size = (max(1, round(width * scale)), max(1, round(height * scale)))
+            img = img.resize(size, Image.LANCZOS)
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        if source_format == "JPEG" and not resized and img.mode == "RGB":
+            # 原图已是合适尺寸的 JPEG，直接复用，避免二次压缩
+            shutil.copyfile(abs_path, tmp_path)
+        else:
+            _flatten(img).save(tmp_path, format="JPEG", quality=settings["quality"], optimize=True)
+        os.replace(tmp_path, path)
+        return path
+    except Exception as e:
+        print(f"  警告：图片处理失败 {abs_path}: {e}", file=sys.stderr)
+        return None
+
+
+def _flatten(img):
+    """转为 RGB（去掉 alpha 通道），白色背景。"""
+    if img.mode in ("RGBA", "LA", "P"):
+        if img.mode == "P":
+            img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, (255, 255, 255))
+        background.paste(img, mask=img.split()[-1] if "A" in img.mode else None)
+        return background
+    if img.mode != "RGB":
+        return img.convert("RGB")
+    return img
+
+
+def parse_profiles(value):
+    """解析 --profiles 参数，如 "epub,docx"。"""
+    profiles = []
+    for profile in value.split(","):
+        profile = profile.strip()
+        if not profile:
+            continue
+        if profile not in PROFILES:
+            raise argparse.ArgumentTypeError(
+                f"不支持的 profile: {profile}（可选: {', '.join(PROFILES)}）"
+            )
+        if profile not in profiles:
+            profiles.append(profile)
+    if not profiles:
+        raise argparse.ArgumentTypeError("至少指定一个 profile")
+    return profiles
+
+
+def main():
+    parser = argparse.ArgumentParser(description="预生成图片衍生图")
+    parser.add_argument(
+        "--profiles",
+        type=parse_profiles,
+        default=list(PROFILES),
+        help=f"要生成的 profile，逗号分隔 (默认: {','.join(PROFILES)})",
+    )
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="并行生成的进程数 (默认: CPU 核数)",
+    )
+    args = parser.parse_args()
+
+    img_dir = os.path.join(BOOK_DIR, "img")
+    paths = sorted(
+        os.path.join(img_dir, name)
+        for name in os.listdir(img_dir)
+        if os.path.splitext(name)[1].lower() in RASTER_EXTS
+    )
+    results = prepare_images(paths, args.profiles, jobs=args.jobs)
+
+    original = sum(os.path.getsize(p) for p in paths)
+    print(f"原图: {len(paths)} 张，{original / 1e6:.1f} MB")
+    for profile, mapping in results.items():
+        size = sum(os.path.getsize(p) for p in mapping.values())
+        print(f"  {profile}: {size / 1e6:.1f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,393 @@
+#!/usr/bin/env python3
+"""
+全书排版检查：一次扫描，多条规则。
+
+每个章节文件只读取、切分一次：代码块（``` 围起的部分）整体跳过，其余的行分为
+标题和正文；行内代码、链接地址、HTML 标签、网址在正文中受保护，规则看不到。
+所有规则在同一次遍历中依次作用于每一行。默认只检查；--fix 时直接采用规则给出的修复，
+写回章节文件。
+
+规则：
+    quotes       引号方向（与 fix_quotes.py 相同）、引号配对
+    punctuation  中文后的半角标点 ,;:?! 和半角括号改为全角
+    spacing      中文与英文字母之间加空格（数字不算：7日3活、36氪、图1 是常见写法）
+    ellipsis     省略号统一为 ……
+    dash         破折号统一为 ——
+    heading      标题末尾不加 ，。；：、 等标点
+
+新规则用 @rule 注册：scope="line" 的规则作用于整行，"text" 的规则只作用于正文中
+未受保护的片段。规则函数接收文本和本文件的状态字典，返回 (修复后的文本, 问题列表)。
+
+与 fix_quotes.py 一样支持 --changed、--staged 和退出码（--staged 检查暂存区中的内容，
+不能与 --fix 一起用），通过检查的文件记录在 output/.cache/lint.json。
+
+用法：
+    python script/lint.py                        # 仅检查，不修改（同 --check）
+    python script/lint.py --fix                  # 修复并写入文件
+    python script/lint.py --rules spacing,dash
+    python script/lint.py --list-rules
+"""
+
+import argparse
+import os
+import re
+import sys
+
+from book_model import CACHE_DIR
+from fix_quotes import (
+    CONTEXT_AFTER,
+    CONTEXT_BEFORE,
+    EXIT_ERROR,
+    EXIT_OK,
+    EXIT_PROBLEMS,
+    LEFT_QUOTE,
+    RIGHT_QUOTE,
+    TABLE_SIZE,
+    add_scope_arguments,
+    fix_line,
+    index_files,
+    load_state,
+    map_files,
+    read_text,
+    record_result,
+    save_state,
+    select_files,
+)
+
+# 规则或切分逻辑变化时递增，使状态文件中记录的"已通过"失效
+LINT_VERSION = 2
+
+STATE_FILE = os.path.join(CACHE_DIR, "lint.json")
+
+# 每个文件最多打印的问题数
+MAX_REPORTED = 20
+
+# 汉字（含扩展 A 区）
+CJK = "\u3400-\u4dbf\u4e00-\u9fff"
+
+HEADING_RE = re.compile(r"#{1,6}\s")
+
+# 正文中不检查的片段：行内代码、链接地址、HTML 标签、网址
+PROTECTED_RE = re.compile(r"`[^`]*`|\]\([^)]*\)|<[^>\n]+>|https?://[^\s)）>]+")
+
+RULES = {}
+
+
+def rule(name, description, scope="text", kinds=("text", "heading"), finish=None):
+    """注册规则。finish(state) 在文件末尾调用，返回无法自动修复的问题列表。"""
+    def register(func):
+        RULES[name] = {
+            "name": name,
+            "description": description,
+            "scope": scope,
+            "kinds": kinds,
+            "apply": func,
+            "finish": finish,
+        }
+        return func
+    return register
+
+
+def tokenize(content):
+    """把文本切分为行：返回 [(行号, 类型, 文本), ...]，类型为 fence、code、heading、text。"""
+    tokens = []
+    in_code_block = False
+    for idx, line in enumerate(content.split("\n"), 1):
+        if line.strip().startswith("```"):
+            in_code_block = not in_code_block
+            kind = "fence"
+        elif in_code_block:
+            kind = "code"
+        elif HEADING_RE.match(line):
+            kind = "heading"
+        else:
+            kind = "text"
+        tokens.append((idx, kind, line))
+    return tokens
+
+
+def split_protected(line):
+    """把一行拆为 [(片段, 是否受保护), ...]。"""
+    segments = []
+    last = 0
+    for m in PROTECTED_RE.finditer(line):
+        if m.start() > last:
+            segments.append((line[last:m.start()], False))
+        segments.append((m.group(0), True))
+        last = m.end()
+    if last < len(line):
+        segments.append((line[last:], False))
+    return segments
+
+
+def in_cjk_context(text, start, end):
+    """text[start:end] 前一个字符或后一个字符是否为中文语境（见 fix_quotes）。"""
+    prev_code = ord(text[start - 1]) if start > 0 else TABLE_SIZE
+    next_code = ord(text[end]) if end < len(text) else TABLE_SIZE
+    return (
+        (prev_code < TABLE_SIZE and CONTEXT_BEFORE[prev_code])
+        or (next_code < TABLE_SIZE and CONTEXT_AFTER[next_code])
+    )
+
+
+def _quote_balance(state):
+    left, right = state.get("left_quotes", 0), state.get("right_quotes", 0)
+    if left != right:
+        return [f"引号不配对：左引号 {left} 个，右引号 {right} 个"]
+    return []
+
+
+@rule("quotes", "引号方向与配对", scope="line", finish=_quote_balance)
+def check_quotes(text, state):
+    fixed, state["quote_depth"] = fix_line(text, state.get("quote_depth", 0))
+    state["left_quotes"] = state.get("left_quotes", 0) + fixed.count(LEFT_QUOTE)
+    state["right_quotes"] = state.get("right_quotes", 0) + fixed.count(RIGHT_QUOTE)
+    if fixed is text:
+        return text, []
+    messages = []
+    for i, (old, new) in enumerate(zip(text, fixed)):
+        if old != new:
+            what = "直引号" if old == '"' else "开口处的右引号"
+            messages.append(f"{what}：{text[max(0, i - 6):i + 7]}")
+    return fixed, messages
+
+
+HALFWIDTH_PUNCT_RE = re.compile(f"(?<=[{CJK}])([,;:?!])[ \\t]*")
+PAREN_RE = re.compile(r"\(([^()]*)\)")
+CJK_RE = re.compile(f"[{CJK}]")
+FULLWIDTH = {",": "，", ";": "；", ":": "：", "?": "？", "!": "！"}
+
+
+@rule("punctuation", "中文后的半角标点改为全角")
+def check_punctuation(text, state):
+    messages = []
+
+    def replace_punct(m):
+        messages.append(f"半角标点：{text[max(0, m.start() - 6):m.end() + 6]}")
+        return FULLWIDTH[m.group(1)]
+
+    def replace_paren(m):
+        if not (CJK_RE.search(m.group(1)) or in_cjk_context(m.string, m.start(), m.end())):
+            return m.group(0)
+        messages.append(f"半角括号：{m.group(0)[:20]}")
+        return f"（{m.group(1)}）"
+
+    text = HALFWIDTH_PUNCT_RE.sub(replace_punct, text)
+    text = PAREN_RE.sub(replace_paren, text)
+    return text, messages
+
+
+# 只管中文与英文字母：中文与数字之间不加空格的写法很常见（7日3活、36氪、图1）
+SPACING_RE = re.compile(f"(?<=[{CJK}])(?=[A-Za-z])|(?<=[A-Za-z])(?=[{CJK}])")
+
+
+@rule("spacing", "中文与英文字母之间加空格")
+def check_spacing(text, state):
+    positions = [m.start() for m in SPACING_RE.finditer(text)]
+    if not positions:
+        return text, []
+    messages = [f"缺少空格：{text[max(0, i - 6):i + 6]}" for i in positions]
+    pieces = []
+    last = 0
+    for i in positions:
+        pieces.append(text[last:i])
+        pieces.append(" ")
+        last = i
+    pieces.append(text[last:])
+    return "".join(pieces), messages
+
+
+ELLIPSIS_RE = re.compile(r"\.{3,}|。{2,}|…+")
+
+
+@rule("ellipsis", "省略号统一为 ……")
+def check_ellipsis(text, state):
+    messages = []
+
+    def replace(m):
+        if m.group(0) == "……" or not in_cjk_context(m.string, m.start(), m.end()):
+            return m.group(0)
+        messages.append(f"省略号 {m.group(0)}：{m.string[max(0, m.start() - 6):m.end() + 6]}")
+        return "……"
+
+    return ELLIPSIS_RE.sub(replace, text), messages
+
+
+DASH_RE = re.compile(r"—+|(?<!-)-{2,3}(?!-)|－+")
+
+
+@rule("dash", "破折号统一为 ——")
+def check_dash(text, state):
+    messages = []
+
+    def replace(m):
+        if m.group(0) == "——" or not in_cjk_context(m.string, m.start(), m.end()):
+            return m.group(0)
+        messages.append(f"破折号 {m.group(0)}：{m.string[max(0, m.start() - 6):m.end() + 6]}")
+        return "——"
+
+    return DASH_RE.sub(replace, text), messages
+
+
+HEADING_PUNCT_RE = re.compile(r"[，。；：、,.;:]+(?=\s*$)")
+
+
+@rule("heading", "标题末尾不加标点", scope="line", kinds=("heading",))
+def check_heading(text, state):
+    m = HEADING_PUNCT_RE.search(text)
+    if not m:
+        return text, []
+    return text[:m.start()] + text[m.end():], [f"标题末尾的标点：{text.strip()[-20:]}"]
+
+
+def lint_text(content, rule_names):
+    """按 rule_names 检查并修复全文，返回 (修复后的文本, 问题列表)。
+
+    问题为 (行号, 规则名, 说明, 能否自动修复)，文件级问题的行号为 None。
+    """
+    rules = [RULES[name] for name in rule_names]
+    line_rules = [r for r in rules if r["scope"] == "line"]
+    text_rules = [r for r in rules if r["scope"] == "text"]
+
+    state = {}
+    lines = []
+    issues = []
+    for idx, kind, line in tokenize(content):
+        if kind in ("fence", "code"):
+            lines.append(line)
+            continue
+
+        for r in line_rules:
+            if kind in r["kinds"]:
+                line, messages = r["apply"](line, state)
+                issues.extend((idx, r["name"], message, True) for message in messages)
+
+        if text_rules:
+            pieces = []
+            for segment, protected in split_protected(line):
+                if not protected:
+                    for r in text_rules:
+                        if kind in r["kinds"]:
+                            segment, messages = r["apply"](segment, state)
+                            issues.extend((idx, r["name"], message, True) for message in messages)
+                pieces.append(segment)
+            line = "".join(pieces)
+        lines.append(line)
+
+    for r in rules:
+        if r["finish"]:
+            issues.extend((None, r["name"], message, False) for message in r["finish"](state))
+
+    if not any(fixable for *_, fixable in issues):
+        return content, issues
+    return "\n".join(lines), issues
+
+
+def lint_file(filepath, dry_run=False, rule_names=tuple(RULES), staged=False):
+    """检查单个文件，返回 ({规则名: 问题数}, 是否通过, 报告)。也在工作进程中运行。
+
+    修复模式下只剩可以自动修复的问题时视为通过。staged=True 时检查 git 暂存区中的
+    内容，须与 dry_run 一起使用。
+    """
+    content = read_text(filepath, staged)
+
+    result, issues = lint_text(content, rule_names)
+    if result != content and not dry_run:
+        with open(filepath, "w") as f:
+            f.write(result)
+
+    counts = {}
+    for _, name, _, _ in issues:
+        counts[name] = counts.get(name, 0) + 1
+    passed = not any(not fixable or dry_run for *_, fixable in issues)
+    if not issues:
+        return counts, passed, None
+
+    action = "would fix" if dry_run else "fixed"
+    fixable = sum(1 for *_, f in issues if f)
+    report = [f"\n=== {filepath} ({len(issues)} issues, {fixable} {action}) ==="]
+    for idx, name, message, _ in issues[:MAX_REPORTED]:
+        where = f"L{idx}" if idx is not None else "文件"
+        report.append(f"  {where} [{name}] {message}")
+    if len(issues) > MAX_REPORTED:
+        report.append(f"  ... and {len(issues) - MAX_REPORTED} more")
+    return counts, passed, "\n".join(report)
+
+
+def parse_rules(value):
+    """解析 --rules 参数，如 "quotes,spacing"。"""
+    names = []
+    for name in value.split(","):
+        name = name.strip()
+        if not name:
+            continue
+        if name not in RULES:
+            raise argparse.ArgumentTypeError(
+                f"不支持的规则: {name}（可选: {', '.join(RULES)}）"
+            )
+        if name not in names:
+            names.append(name)
+    if not names:
+        raise argparse.ArgumentTypeError("至少指定一条规则")
+    return names
+
+
+def main():
+    parser = argparse.ArgumentParser(description="全书排版检查")
+    mode = parser.add_mutually_exclusive_group()
+    mode.add_argument("--check", action="store_true", help="仅检查，不修改文件（默认）")
+    mode.add_argument("--fix", action="store_true", help="修复并写入章节文件")
+    parser.add_argument(
+        "--rules",
+        type=parse_rules,
+        default=list(RULES),
+        help=f"要运行的规则，逗号分隔 (默认: {','.join(RULES)})",
+    )
+    parser.add_argument("--list-rules", action="store_true", help="列出全部规则")
+    add_scope_arguments(parser)
+    args = parser.parse_args()
+    if args.staged and args.fix:
+        parser.error("--staged 不能与 --fix 一起使用：修复写回工作区，暂存区中的内容不会变")
+
+    if args.list_rules:
+        for r in RULES.values():
+            print(f"{r['name']:<12} {r['description']}")
+        return
+
+    book_files = index_files()
+    if book_files is None:
+        sys.exit(EXIT_ERROR)
+
+    # 状态只对同一组规则有效
+    version = f"{LINT_VERSION}:{','.join(args.rules)}"
+    existing = [fpath for fpath in book_files if os.path.exists(fpath)]
+    state = load_state(STATE_FILE, version)
+    targets = select_files(existing, state, changed=args.changed, staged=args.staged)
+    if targets is None:
+        sys.exit(EXIT_ERROR)
+
+    totals = {}
+    problems = False
+    results = map_files(lint_file, targets, args.jobs, not args.fix, args.rules, args.staged)
+    for fpath, (counts, passed, report) in zip(targets, results):
+        if report:
+            print(report)
+        for name, n in counts.items():
+            totals[name] = totals.get(name, 0) + n
+        # 暂存区中的内容不一定是工作区中的文件，不记录
+        if not args.staged:
+            record_result(state, fpath, passed)
+        problems = problems or not passed
+
+    if targets and not args.staged:
+        save_state(state, STATE_FILE, version)
+
+    summary = f"{sum(totals.values())} issues across {len(targets)} of {len(book_files)} files"
+    if totals:
+        summary += " (" + ", ".join(f"{name} {totals[name]}" for name in args.rules if name in totals) + ")"
+    print(f"\n--- {'Fix' if args.fix else 'Check'} complete: {summary} ---")
+    sys.exit(EXIT_PROBLEMS if problems else EXIT_OK)
+
+
+if __name__ == "__main__":
+    main()
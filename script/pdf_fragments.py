@@ -0,0 +1,342 @@
+#!/usr/bin/env python3
+"""
+PDF 分片导出：逐章排版并缓存，再拼接为整本书。
+
+整本书一次性交给 WeasyPrint 排版是 export_pdf 中最慢的一步，改一个字也要全部重排。
+分片模式下：
+    - 封面、目录和每一章（连同它前面的部分标题页、子分类标题页、问题页）
+      各自排版为一个 PDF 分片，缓存在 output/.cache/pdf/，键为分片 HTML
+      （含样式）、所引用图片的修改时间、WeasyPrint 选项和 FRAGMENT_VERSION 的哈希；
+    - 分片内不印页码，拼接时按全书页码统一叠加页脚；
+    - 目录页码、目录链接和书签根据各分片记录的锚点位置重新生成。
+
+只有修改过的章节需要重新排版；目录页随页码变化重排，但只有一两页。
+
+依赖安装：
+    pip install markdown weasyprint pypdf
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+
+import weasyprint
+from pypdf import PdfReader, PdfWriter
+from pypdf.annotations import Link
+from pypdf.generic import Fit
+from weasyprint import HTML
+
+import profiling
+from book_model import BOOK_DIR, CACHE_DIR
+from export_pdf import (
+    build_chapter_body,
+    build_cover_html,
+    build_toc_items,
+    build_toc_page_html,
+    wrap_html,
+)
+
+# 分片 HTML 结构或元数据格式变化时递增，使旧缓存失效
+FRAGMENT_VERSION = 1
+
+PDF_CACHE_DIR = os.path.join(CACHE_DIR, "pdf")
+
+# WeasyPrint 的 CSS 像素到 PDF 点
+PX_TO_PT = 0.75
+
+# 目录页数在页码确定后通常一两轮就稳定，防止极端情况下来回振荡
+MAX_TOC_PASSES = 5
+
+# 分片内不印页码；目录页码改为读取 data-page 属性
+FRAGMENT_CSS = """
+/* 分片导出：页码在拼接时统一叠加 */
+@page {
+    @bottom-center { content: none; }
+}
+
+.toc a::after,
+.toc-subheading a::after {
+    content: attr(data-page);
+}
+"""
+
+# 页码层：与正文相同的页面设置，只有页脚
+NUMBERS_CSS = """
+.number-page {
+    page-break-before: always;
+    height: 1px;
+}
+"""
+
+
+def fragment_key(html, image_paths=(), options=None):
+    """分片的缓存键：HTML、引用的图片、WeasyPrint 版本和选项。"""
+    h = hashlib.sha256()
+    for part in (str(FRAGMENT_VERSION), weasyprint.__version__, BOOK_DIR, html,
+                 json.dumps(options or {}, sort_keys=True)):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    for path in image_paths:
+        try:
+            st = os.stat(path)
+            stamp = f"{path}:{st.st_mtime_ns}:{st.st_size}"
+        except OSError:
+            stamp = f"{path}:missing"
+        h.update(stamp.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def layout_fragments(shards, cache_dir=PDF_CACHE_DIR, use_cache=True, jobs=1, names=None,
+                     options=None):
+    """排版一组分片，返回与 shards 顺序一致的元数据列表。
+
+    shards 为 [(html, 引用的图片路径), ...]。先在主进程中读取缓存，未命中的分片
+    分发到 jobs 个工作进程并行排版（WeasyPrint 本身是单线程的），大的分片先提交，
+    避免最后只剩一个大章节在排。names 为各分片的名称（如章节文件），--profile 时
+    用于逐个分片记录排版耗时。options 为传给 WeasyPrint 的选项（见 export_pdf.PDF_PRESETS）。
+
+    元数据包括：
+        pdf         分片 PDF 路径
+        page_count  页数
+        anchors     {锚点 ID: [页序号, x, y]}
+        bookmarks   [[级别, 标题, 页序号, x, y, 展开状态], ...]
+        links       [[目标锚点, 页序号, x, y, 宽, 高], ...]（仅文档内链接）
+        cached      是否来自缓存
+    页序号从 0 开始，坐标为 CSS 像素，原点在页面左上角。
+    """
+    results = [None] * len(shards)
+    pending = []
+    for i, (html, image_paths) in enumerate(shards):
+        key = fragment_key(html, image_paths, options)
+        pdf_path = os.path.join(cache_dir, key + ".pdf")
+        meta_path = os.path.join(cache_dir, key + ".json")
+        meta = _load_fragment(meta_path, pdf_path) if use_cache else None
+        if meta is not None:
+            meta["cached"] = True
+            results[i] = meta
+        else:
+            pending.append((i, html, pdf_path, meta_path))
+
+    pending.sort(key=lambda item: len(item[1]), reverse=True)
+    # 只有给出名称时才逐个记录（目录、页码层这类单独排版的分片由调用方计时）
+    layout = profiling.wrap(_layout_and_store) if names else _layout_and_store
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+            futures = {
+                pool.submit(layout, html, pdf_path, meta_path, options): i
+                for i, html, pdf_path, meta_path in pending
+            }
+            for future, i in futures.items():
+                results[i] = future.result()
+    else:
+        for i, html, pdf_path, meta_path in pending:
+            results[i] = layout(html, pdf_path, meta_path, options)
+    if names:
+        laid_out = profiling.unwrap(
+            "layout", [names[i] for i, *_ in pending], [results[i] for i, *_ in pending],
+        )
+        for (i, *_), meta in zip(pending, laid_out):
+            results[i] = meta
+    for i, *_ in pending:
+        results[i]["cached"] = False
+    return results
+
+
+def layout_fragment(html, image_paths=(), cache_dir=PDF_CACHE_DIR, use_cache=True, options=None):
+    """排版单个分片，返回其元数据，见 layout_fragments()。"""
+    return layout_fragments([(html, image_paths)], cache_dir, use_cache, options=options)[0]
+
+
+def _load_fragment(meta_path, pdf_path):
+    if not os.path.exists(pdf_path):
+        return None
+    try:
+        with open(meta_path, "r", encoding="utf-8") as f:
+            meta = json.load(f)
+    except (OSError, ValueError):
+        return None
+    meta["pdf"] = pdf_path
+    return meta
+
+
+def _layout_and_store(html, pdf_path, meta_path, options=None):
+    """排版并写入缓存。也在工作进程中运行。"""
+    options = options or {}
+    document = HTML(string=html, base_url=BOOK_DIR).render(**options)
+
+    meta = {"page_count": len(document.pages), "anchors": {}, "bookmarks": [], "links": []}
+    for index, page in enumerate(document.pages):
+        for name, position in page.anchors.items():
+            meta["anchors"][name] = [index, position[0], position[1]]
+        for level, label, (x, y), state in page.bookmarks:
+            meta["bookmarks"].append([level, label, index, x, y, state])
+        for link_type, target, (x, y, width, height), _ in page.links:
+            if link_type == "internal":
+                meta["links"].append([target, index, x, y, width, height])
+
+    os.makedirs(os.path.dirname(pdf_path), exist_ok=True)
+    tmp_path = f"{pdf_path}.{os.getpid()}.tmp"
+    document.write_pdf(tmp_path, **options)
+    os.replace(tmp_path, pdf_path)
+
+    tmp_path = f"{meta_path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    os.replace(tmp_path, meta_path)
+
+    meta["pdf"] = pdf_path
+    return meta
+
+
+def export_fragments(book_title, chapters, rendered, output, use_cache=True, jobs=1,
+                     options=None):
+    """分片排版整本书并拼接为 output。use_cache=False 时在临时目录中排版。
+    options 为传给 WeasyPrint 的选项，各分片都按同样的选项排版和写出。
+
+    各分片互不依赖，由 jobs 个进程并行排版；分片内不含页码，不需要预先知道
+    起始页码，只有目录页在拿到各分片页数之后排版。
+
+    返回 ({锚点 ID: 所在页序号}, 总页数)，供按页码范围拆分（见 split_pdf()）。
+    """
+    if use_cache:
+        return _export_fragments(book_title, chapters, rendered, output, PDF_CACHE_DIR, True, jobs,
+                                 options)
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        return _export_fragments(book_title, chapters, rendered, output, tmp_dir, False, jobs,
+                                 options)
+
+
+def _export_fragments(book_title, chapters, rendered, output, cache_dir, use_cache, jobs,
+                      options):
+    def layout(body, image_paths=(), extra_css=FRAGMENT_CSS):
+        html = wrap_html(book_title, body, extra_css)
+        return layout_fragment(html, image_paths, cache_dir, use_cache, options)
+
+    print("排版分片...")
+    shards = [(wrap_html(book_title, build_cover_html(book_title), FRAGMENT_CSS), [])]
+    names = ["cover"]
+    for ch in chapters:
+        chapter = rendered.get(ch["file"])
+        if chapter is None:
+            continue
+        html = wrap_html(book_title, build_chapter_body(ch, chapter), FRAGMENT_CSS)
+        shards.append((html, chapter["images"]))
+        names.append(ch["file"])
+    with profiling.stage("layout"):
+        metas = layout_fragments(shards, cache_dir, use_cache, jobs, names, options)
+    cover, bodies = metas[0], metas[1:]
+    laid_out = sum(1 for meta in metas if not meta["cached"])
+    print(f"  分片数: {len(metas)}，重新排版: {laid_out}")
+
+    # 目录页码取决于目录自身的页数：先假设一页，排版后页数变了就重来
+    toc_items = build_toc_items(chapters, rendered)
+    toc_pages = 1
+    with profiling.stage("toc"):
+        for _ in range(MAX_TOC_PASSES):
+            anchors = _global_anchors([cover, {"page_count": toc_pages, "anchors": {}}] + bodies)
+            page_numbers = {name: index + 1 for name, (index, _, _) in anchors.items()}
+            toc = layout(build_toc_page_html(toc_items, page_numbers))
+            if toc["page_count"] == toc_pages:
+                break
+            toc_pages = toc["page_count"]
+    print(f"  目录页数: {toc['page_count']}")
+
+    fragments = [cover, toc] + bodies
+    total_pages = sum(meta["page_count"] for meta in fragments)
+    numbers_body = '<div class="number-page"></div>' * total_pages
+    with profiling.stage("numbers"):
+        numbers = layout(numbers_body, extra_css=NUMBERS_CSS)
+
+    print("拼接 PDF...")
+    with profiling.stage("stitch"):
+        stitch(book_title, fragments, numbers["pdf"], output)
+
+    anchors = _global_anchors(fragments)
+    return {name: index for name, (index, _, _) in anchors.items()}, total_pages
+
+
+def _global_anchors(fragments):
+    """将各分片的锚点换算为全书页序号：{锚点 ID: (页序号, x, y)}。"""
+    anchors = {}
+    offset = 0
+    for meta in fragments:
+        for name, (index, x, y) in meta["anchors"].items():
+            # 与单文档一致：重复的 ID 只有第一个是锚点
+            anchors.setdefault(name, (offset + index, x, y))
+        offset += meta["page_count"]
+    return anchors
+
+
+def stitch(book_title, fragments, numbers_pdf, output):
+    """按顺序拼接分片 PDF，叠加页码层，重建书签和文档内链接。"""
+    writer = PdfWriter()
+    for meta in fragments:
+        writer.append(meta["pdf"], import_outline=False)
+
+    numbers = PdfReader(numbers_pdf)
+    for page, number_page in zip(writer.pages, numbers.pages):
+        page.merge_page(number_page)
+
+    anchors = _global_anchors(fragments)
+    page_heights = [float(page.mediabox.height) for page in writer.pages]
+
+    def destination(index, x, y):
+        return Fit.xyz(left=x * PX_TO_PT, top=page_heights[index] - y * PX_TO_PT)
+
+    offset = 0
+    outline_stack = []  # [(级别, 书签对象)]
+    for meta in fragments:
+        for target, index, x, y, width, height in meta["links"]:
+            if target not in anchors:
+                continue
+            page_index = offset + index
+            page_height = page_heights[page_index]
+            rect = (
+                x * PX_TO_PT,
+                page_height - (y + height) * PX_TO_PT,
+                (x + width) * PX_TO_PT,
+                page_height - y * PX_TO_PT,
+            )
+            link = Link(
+                rect=rect,
+                border=[0, 0, 0],
+                target_page_index=anchors[target][0],
+                fit=destination(*anchors[target]),
+            )
+            writer.add_annotation(page_index, link)
+
+        # 书签按级别嵌套：比当前级别低的最近一个书签是父节点
+        for level, label, index, x, y, state in meta["bookmarks"]:
+            page_index = offset + index
+            while outline_stack and outline_stack[-1][0] >= level:
+                outline_stack.pop()
+            parent = outline_stack[-1][1] if outline_stack else None
+            item = writer.add_outline_item(
+                label,
+                page_index,
+                parent=parent,
+                fit=destination(page_index, x, y),
+                is_open=state != "closed",
+            )
+            outline_stack.append((level, item))
+
+        offset += meta["page_count"]
+
+    writer.add_metadata({"/Title": book_title})
+    with open(output, "wb") as f:
+        writer.write(f)
+
+
+def split_pdf(path, ranges):
+    """从拼接好的 PDF 中按页码范围拆出多个文件。ranges 为 [(输出路径, 起始页序号, 结束页序号)]，
+    结束页序号不含。页码层已叠加在页面上，拆出的页面保留整本书的页码。"""
+    reader = PdfReader(path)
+    for output, start, end in ranges:
+        writer = PdfWriter()
+        writer.append(reader, pages=(start, end))
+        writer.add_metadata(reader.metadata or {})
+        with open(output, "wb") as f:
+            writer.write(f)
@@ -0,0 +1,389 @@
+#!/usr/bin/env python3
+"""
+导出和检查脚本的 --profile：按阶段、按章节记录耗时。
+
+各脚本在关键步骤外面套上 stage()：
+
+    with profiling.stage("layout"):
+        document = HTML(...).render()
+    with profiling.stage("assemble", chapter=ch["file"]):
+        ...
+
+未启用时 stage() 什么也不做。启用后每个阶段记录起始时间、墙钟时间和 CPU 时间
+（本进程），阶段可以嵌套。在工作进程中运行的函数用 wrap()/unwrap() 包装：
+计时在工作进程中完成，结果带回主进程后再记录，Chrome trace 中每个进程一行。
+
+结果写入 output/profile/：
+    {工具}.json         全部事件，以及按阶段、按章节的汇总
+    {工具}.trace.json   Chrome trace 格式，可在 chrome://tracing 或 https://ui.perfetto.dev 打开
+    {工具}.{阶段}.prof  --cprofile 时每个阶段的 cProfile 数据（只含主进程），
+                        可用 python -m pstats 或 snakeviz 查看
+
+嵌套阶段的 cProfile 数据互不重叠：进入子阶段时暂停父阶段的采样。
+
+--memory 时每个阶段另外记录内存（只含主进程）：
+    rss         阶段结束时的常驻内存
+    rss_peak    阶段内的常驻内存峰值（Linux 上每个阶段开始时重置 VmHWM；
+                其他系统为进程启动以来的峰值）
+    py_peak     阶段内 Python 对象分配的峰值（tracemalloc，运行会慢几倍）
+父阶段的峰值包含子阶段的峰值。
+"""
+
+import json
+import os
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+from functools import partial
+
+from book_model import ROOT_DIR
+
+PROFILE_DIR = os.path.join(ROOT_DIR, "output", "profile")
+
+# 结果文件格式变化时递增
+PROFILE_VERSION = 1
+
+# 终端摘要中列出的最慢章节数
+TOP_CHAPTERS = 5
+
+MB = 1024 * 1024
+
+_active = None
+
+
+class Profiler:
+    """收集一次运行的阶段事件。一般通过 start() 创建，不直接使用。"""
+
+    def __init__(self, name, cprofile=False, memory=False):
+        self.name = name
+        self.cprofile = cprofile
+        self.memory = memory
+        self.pid = os.getpid()
+        self.started = time.time()
+        self._wall = time.perf_counter()
+        self._cpu = time.process_time()
+        self.events = []
+        self.profiles = {}
+        self._profile_stack = []
+        self._memory_stack = []
+        if memory:
+            import tracemalloc
+
+            tracemalloc.start()
+
+    @contextmanager
+    def stage(self, name, chapter=None):
+        profile = self._enter_profile(name) if self.cprofile else None
+        if self.memory:
+            self._enter_memory()
+        start = time.time()
+        wall = time.perf_counter()
+        cpu = time.process_time()
+        try:
+            yield
+        finally:
+            timing = (start, time.perf_counter() - wall, time.process_time() - cpu, self.pid)
+            memory = self._exit_memory() if self.memory else None
+            if profile is not None:
+                self._exit_profile(profile)
+            self.add(name, timing, chapter, memory)
+
+    def _enter_memory(self):
+        # 峰值计数器全进程只有一个：进入子阶段前把目前的峰值记到父阶段上，再重置
+        self._fold_peaks()
+        self._memory_stack.append([0, 0])
+
+    def _exit_memory(self):
+        self._fold_peaks()
+        py_peak, rss_peak = self._memory_stack.pop()
+        if self._memory_stack:
+            top = self._memory_stack[-1]
+            top[0] = max(top[0], py_peak)
+            top[1] = max(top[1], rss_peak)
+        return {"rss": _rss()[0], "rss_peak": rss_peak, "py_peak": py_peak}
+
+    def _fold_peaks(self):
+        import tracemalloc
+
+        py_peak = tracemalloc.get_traced_memory()[1]
+        rss_peak = _rss()[1]
+        if self._memory_stack:
+            top = self._memory_stack[-1]
+            top[0] = max(top[0], py_peak)
+            top[1] = max(top[1], rss_peak)
+        tracemalloc.reset_peak()
+        _reset_rss_peak()
+
+    def _enter_profile(self, name):
+        import cProfile
+
+        profile = self.profiles.get(name)
+        if profile is None:
+            profile = self.profiles[name] = cProfile.Profile()
+        top = self._profile_stack[-1] if self._profile_stack else None
+        # 同名阶段嵌套时（如递归调用）继续使用外层的采样
+        if top is not profile:
+            if top is not None:
+                top.disable()
+            profile.enable()
+        self._profile_stack.append(profile)
+        return profile
+
+    def _exit_profile(self, profile):
+        self._profile_stack.pop()
+        top = self._profile_stack[-1] if self._profile_stack else None
+        if top is not profile:
+            profile.disable()
+            if top is not None:
+                top.enable()
+
+    def add(self, name, timing, chapter=None, memory=None):
+        """记录一个事件。timing 为 (起始 Unix 时间, 墙钟秒数, CPU 秒数, 进程 ID)，
+        memory 为 {"rss", "rss_peak", "py_peak"}（字节）。"""
+        start, wall, cpu, pid = timing
+        if chapter is not None and os.path.isabs(chapter):
+            chapter = os.path.relpath(chapter, ROOT_DIR)
+        event = {
+            "name": name,
+            "chapter": chapter,
+            "start": start - self.started,
+            "wall": wall,
+            "cpu": cpu,
+            "pid": pid,
+        }
+        if memory is not None:
+            event["memory"] = memory
+        self.events.append(event)
+
+    def summary(self):
+        """汇总：(阶段, 章节)。
+
+        阶段：{名称: {"count", "wall", "cpu"}}，只计整本书的阶段（不带章节的事件）；
+        章节：{章节: {阶段: {"wall", "cpu"}}}。逐章事件通常嵌套在同名或上层的
+        整本书阶段里，分开汇总，避免重复计算。--memory 时另有 "rss_peak"、
+        "py_peak"，取各次的最大值。
+        """
+        stages = defaultdict(lambda: {"count": 0, "wall": 0.0, "cpu": 0.0})
+        chapters = defaultdict(lambda: defaultdict(lambda: {"wall": 0.0, "cpu": 0.0}))
+        for event in self.events:
+            if event["chapter"] is None:
+                item = stages[event["name"]]
+                item["count"] += 1
+            else:
+                item = chapters[event["chapter"]][event["name"]]
+            item["wall"] += event["wall"]
+            item["cpu"] += event["cpu"]
+            memory = event.get("memory")
+            if memory:
+                for key in ("rss_peak", "py_peak"):
+                    item[key] = max(item.get(key, 0), memory[key])
+        return (
+            dict(stages),
+            {chapter: dict(items) for chapter, items in chapters.items()},
+        )
+
+    def trace(self):
+        """Chrome trace 格式（微秒）。"""
+        events = [
+            {
+                "name": event["name"] if event["chapter"] is None
+                else f"{event['name']} {event['chapter']}",
+                "cat": event["name"],
+                "ph": "X",
+                "ts": round(event["start"] * 1e6),
+                "dur": round(event["wall"] * 1e6),
+                "pid": self.pid,
+                "tid": event["pid"],
+                "args": {"chapter": event["chapter"], "cpu_ms": round(event["cpu"] * 1e3, 3)},
+            }
+            for event in self.events
+        ]
+        # 内存曲线：每个阶段结束时的常驻内存
+        events.extend(
+            {
+                "name": "memory",
+                "ph": "C",
+                "ts": round((event["start"] + event["wall"]) * 1e6),
+                "pid": self.pid,
+                "args": {"rss_mb": round(event["memory"]["rss"] / MB, 1)},
+            }
+            for event in self.events
+            if "memory" in event
+        )
+        events.append({
+            "name": "process_name", "ph": "M", "pid": self.pid, "args": {"name": self.name},
+        })
+        for pid in sorted({event["pid"] for event in self.events}):
+            label = "main" if pid == self.pid else f"worker {pid}"
+            events.append({
+                "name": "thread_name", "ph": "M", "pid": self.pid, "tid": pid, "args": {"name": label},
+            })
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def save(self, out_dir=PROFILE_DIR):
+        """写出结果文件，返回写入的路径列表。"""
+        for profile in self._profile_stack:
+            profile.disable()
+        self._profile_stack = []
+
+        stages, chapters = self.summary()
+        data = {
+            "version": PROFILE_VERSION,
+            "tool": self.name,
+            "started": self.started,
+            "wall": time.perf_counter() - self._wall,
+            "cpu": time.process_time() - self._cpu,
+            "stages": stages,
+            "chapters": chapters,
+            "events": self.events,
+        }
+        os.makedirs(out_dir, exist_ok=True)
+        paths = [
+            os.path.join(out_dir, f"{self.name}.json"),
+            os.path.join(out_dir, f"{self.name}.trace.json"),
+        ]
+        for path, content in zip(paths, (data, self.trace())):
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(content, f, ensure_ascii=False, indent=1)
+        for name, profile in self.profiles.items():
+            path = os.path.join(out_dir, f"{self.name}.{name}.prof")
+            profile.dump_stats(path)
+            paths.append(path)
+        return paths
+
+    def report(self):
+        """在终端打印各阶段耗时（--memory 时含内存峰值）和最慢的几个章节。"""
+        stages, chapters = self.summary()
+        header = f"\n耗时（墙钟 / CPU，总计 {time.perf_counter() - self._wall:.2f}s）"
+        if self.memory:
+            header += f"与内存峰值（RSS / Python，进程峰值 {_rss()[2] / MB:.0f} MB）"
+        print(header + ":")
+        for name, stage in stages.items():
+            count = f" ×{stage['count']}" if stage["count"] > 1 else ""
+            line = f"  {name + count:<20} {stage['wall']:8.3f}s {stage['cpu']:8.3f}s"
+            if "rss_peak" in stage:
+                line += f" {stage['rss_peak'] / MB:8.1f} MB {stage['py_peak'] / MB:8.1f} MB"
+            print(line)
+        if chapters:
+            totals = sorted(
+                ((sum(item["wall"] for item in items.values()), chapter)
+                 for chapter, items in chapters.items()),
+                reverse=True,
+            )
+            print("最慢的章节:")
+            for wall, chapter in totals[:TOP_CHAPTERS]:
+                parts = ", ".join(
+                    f"{name} {item['wall']:.3f}s" for name, item in chapters[chapter].items()
+                )
+                print(f"  {chapter:<30} {wall:8.3f}s  ({parts})")
+
+
+def start(name, cprofile=False, memory=False):
+    """启用本进程的性能记录，name 为结果文件名（通常是脚本名）。"""
+    global _active
+    _active = Profiler(name, cprofile, memory)
+    return _active
+
+
+def _rss():
+    """(当前常驻内存, 上次重置以来的峰值, 进程峰值)，字节。"""
+    import resource
+
+    # Linux 上 ru_maxrss 单位为 KB，macOS 上为字节
+    scale = 1 if sys.platform == "darwin" else 1024
+    maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * scale
+    try:
+        with open("/proc/self/status", "rb") as f:
+            status = dict(line.split(b":", 1) for line in f if b":" in line)
+        current = int(status[b"VmRSS"].split()[0]) * 1024
+        peak = int(status[b"VmHWM"].split()[0]) * 1024
+    except (OSError, KeyError, ValueError):
+        return maxrss, maxrss, maxrss
+    return current, peak, maxrss
+
+
+def _reset_rss_peak():
+    """重置 VmHWM（Linux 4.0+），使之后的峰值只反映当前阶段。其他系统什么也不做。"""
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def enabled():
+    """当前进程是否在记录。fork 出的工作进程继承了全局状态，但不记录。"""
+    return _active is not None and _active.pid == os.getpid()
+
+
+def stage(name, chapter=None):
+    """阶段计时的上下文管理器，未启用时什么也不做。"""
+    if enabled():
+        return _active.stage(name, chapter)
+    return nullcontext()
+
+
+def timed(func, *args):
+    """调用 func(*args)，返回 (结果, 计时)。可在工作进程中运行。"""
+    start = time.time()
+    wall = time.perf_counter()
+    cpu = time.process_time()
+    value = func(*args)
+    return value, (start, time.perf_counter() - wall, time.process_time() - cpu, os.getpid())
+
+
+def wrap(func):
+    """启用时把 func 包装为返回 (结果, 计时) 的函数，交给进程池或直接调用；
+    结果随后用 unwrap() 还原。未启用时原样返回 func。"""
+    return partial(timed, func) if enabled() else func
+
+
+def unwrap(name, chapters, results):
+    """记录 wrap() 包装的函数的计时，返回原来的结果列表。chapters 与 results 一一对应。"""
+    if not enabled():
+        return results
+    values = []
+    for chapter, (value, timing) in zip(chapters, results):
+        _active.add(name, timing, chapter)
+        values.append(value)
+    return values
+
+
+def finish(report=True):
+    """保存结果，report=True 时打印摘要。未启用时什么也不做。"""
+    global _active
+    if not enabled():
+        return
+    profiler, _active = _active, None
+    paths = profiler.save()
+    if report:
+        profiler.report()
+    print("性能数据已保存:")
+    for path in paths:
+        print(f"  {os.path.relpath(path, ROOT_DIR)}")
+
+
+def add_profile_arguments(parser):
+    """添加 --profile、--cprofile、--memory 选项。"""
+    parser.add_argument(
+        "--profile",
+        action="store_true",
+        help="记录各阶段、各章节的耗时，保存到 output/profile/",
+    )
+    parser.add_argument(
+        "--cprofile",
+        action="store_true",
+        help="同时保存每个阶段的 cProfile 数据（隐含 --profile）",
+    )
+    parser.add_argument(
+        "--memory",
+        action="store_true",
+        help="同时记录每个阶段的 RSS 和 tracemalloc 内存峰值（隐含 --profile，运行会变慢）",
+    )
+
+
+def start_from_args(name, args):
+    """按 add_profile_arguments() 添加的选项启用记录。"""
+    if args.profile or args.cprofile or args.memory:
+        start(name, cprofile=args.cprofile, memory=args.memory)
@@ -0,0 +1,259 @@
+#!/usr/bin/env python3
+"""
+章节渲染：Markdown -> HTML，PDF、EPUB、DOCX 三种导出格式共用。
+
+每章只需读取、编号、转换一次。Markdown 转换时由 BookTreeprocessor 在同一次
+树遍历中完成全部后处理，得到的 HTML 中：
+    - 图片 src 为 file:// 绝对路径，引用的图片同时记录在结果的 images 中，
+      标题大纲记录在 outline 中；
+    - 章节开头的引言标记为 blockquote.epigraph；
+    - "图 x-y" 说明段落标记为 p.img-caption；
+    - 第一个 h1 的 ID 为章节 ID，h2 的 ID 为 {章节ID}-h2-N。
+
+各导出后端在此基础上只做本格式特有的处理。
+
+渲染结果按内容寻址缓存在 output/.cache/html/，键为章节源文件、章节编号、
+Markdown 扩展列表和 PIPELINE_VERSION 的哈希；未修改的章节在重新构建时
+直接跳过 Markdown 转换和后处理。修改后处理逻辑时记得递增 PIPELINE_VERSION。
+"""
+
+import hashlib
+import json
+import os
+import re
+from concurrent.futures import ProcessPoolExecutor
+from urllib.parse import unquote, urlparse
+
+import markdown
+from markdown.extensions import Extension
+from markdown.treeprocessors import Treeprocessor
+
+import profiling
+from book_model import CACHE_DIR, ROOT_DIR, read_chapter, scan_chapter
+
+MD_EXTENSIONS = ["extra", "toc", "sane_lists", "smarty"]
+
+# 渲染流程（编号、后处理、HTML 结构）变化时递增，使旧缓存失效
+PIPELINE_VERSION = 4
+
+HTML_CACHE_DIR = os.path.join(CACHE_DIR, "html")
+
+
+CAPTION_RE = re.compile(r"图\s+\d+-\d+")
+
+
+class BookTreeprocessor(Treeprocessor):
+    """章节 HTML 后处理：一次遍历元素树，完成图片路径、引言、图片说明和标题 ID。
+
+    在 toc 之后运行，覆盖 toc 生成的标题 ID。新增的处理也应加在这里，
+    而不是对输出的 HTML 字符串再做一遍正则替换。
+    """
+
+    def __init__(self, md):
+        super().__init__(md)
+        self.chapter_id = None
+        self.base_dir = None
+        self.images = []
+
+    def run(self, root):
+        self.images = []
+        h1_seen = False
+        h2_counter = 0
+        after_h1 = False
+
+        # 章节开头的引言：紧跟在 h1 后面的连续 blockquote（仅顶层元素）
+        for el in root:
+            if el.tag == "h1":
+                after_h1 = True
+            elif el.tag == "blockquote" and after_h1:
+                el.set("class", "epigraph")
+            else:
+                after_h1 = False
+
+        for el in root.iter():
+            tag = el.tag
+            if tag == "img":
+                self._fix_image(el)
+            elif tag == "p":
+                if not el.attrib and el.text and CAPTION_RE.match(el.text):
+                    el.set("class", "img-caption")
+            elif tag == "h2":
+                h2_counter += 1
+                el.attrib.clear()
+                el.set("id", f"{self.chapter_id}-h2-{h2_counter}")
+            elif tag == "h1" and not h1_seen:
+                h1_seen = True
+                el.attrib.clear()
+                el.set("id", self.chapter_id)
+
+    def _fix_image(self, el):
+        """将图片的相对路径转为绝对路径（file:// URI）。"""
+        src = el.get("src", "")
+        if src.startswith(("http://", "https://")):
+            return
+        if src.startswith("file://"):
+            abs_path = image_path_from_src(src)
+        else:
+            abs_path = os.path.abspath(os.path.join(self.base_dir, src))
+            el.set("src", f"file://{abs_path}")
+        if abs_path not in self.images:
+            self.images.append(abs_path)
+
+
+class BookExtension(Extension):
+    """注册 BookTreeprocessor。"""
+
+    def extendMarkdown(self, md):
+        md.treeprocessors.register(BookTreeprocessor(md), "book", 1)
+
+
+_markdown = None
+
+
+def get_markdown():
+    """本进程共用的 Markdown 实例（含 BookExtension），省去逐章加载扩展的开销。
+
+    其 treeprocessors["book"] 为本书的后处理（BookTreeprocessor），bench.py 单独为它计时。
+    """
+    global _markdown
+    if _markdown is None:
+        _markdown = markdown.Markdown(extensions=MD_EXTENSIONS + [BookExtension()])
+    return _markdown
+
+
+def image_path_from_src(src):
+    """将渲染结果中的图片 src 转回本地文件路径，远程图片返回 None。"""
+    if src.startswith("file://"):
+        return unquote(urlparse(src).path)
+    if src.startswith(("http://", "https://")):
+        return None
+    return src
+
+
+def render_chapter(ch, use_cache=True):
+    """读取并渲染单个章节。
+
+    返回 {"question", "html", "images", "outline"}，文件缺失时返回 None。
+    """
+    content = read_chapter(ch["file"])
+    if content is None:
+        return None
+
+    cache_path = _cache_path(ch, content) if use_cache else None
+    if cache_path:
+        result = _load_cached(cache_path)
+        if result is not None:
+            return result
+    return _render_and_store(ch, content, cache_path)
+
+
+def _cache_path(ch, content):
+    return os.path.join(HTML_CACHE_DIR, chapter_cache_key(ch, content) + ".json")
+
+
+def _load_cached(cache_path):
+    try:
+        with open(cache_path, "r", encoding="utf-8") as f:
+            result = json.load(f)
+    except (OSError, ValueError):
+        return None
+    result["outline"] = [tuple(item) for item in result["outline"]]
+    return result
+
+
+def _render_and_store(ch, content, cache_path):
+    """渲染章节并写入缓存（cache_path 为 None 时不写）。也在工作进程中运行。"""
+    result = render_content(ch, content)
+    if cache_path:
+        os.makedirs(HTML_CACHE_DIR, exist_ok=True)
+        tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(result, f, ensure_ascii=False)
+        os.replace(tmp_path, cache_path)
+    return result
+
+
+def chapter_cache_key(ch, content):
+    """章节渲染结果的缓存键。
+
+    除源文件内容外，章节编号、章节 ID（决定锚点）和图片所在目录（决定 file://
+    路径）也会进入渲染结果，一并计入。
+    """
+    h = hashlib.sha256()
+    for part in (
+        str(PIPELINE_VERSION),
+        markdown.__version__,
+        ",".join(MD_EXTENSIONS),
+        ROOT_DIR,
+        ch["file"],
+        ch["chapter_id"],
+        str(ch["chapter_num"]),
+        content,
+    ):
+        h.update(part.encode("utf-8"))
+        h.update(b"\0")
+    return h.hexdigest()
+
+
+def render_content(ch, content):
+    """渲染单个章节（不读写缓存），返回 {"question", "html", "images", "outline"}。
+    content 为章节的 Markdown 源文。"""
+    # 提取引导问题、添加编号
+    scan = scan_chapter(content, ch["file"], ch["chapter_num"])
+
+    md = get_markdown()
+    md.reset()
+    processor = md.treeprocessors["book"]
+    processor.chapter_id = ch["chapter_id"]
+    processor.base_dir = os.path.dirname(os.path.join(ROOT_DIR, ch["file"]))
+    html_content = md.convert(scan["body"])
+
+    return {
+        "question": scan["question"],
+        "html": html_content,
+        "images": processor.images,
+        "outline": scan["outline"],
+    }
+
+
+def render_chapters(chapters, use_cache=True, jobs=1):
+    """渲染章节列表，返回 {章节文件: 渲染结果}，按 chapters 的顺序排列，缺失的章节不在其中。
+
+    先在主进程中读取缓存，只把未命中的章节分发到 jobs 个工作进程；
+    全部命中或只剩一章时不启动进程池。
+    """
+    order = []
+    cached = {}
+    pending = []
+    for ch in chapters:
+        if ch["missing"]:
+            continue
+        content = read_chapter(ch["file"])
+        if content is None:
+            continue
+        cache_path = _cache_path(ch, content) if use_cache else None
+        result = _load_cached(cache_path) if cache_path else None
+        if result is not None:
+            cached[ch["file"]] = result
+        else:
+            pending.append((ch, content, cache_path))
+        order.append(ch["file"])
+
+    # --profile 时逐章计时（在工作进程中计时，回到主进程记录）
+    render = profiling.wrap(_render_and_store)
+    if jobs > 1 and len(pending) > 1:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+            results = list(pool.map(render, *zip(*pending)))
+    else:
+        results = [render(*args) for args in pending]
+    results = profiling.unwrap("markdown", [ch["file"] for ch, _, _ in pending], results)
+    for (ch, _, _), result in zip(pending, results):
+        cached[ch["file"]] = result
+
+    # 按章节顺序重新组装，保证输出与串行渲染一致
+    return {file_path: cached[file_path] for file_path in order}
+
+
+def default_jobs():
+    """--jobs 的默认值：CPU 核数。"""
+    return os.cpu_count() or 1
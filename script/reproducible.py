@@ -0,0 +1,184 @@
+#!/usr/bin/env python3
+"""
+可复现构建与构建清单。
+
+同样的输入应当得到逐字节相同的输出，这样产物才能按内容缓存、重复的上传才能跳过：
+    - 时间戳：EPUB、DOCX 的 zip 条目时间和 EPUB 的 dcterms:modified 都取
+      source_date_epoch()，即环境变量 SOURCE_DATE_EPOCH（reproducible-builds.org
+      的约定），未设置时为固定的 1980-01-01；
+    - EPUB 的标识符由内容哈希生成（见 epub_writer.finish_epub()）；
+    - zip 条目按固定顺序写入（见 zip_writer.py）；
+    - PDF 本来就是确定的：WeasyPrint 只在 HTML 中有 dcterms 日期时才写入日期，
+      分片模式下 pypdf 的文件 ID 由内容计算。
+
+构建清单（{输出目录}/build-manifest.json）记录 build.py 的全部输入（index.md、book/
+下的文件、导出脚本、依赖版本和构建选项）的哈希，以及各产物的哈希。再次构建时输入与
+清单一致、产物也没有被改动，就直接复用上次的产物。输入文件的 mtime 和大小都没变时
+沿用清单中的哈希，不重新读取。
+
+用法：
+    python script/reproducible.py   # 打印构建指纹和各输入的哈希
+"""
+
+import hashlib
+import json
+import os
+import sys
+from importlib import metadata
+
+from book_model import BOOK_DIR, INDEX_FILE, ROOT_DIR
+
+SCRIPT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+MANIFEST_NAME = "build-manifest.json"
+
+# 清单格式或输入范围变化时递增，使旧清单失效
+MANIFEST_VERSION = 1
+
+# 未设置 SOURCE_DATE_EPOCH 时的时间戳：1980-01-01T00:00:00Z，zip 能表示的最早时间
+DEFAULT_SOURCE_DATE = 315532800
+
+# 影响输出的依赖，版本变化时重新构建
+DEPENDENCIES = ("markdown", "ebooklib", "python-docx", "weasyprint", "pypdf", "Pillow")
+
+
+def source_date_epoch():
+    """输出中使用的时间戳（Unix 时间）。"""
+    value = os.environ.get("SOURCE_DATE_EPOCH")
+    if not value:
+        return DEFAULT_SOURCE_DATE
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"SOURCE_DATE_EPOCH 应为整数: {value!r}") from None
+
+
+def input_files():
+    """构建的全部输入：{清单中的名称: 绝对路径}，按名称排序。"""
+    files = {"index.md": INDEX_FILE}
+    for dirpath, dirnames, filenames in os.walk(BOOK_DIR):
+        dirnames[:] = sorted(d for d in dirnames if not d.startswith("."))
+        for name in filenames:
+            if name.startswith("."):
+                continue
+            path = os.path.join(dirpath, name)
+            files[os.path.relpath(path, ROOT_DIR)] = path
+    for name in os.listdir(SCRIPT_DIR):
+        if name.endswith(".py") or name == "requirements.txt":
+            files[f"script/{name}"] = os.path.join(SCRIPT_DIR, name)
+    return dict(sorted(files.items()))
+
+
+def hash_inputs(previous=None):
+    """各输入文件的 {名称: {"sha256", "size", "mtime_ns"}}。
+
+    previous 为上次清单中的同一结构，mtime 和大小都没变的文件沿用其中的哈希。
+    """
+    previous = previous or {}
+    inputs = {}
+    for name, path in input_files().items():
+        st = os.stat(path)
+        old = previous.get(name)
+        if old and old["size"] == st.st_size and old["mtime_ns"] == st.st_mtime_ns:
+            digest = old["sha256"]
+        else:
+            digest = file_hash(path)
+        inputs[name] = {"sha256": digest, "size": st.st_size, "mtime_ns": st.st_mtime_ns}
+    return inputs
+
+
+def file_hash(path):
+    h = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            h.update(block)
+    return h.hexdigest()
+
+
+def dependency_versions():
+    versions = {}
+    for name in DEPENDENCIES:
+        try:
+            versions[name] = metadata.version(name)
+        except metadata.PackageNotFoundError:
+            versions[name] = None
+    return versions
+
+
+def fingerprint(inputs, options):
+    """构建指纹：输入内容、依赖版本、Python 版本和构建选项的哈希。"""
+    state = {
+        "version": MANIFEST_VERSION,
+        "inputs": {name: entry["sha256"] for name, entry in inputs.items()},
+        "dependencies": dependency_versions(),
+        "python": ".".join(map(str, sys.version_info[:2])),
+        "options": options,
+    }
+    return hashlib.sha256(json.dumps(state, sort_keys=True).encode("utf-8")).hexdigest()
+
+
+def load_manifest(path):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return None
+    if manifest.get("version") != MANIFEST_VERSION:
+        return None
+    return manifest
+
+
+def save_manifest(path, build_fingerprint, inputs, options, outputs):
+    """保存清单。outputs 为 {格式: 产物路径}，路径记录为相对清单所在目录的路径。"""
+    base = os.path.dirname(path)
+    manifest = {
+        "version": MANIFEST_VERSION,
+        "fingerprint": build_fingerprint,
+        "options": options,
+        "inputs": inputs,
+        "outputs": {},
+    }
+    for fmt, output in outputs.items():
+        st = os.stat(output)
+        manifest["outputs"][fmt] = {
+            "path": os.path.relpath(output, base),
+            "sha256": file_hash(output),
+            "size": st.st_size,
+            "mtime_ns": st.st_mtime_ns,
+        }
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=1)
+    os.replace(tmp_path, path)
+
+
+def up_to_date(manifest, build_fingerprint, path):
+    """清单的指纹与本次一致，且清单中的产物都还在、没有被改动。path 为清单路径。"""
+    if manifest is None or manifest.get("fingerprint") != build_fingerprint:
+        return False
+    base = os.path.dirname(path)
+    for entry in manifest["outputs"].values():
+        output = os.path.join(base, entry["path"])
+        try:
+            st = os.stat(output)
+        except OSError:
+            return False
+        if st.st_size != entry["size"]:
+            return False
+        if st.st_mtime_ns != entry["mtime_ns"] and file_hash(output) != entry["sha256"]:
+            return False
+    return True
+
+
+def main():
+    inputs = hash_inputs()
+    print(f"输入文件: {len(inputs)}")
+    for name, entry in inputs.items():
+        print(f"  {entry['sha256'][:16]}  {name}")
+    print(f"SOURCE_DATE_EPOCH: {source_date_epoch()}")
+    print(f"依赖: {', '.join(f'{k} {v}' for k, v in dependency_versions().items())}")
+    print(f"指纹（不含构建选项）: {fingerprint(inputs, None)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,433 @@
+#!/usr/bin/env python3
+"""
+本地预览服务器：在浏览器中查看渲染后的章节，保存后自动刷新。
+
+不经过 WeasyPrint 排版，直接把 render.py 的渲染结果套上 PDF 的样式（get_css()，
+外加几条屏幕用的样式）交给浏览器。--watch 时监视 index.md、book/*.md 和 book/img：
+    - 修改某一章只重新渲染这一章；
+    - 修改 index.md 重新解析目录，编号或 ID 变了的章节才重新渲染；
+    - 修改图片不需要重新渲染，只刷新引用它的页面。
+浏览器通过 WebSocket 接收刷新通知，刷新后回到原来的滚动位置。
+
+页面：
+    /                 章节列表
+    /book.html        全书（封面、目录、全部章节）
+    /{章节ID}.html    单章（连同前面的部分标题页、子分类标题页、问题页）
+
+用法：
+    python script/serve.py --watch
+    python script/serve.py --watch --port 8001
+"""
+
+import argparse
+import base64
+import hashlib
+import json
+import mimetypes
+import os
+import struct
+import sys
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import quote, unquote, urlparse
+
+from book_model import BOOK_DIR, INDEX_FILE, ROOT_DIR, load_book
+from export_pdf import build_chapter_body, build_html, wrap_html
+from images import rewrite_image_srcs
+from render import default_jobs, render_chapter, render_chapters
+from watch import watch
+
+DEFAULT_PORT = 8000
+
+IMG_DIR = os.path.join(BOOK_DIR, "img")
+
+# RFC 6455 握手用的固定 GUID
+WS_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC11B65"
+
+# 屏幕预览：版心居中，分页处改为分隔线，目录不显示页码
+SCREEN_CSS = """
+/* 屏幕预览 */
+body {
+    max-width: 46em;
+    margin: 0 auto;
+    padding: 1em 1.5em 4em;
+}
+
+.cover-page, .toc-page, .part-page, .section-page, .question-page, .chapter {
+    border-bottom: 1px dashed #ccc;
+    margin-bottom: 2em;
+    padding-bottom: 2em;
+}
+
+.cover-page, .part-page, .section-page, .question-page {
+    padding-top: 10vh;
+}
+
+.toc a::after,
+.toc-subheading a::after {
+    content: none;
+}
+
+.preview-nav {
+    font-size: 10pt;
+    margin-bottom: 2em;
+    color: #999;
+}
+
+.preview-nav a {
+    margin-right: 1.5em;
+    color: #06c;
+}
+"""
+
+# 收到刷新通知后，若涉及本页则记下滚动位置并刷新；服务器重启后重连时也刷新
+RELOAD_SCRIPT = """<script>
+(function () {
+    var key = "preview-scroll:" + location.pathname;
+    window.addEventListener("load", function () {
+        var saved = sessionStorage.getItem(key);
+        if (saved !== null) {
+            sessionStorage.removeItem(key);
+            window.scrollTo(0, +saved);
+        }
+    });
+    function reload() {
+        sessionStorage.setItem(key, window.scrollY);
+        location.reload();
+    }
+    var lost = false;
+    function connect() {
+        var ws = new WebSocket("ws://" + location.host + "/ws");
+        ws.onopen = function () { if (lost) reload(); };
+        ws.onmessage = function (e) {
+            var msg = JSON.parse(e.data);
+            var page = document.body.dataset.chapter;
+            if (msg.all || !page || msg.chapters.indexOf(page) >= 0) reload();
+        };
+        ws.onclose = function () { lost = true; setTimeout(connect, 500); };
+    }
+    connect();
+})();
+</script>"""
+
+
+class Preview:
+    """预览的书籍状态：目录和各章渲染结果，由监视线程更新、请求线程读取。"""
+
+    def __init__(self, use_cache=True, jobs=1, live_reload=False):
+        self.use_cache = use_cache
+        self.live_reload = live_reload
+        self.lock = threading.Lock()
+        book = load_book(use_cache=use_cache)
+        self.title = book["title"]
+        self.chapters = book["chapters"]
+        self.rendered = render_chapters(self.chapters, use_cache=use_cache, jobs=jobs)
+
+    def update(self, changed):
+        """处理一批文件变化，返回刷新通知（{"all": bool, "chapters": [章节ID]}），无关的变化返回 None。"""
+        index_changed = INDEX_FILE in changed
+        changed_md = {
+            path for path in changed
+            if os.path.dirname(path) == BOOK_DIR and path.endswith(".md")
+        }
+        changed_img = {path for path in changed if os.path.dirname(path) == IMG_DIR}
+        if not (index_changed or changed_md or changed_img):
+            return None
+
+        with self.lock:
+            chapter_ids = []
+            if index_changed or changed_md:
+                book = load_book(use_cache=self.use_cache)
+                previous = {ch["file"]: ch for ch in self.chapters}
+                rendered = {}
+                for ch in book["chapters"]:
+                    old = previous.get(ch["file"])
+                    chapter = self.rendered.get(ch["file"])
+                    if (
+                        chapter is None
+                        or os.path.join(ROOT_DIR, ch["file"]) in changed_md
+                        or old is None
+                        or (old["chapter_id"], old["chapter_num"]) != (ch["chapter_id"], ch["chapter_num"])
+                    ):
+                        chapter = render_chapter(ch, use_cache=self.use_cache)
+                        chapter_ids.append(ch["chapter_id"])
+                    if chapter is not None:
+                        rendered[ch["file"]] = chapter
+                self.title = book["title"]
+                self.chapters = book["chapters"]
+                self.rendered = rendered
+
+            for ch in self.chapters:
+                chapter = self.rendered.get(ch["file"])
+                if chapter and changed_img.intersection(chapter["images"]):
+                    chapter_ids.append(ch["chapter_id"])
+
+        return {"all": index_changed, "chapters": chapter_ids}
+
+    def _finish(self, html, chapter_id=None):
+        """为页面加上章节标记和刷新脚本。"""
+        if chapter_id:
+            html = html.replace("<body>", f'<body data-chapter="{chapter_id}">', 1)
+        if self.live_reload:
+            html = html.replace("</body>", f"{RELOAD_SCRIPT}\n</body>", 1)
+        return html
+
+    def _web_rendered(self, chapters):
+        """渲染结果中的图片 src（file:// 路径）改为本服务器的 /book/ 地址。"""
+        result = {}
+        for ch in chapters:
+            chapter = self.rendered.get(ch["file"])
+            if chapter is None:
+                continue
+            urls = {
+                path: "/book/" + quote(os.path.relpath(path, BOOK_DIR))
+                for path in chapter["images"]
+                if path.startswith(BOOK_DIR + os.sep)
+            }
+            result[ch["file"]] = dict(chapter, html=rewrite_image_srcs(chapter["html"], urls))
+        return result
+
+    def index_page(self):
+        with self.lock:
+            items = []
+            for ch in self.chapters:
+                if ch["file"] not in self.rendered:
+                    continue
+                if ch["new_part"]:
+                    items.append(f'<h2>{ch["part"]}</h2>')
+                if ch["new_section"]:
+                    items.append(f'<h3>{ch["section"]}</h3>')
+                items.append(
+                    f'<p><a href="/{ch["chapter_id"]}.html">{ch["display_title"]}</a></p>'
+                )
+            body = (
+                f'<nav class="preview-nav"><a href="/book.html">全书</a></nav>\n'
+                f'<h1>{self.title}</h1>\n' + "\n".join(items)
+            )
+            return self._finish(wrap_html(self.title, body, SCREEN_CSS))
+
+    def book_page(self):
+        with self.lock:
+            html = build_html(self.title, self.chapters, self._web_rendered(self.chapters), SCREEN_CSS)
+            return self._finish(html)
+
+    def chapter_page(self, chapter_id):
+        """单章页面，章节不存在时返回 None。"""
+        with self.lock:
+            available = [ch for ch in self.chapters if ch["file"] in self.rendered]
+            for i, ch in enumerate(available):
+                if ch["chapter_id"] == chapter_id:
+                    break
+            else:
+                return None
+
+            nav = ['<a href="/">目录</a>']
+            if i > 0:
+                nav.append(f'<a href="/{available[i - 1]["chapter_id"]}.html">上一章</a>')
+            if i + 1 < len(available):
+                nav.append(f'<a href="/{available[i + 1]["chapter_id"]}.html">下一章</a>')
+            chapter = self._web_rendered([ch])[ch["file"]]
+            body = f'<nav class="preview-nav">{"".join(nav)}</nav>\n{build_chapter_body(ch, chapter)}'
+            return self._finish(wrap_html(self.title, body, SCREEN_CSS), chapter_id)
+
+
+class ReloadClients:
+    """已连接的 WebSocket 客户端，向它们广播刷新通知。"""
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sockets = set()
+
+    def add(self, sock):
+        with self.lock:
+            self.sockets.add(sock)
+
+    def remove(self, sock):
+        with self.lock:
+            self.sockets.discard(sock)
+
+    def broadcast(self, message):
+        frame = ws_frame(0x1, json.dumps(message).encode("utf-8"))
+        with self.lock:
+            for sock in list(self.sockets):
+                try:
+                    sock.sendall(frame)
+                except OSError:
+                    self.sockets.discard(sock)
+
+
+def ws_frame(opcode, payload):
+    """服务器发出的 WebSocket 帧（不加掩码）。"""
+    length = len(payload)
+    if length < 126:
+        header = struct.pack(">BB", 0x80 | opcode, length)
+    elif length < 1 << 16:
+        header = struct.pack(">BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack(">BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+
+class PreviewHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        path = unquote(urlparse(self.path).path)
+        preview = self.server.preview
+
+        if path == "/ws":
+            self.handle_websocket()
+        elif path == "/":
+            self.send_html(preview.index_page())
+        elif path == "/book.html":
+            self.send_html(preview.book_page())
+        elif path.startswith("/book/"):
+            self.send_book_file(path[len("/book/"):])
+        elif path.endswith(".html"):
+            html = preview.chapter_page(path[1:-len(".html")])
+            if html is None:
+                self.send_error(404)
+            else:
+                self.send_html(html)
+        else:
+            self.send_error(404)
+
+    def send_html(self, html):
+        self.send_body(html.encode("utf-8"), "text/html; charset=utf-8")
+
+    def send_body(self, data, content_type):
+        self.send_response(200)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_book_file(self, rel_path):
+        """book/ 下的文件（图片），不允许访问 book/ 之外。"""
+        path = os.path.realpath(os.path.join(BOOK_DIR, rel_path))
+        if not path.startswith(os.path.realpath(BOOK_DIR) + os.sep) or not os.path.isfile(path):
+            self.send_error(404)
+            return
+        with open(path, "rb") as f:
+            data = f.read()
+        self.send_body(data, mimetypes.guess_type(path)[0] or "application/octet-stream")
+
+    def handle_websocket(self):
+        """WebSocket 握手后保持连接，直到浏览器关闭页面。只读取控制帧。"""
+        key = self.headers.get("Sec-WebSocket-Key")
+        if self.headers.get("Upgrade", "").lower() != "websocket" or not key:
+            self.send_error(400)
+            return
+        accept = base64.b64encode(hashlib.sha1((key + WS_GUID).encode("ascii")).digest())
+        self.send_response(101)
+        self.send_header("Upgrade", "websocket")
+        self.send_header("Connection", "Upgrade")
+        self.send_header("Sec-WebSocket-Accept", accept.decode("ascii"))
+        self.end_headers()
+        self.wfile.flush()
+        self.close_connection = True
+
+        clients = self.server.clients
+        clients.add(self.request)
+        try:
+            while True:
+                frame = self.read_frame()
+                if frame is None:
+                    break
+                opcode, payload = frame
+                if opcode == 0x8:  # close
+                    self.request.sendall(ws_frame(0x8, payload[:2]))
+                    break
+                if opcode == 0x9:  # ping
+                    self.request.sendall(ws_frame(0xA, payload))
+        except OSError:
+            pass
+        finally:
+            clients.remove(self.request)
+
+    def read_frame(self):
+        """读取一个浏览器发来的帧（带掩码），连接断开时返回 None。"""
+        header = self.rfile.read(2)
+        if len(header) < 2:
+            return None
+        opcode = header[0] & 0x0F
+        length = header[1] & 0x7F
+        if length == 126:
+            length = struct.unpack(">H", self.rfile.read(2))[0]
+        elif length == 127:
+            length = struct.unpack(">Q", self.rfile.read(8))[0]
+        mask = self.rfile.read(4) if header[1] & 0x80 else b"\0\0\0\0"
+        payload = self.rfile.read(length)
+        if len(payload) < length:
+            return None
+        return opcode, bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+
+    def log_request(self, code="-", size="-"):
+        # 只报告出错的请求
+        if isinstance(code, int) and code >= 400:
+            super().log_request(code, size)
+
+
+def watch_book(preview, clients, poll=False):
+    """监视书稿变化，更新预览并通知浏览器。在后台线程中运行。"""
+    for changed in watch([ROOT_DIR, BOOK_DIR, IMG_DIR], poll=poll):
+        start = time.perf_counter()
+        try:
+            message = preview.update(changed)
+        except Exception as e:
+            print(f"  渲染失败: {e}", file=sys.stderr)
+            continue
+        if message is None:
+            continue
+        clients.broadcast(message)
+        names = ", ".join(sorted(os.path.basename(path) for path in changed))
+        print(f"  已更新: {names} ({(time.perf_counter() - start) * 1000:.0f} ms)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="本地预览服务器")
+    parser.add_argument("--host", default="127.0.0.1", help="监听地址 (默认: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help=f"端口 (默认: {DEFAULT_PORT})")
+    parser.add_argument(
+        "--watch",
+        action="store_true",
+        help="监视书稿变化，重新渲染修改过的章节并刷新浏览器",
+    )
+    parser.add_argument("--poll", action="store_true", help="不用 inotify，定时轮询文件变化")
+    parser.add_argument(
+        "-j", "--jobs",
+        type=int,
+        default=default_jobs(),
+        help="启动时并行转换章节的进程数 (默认: CPU 核数)",
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="忽略并不写入 output/.cache 中的解析和渲染缓存",
+    )
+    args = parser.parse_args()
+
+    print("转换章节内容...")
+    preview = Preview(use_cache=not args.no_cache, jobs=args.jobs, live_reload=args.watch)
+
+    server = ThreadingHTTPServer((args.host, args.port), PreviewHandler)
+    server.daemon_threads = True
+    server.preview = preview
+    server.clients = ReloadClients()
+
+    if args.watch:
+        threading.Thread(
+            target=watch_book, args=(preview, server.clients, args.poll), daemon=True,
+        ).start()
+
+    print(f"预览: http://{args.host}:{args.port}/（Ctrl-C 退出）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,274 @@
+#!/usr/bin/env python3
+"""
+生成合成书稿，用于测试导出脚本在更大书稿上的表现。
+
+生成的 index.md 和 book/*.md 与本书格式相同：部分、子分类、前言/后记/致谢，
+章节开头的引导问题（"---" 之前）、引言 blockquote、h2/h3 标题、带 "图 x-y" 说明的
+图片、嵌套列表、表格、代码块、中英文混排和中文引号。图片为 RGBA PNG，尺寸与
+book/img 中的原图相当。内容由随机数种子决定，同样的参数总是生成同样的书稿。
+
+默认规模与本书相当（约 40 章、0.6 MB Markdown、30 张图），--scale 按比例放大。
+生成后用环境变量 BOOK_ROOT 让各脚本处理这份书稿：
+
+    python script/synth_book.py -o /tmp/synth --scale 10
+    BOOK_ROOT=/tmp/synth python script/build.py
+    BOOK_ROOT=/tmp/synth python script/fix_quotes.py --check
+    BOOK_ROOT=/tmp/synth python script/bench.py --formats epub,docx
+
+用法：
+    python script/synth_book.py -o DIR [--scale N] [--images-per-chapter N] [--seed N]
+"""
+
+import argparse
+import os
+import random
+import sys
+
+from PIL import Image, ImageDraw
+
+from book_model import ROOT_DIR
+
+# --scale 1 时的规模，与本书相当
+BASE_CHAPTERS = 40
+BASE_CHAPTER_CHARS = 5500
+BASE_IMAGES_PER_CHAPTER = 0.75
+CHAPTERS_PER_PART = 6
+
+IMAGE_SIZE = (1600, 1000)
+
+PART_NUMERALS = "一二三四五六七八九十"
+
+WORDS = [
+    "产品", "用户", "增长", "留存", "团队", "市场", "需求", "渠道", "社区", "内容",
+    "收入", "成本", "定价", "体验", "数据", "指标", "反馈", "迭代", "节奏", "边界",
+    "信任", "口碑", "效率", "风险", "现金流", "组织", "文化", "判断", "选择", "机会",
+]
+SUBJECTS = ["我们", "很多创业者", "小团队", "早期用户", "这个产品", "一位星主", "投资人", "老板", "同事们"]
+VERBS = ["发现", "低估了", "重新思考", "反复验证", "坚持", "放弃了", "忽略了", "花时间打磨", "认真对待"]
+CLAUSES = [
+    "这件事比想象中难", "结果往往不是线性的", "真正的问题藏在细节里", "慢一点反而更快",
+    "数据会说话，但不会替你做决定", "夹缝里也能长出东西", "小而美不等于小而弱",
+]
+LATIN = ["AI", "SaaS", "MVP", "PMF", "API", "iOS", "GitHub", "Notion", "DAU", "ARR"]
+AUTHORS = ["保罗·格雷厄姆（Paul Graham）", "彼得·德鲁克（Peter Drucker）", "商业格言", "佚名", "纳瓦尔（Naval）"]
+CODE_LINES = ["def retention(users, day):", "    active = [u for u in users if u.active(day)]",
+              "    return len(active) / len(users)", "", "print(retention(users, 7))"]
+
+
+def sentence(rng):
+    """一句中文，偶尔夹带英文、数字和引号。"""
+    kind = rng.random()
+    if kind < 0.35:
+        text = f"{rng.choice(SUBJECTS)}{rng.choice(VERBS)}{rng.choice(WORDS)}和{rng.choice(WORDS)}"
+    elif kind < 0.55:
+        text = f"{rng.choice(WORDS)}的关键在于{rng.choice(WORDS)}，而不是{rng.choice(WORDS)}"
+    elif kind < 0.7:
+        text = f"{rng.choice(SUBJECTS)}用 {rng.choice(LATIN)} 做了 {rng.randint(2, 99)}% 的{rng.choice(WORDS)}"
+    elif kind < 0.85:
+        text = f"有人说：“{rng.choice(CLAUSES)}。”{rng.choice(SUBJECTS)}深以为然"
+    else:
+        text = rng.choice(CLAUSES)
+    return text + rng.choice("。。。，；")
+
+
+def paragraph(rng, min_sentences=3, max_sentences=8):
+    text = "".join(sentence(rng) for _ in range(rng.randint(min_sentences, max_sentences)))
+    text = text.rstrip("，；") + ("" if text.endswith("。") else "。")
+    if rng.random() < 0.15:
+        word = rng.choice(WORDS)
+        text = text.replace(word, f"**{word}**", 1)
+    return text
+
+
+def title(rng, words=2):
+    return "".join(rng.sample(WORDS, words))
+
+
+def epigraph(rng):
+    return f"> {rng.choice(CLAUSES)}。\n>\n> —— {rng.choice(AUTHORS)}"
+
+
+def bullet_list(rng):
+    lines = []
+    for _ in range(rng.randint(2, 5)):
+        lines.append(f"- {sentence(rng)}")
+        if rng.random() < 0.3:
+            for _ in range(rng.randint(1, 3)):
+                lines.append(f"    - {sentence(rng)}")
+    return "\n".join(lines)
+
+
+def ordered_list(rng):
+    return "\n".join(f"{i}. {sentence(rng)}" for i in range(1, rng.randint(3, 6)))
+
+
+def table(rng):
+    columns = rng.randint(2, 4)
+    header = [title(rng, 1) for _ in range(columns)]
+    lines = ["| " + " | ".join(header) + " |", "|" + "---|" * columns]
+    for _ in range(rng.randint(2, 6)):
+        cells = [rng.choice([rng.choice(WORDS), str(rng.randint(1, 1000)), rng.choice(LATIN)]) for _ in header]
+        lines.append("| " + " | ".join(cells) + " |")
+    return "\n".join(lines)
+
+
+def code_block(rng):
+    return "```python\n" + "\n".join(CODE_LINES[:rng.randint(2, len(CODE_LINES))]) + "\n```"
+
+
+def chapter_text(rng, chapter_title, target_chars, figures, question=True):
+    """一章的 Markdown。figures 为 [(图片相对路径, 图号)]。"""
+    blocks = []
+    if question:
+        blocks += [f"{rng.choice(SUBJECTS)}为什么总是{rng.choice(VERBS)}{rng.choice(WORDS)}？", "---"]
+    blocks.append(f"# {chapter_title}")
+    for _ in range(rng.randint(1, 2)):
+        blocks.append(epigraph(rng))
+
+    figures = list(figures)
+    size = sum(len(block) for block in blocks)
+    while size < target_chars:
+        blocks.append(f"## {title(rng)}")
+        for _ in range(rng.randint(3, 8)):
+            r = rng.random()
+            if r < 0.08:
+                blocks.append(f"### {title(rng)}")
+            elif r < 0.16:
+                blocks.append(bullet_list(rng))
+            elif r < 0.2:
+                blocks.append(ordered_list(rng))
+            elif r < 0.23:
+                blocks.append(table(rng))
+            elif r < 0.25:
+                blocks.append(code_block(rng))
+            elif r < 0.3:
+                blocks.append(f"> {paragraph(rng, 1, 3)}")
+            else:
+                blocks.append(paragraph(rng))
+            if figures and rng.random() < 0.2:
+                path, number = figures.pop(0)
+                blocks += [f"![]({path})", f"图 {number} {title(rng, 3)}"]
+        size = sum(len(block) for block in blocks)
+
+    # 没来得及插入的图片放在章末
+    for path, number in figures:
+        blocks += [f"![]({path})", f"图 {number} {title(rng, 3)}"]
+    return "\n\n".join(blocks) + "\n"
+
+
+def make_image(rng, path, size=IMAGE_SIZE):
+    """示意图风格的 RGBA PNG：渐变底色、色块、线条和噪点（让文件大小接近真实图片）。"""
+    width, height = size
+    base = Image.linear_gradient("L").resize(size)
+    # 噪点取自 rng（保证可复现），按 1/4 尺寸生成再放大，PNG 大小与 book/img 中的原图接近
+    small = (width // 4, height // 4)
+    noise = Image.frombytes("L", small, rng.randbytes(small[0] * small[1])).resize(size)
+    img = Image.merge("RGBA", (base, noise, Image.new("L", size, rng.randint(150, 255)), Image.new("L", size, 255)))
+    draw = ImageDraw.Draw(img)
+    for _ in range(rng.randint(4, 10)):
+        x, y = rng.randrange(width - 200), rng.randrange(height - 120)
+        color = tuple(rng.randrange(256) for _ in range(3)) + (255,)
+        draw.rectangle([x, y, x + rng.randint(80, 400), y + rng.randint(40, 200)], fill=color)
+    for _ in range(rng.randint(3, 8)):
+        draw.line(
+            [rng.randrange(width), rng.randrange(height), rng.randrange(width), rng.randrange(height)],
+            fill=(40, 40, 40, 255), width=4,
+        )
+    img.save(path, format="PNG")
+
+
+def generate(output_dir, scale=1.0, chapter_chars=BASE_CHAPTER_CHARS,
+             images_per_chapter=BASE_IMAGES_PER_CHAPTER, seed=0):
+    """生成书稿，返回 (章节数, 图片数, Markdown 字节数)。"""
+    rng = random.Random(seed)
+    book_dir = os.path.join(output_dir, "book")
+    img_dir = os.path.join(book_dir, "img")
+    os.makedirs(img_dir, exist_ok=True)
+
+    num_chapters = max(1, round(BASE_CHAPTERS * scale))
+    num_parts = max(1, -(-num_chapters // CHAPTERS_PER_PART))
+    index = [f"# 合成书稿 ×{scale:g}", "", "- [致谢](book/acknowledgments.md)", "- 前言：[重新开始](book/restart.md)", ""]
+    files = [
+        ("acknowledgments.md", "致谢", None, False),
+        ("restart.md", "重新开始", None, False),
+    ]
+
+    chapter_num = 0
+    for part in range(num_parts):
+        numeral = PART_NUMERALS[part] if part < len(PART_NUMERALS) else str(part + 1)
+        index += [f"- 第{numeral}部分：{title(rng)}", ""]
+        in_part = min(CHAPTERS_PER_PART, num_chapters - chapter_num)
+        # 每隔一个部分分为两个子分类
+        split = in_part // 2 if part % 2 and in_part > 1 else None
+        for i in range(in_part):
+            if split is not None and i in (0, split):
+                index.append(f"  - {title(rng)}")
+            chapter_num += 1
+            name = f"ch{chapter_num:04d}.md"
+            chapter_title = title(rng, rng.randint(2, 3))
+            index.append(f"  - [{chapter_title}](book/{name})")
+            files.append((name, chapter_title, chapter_num, True))
+        index.append("")
+    index.append("- 后记：[夹缝中的小而美](book/crack.md)")
+    files.append(("crack.md", "夹缝中的小而美", None, False))
+
+    with open(os.path.join(output_dir, "index.md"), "w", encoding="utf-8") as f:
+        f.write("\n".join(index) + "\n")
+
+    # 图片按 images_per_chapter 分摊到各章（小数部分按概率）
+    num_images = 0
+    md_bytes = 0
+    for name, chapter_title, number, question in files:
+        count = int(images_per_chapter) + (rng.random() < images_per_chapter % 1) if number else 0
+        figures = []
+        for i in range(1, count + 1):
+            img_name = f"{os.path.splitext(name)[0]}-{i:02d}.png"
+            make_image(rng, os.path.join(img_dir, img_name))
+            figures.append((f"img/{img_name}", f"{number}-{i}"))
+        num_images += count
+
+        target = chapter_chars if number else chapter_chars // 4
+        text = chapter_text(rng, chapter_title, target, figures, question=question)
+        data = text.encode("utf-8")
+        md_bytes += len(data)
+        with open(os.path.join(book_dir, name), "wb") as f:
+            f.write(data)
+
+    return len(files), num_images, md_bytes
+
+
+def main():
+    parser = argparse.ArgumentParser(description="生成合成书稿，用于规模测试")
+    parser.add_argument("-o", "--output-dir", required=True, help="书稿目录（将写入 index.md 和 book/）")
+    parser.add_argument("--scale", type=float, default=1.0, help="章节数相对本书的倍数 (默认: 1)")
+    parser.add_argument(
+        "--chapter-chars",
+        type=int,
+        default=BASE_CHAPTER_CHARS,
+        help=f"每章正文的大致字数 (默认: {BASE_CHAPTER_CHARS})",
+    )
+    parser.add_argument(
+        "--images-per-chapter",
+        type=float,
+        default=BASE_IMAGES_PER_CHAPTER,
+        help=f"每章平均图片数，可为小数 (默认: {BASE_IMAGES_PER_CHAPTER})",
+    )
+    parser.add_argument("--seed", type=int, default=0, help="随机数种子 (默认: 0)")
+    args = parser.parse_args()
+
+    output_dir = os.path.abspath(args.output_dir)
+    if output_dir == ROOT_DIR:
+        print("错误：不能覆盖当前书稿，请指定其他目录", file=sys.stderr)
+        sys.exit(1)
+
+    print(f"生成书稿: {output_dir}")
+    chapters, images, md_bytes = generate(
+        output_dir, scale=args.scale, chapter_chars=args.chapter_chars,
+        images_per_chapter=args.images_per_chapter, seed=args.seed,
+    )
+    print(f"  章节: {chapters}，图片: {images}，Markdown: {md_bytes / 1e6:.2f} MB")
+    print(f"使用: BOOK_ROOT={output_dir} python script/build.py")
+
+
+if __name__ == "__main__":
+    main()
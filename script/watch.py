@@ -0,0 +1,169 @@
+#!/usr/bin/env python3
+"""
+文件变化监视：Linux 上用 inotify（通过 ctypes 调用 libc，不需要额外依赖），
+其他系统或 inotify 不可用时退回到定时轮询 mtime。
+
+编辑器保存文件的方式各不相同（直接写入、写临时文件再改名），这里监视目录而不是
+文件，把写入完成、移入、创建、删除都算作变化；同一次保存产生的多个事件合并为一批。
+
+用法：
+    from watch import watch
+    for changed in watch([BOOK_DIR, IMG_DIR]):
+        ...  # changed 为发生变化的文件绝对路径集合
+
+    python script/watch.py   # 打印 book/ 和 index.md 的变化
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import sys
+import time
+
+from book_model import BOOK_DIR, ROOT_DIR
+
+# inotify 事件（见 <sys/inotify.h>）
+IN_CLOSE_WRITE = 0x008
+IN_MOVED_FROM = 0x040
+IN_MOVED_TO = 0x080
+IN_CREATE = 0x100
+IN_DELETE = 0x200
+IN_Q_OVERFLOW = 0x4000
+
+WATCH_MASK = IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE
+
+EVENT_HEADER = struct.Struct("iIII")  # wd, mask, cookie, len
+
+# 收到第一个事件后再等这么久，把同一次保存的事件合并（秒）
+DEBOUNCE = 0.05
+
+# 轮询间隔（秒）
+POLL_INTERVAL = 0.3
+
+
+def watch(dirs, poll=False, interval=POLL_INTERVAL):
+    """监视 dirs 中文件的变化，每批变化产生一个文件绝对路径的集合。只监视目录本身，不递归。"""
+    if not poll:
+        inotify = _inotify_init(dirs)
+        if inotify is not None:
+            yield from _watch_inotify(*inotify, dirs)
+            return
+        print("  inotify 不可用，改为轮询", file=sys.stderr)
+    yield from _watch_polling(dirs, interval)
+
+
+def _inotify_init(dirs):
+    """创建 inotify 实例并监视 dirs，返回 (fd, {wd: 目录})，失败时返回 None。"""
+    if not sys.platform.startswith("linux"):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library("c"), use_errno=True)
+        fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+    except (OSError, AttributeError):
+        return None
+    if fd < 0:
+        return None
+
+    wds = {}
+    for path in dirs:
+        wd = libc.inotify_add_watch(fd, os.fsencode(path), WATCH_MASK)
+        if wd < 0:
+            os.close(fd)
+            return None
+        wds[wd] = path
+    return fd, wds
+
+
+def _watch_inotify(fd, wds, dirs):
+    try:
+        while True:
+            select.select([fd], [], [])
+            changed = set()
+            deadline = time.monotonic() + DEBOUNCE
+            while True:
+                overflow = _read_events(fd, wds, changed)
+                if overflow:
+                    # 事件队列溢出，不知道丢了哪些，按全部变化处理
+                    changed.update(_scan(dirs).keys())
+                timeout = deadline - time.monotonic()
+                if timeout <= 0 or not select.select([fd], [], [], timeout)[0]:
+                    break
+            if changed:
+                yield changed
+    finally:
+        os.close(fd)
+
+
+def _read_events(fd, wds, changed):
+    """读出当前所有事件，变化的文件加入 changed。返回是否发生了队列溢出。"""
+    overflow = False
+    while True:
+        try:
+            data = os.read(fd, 64 * 1024)
+        except BlockingIOError:
+            return overflow
+        offset = 0
+        while offset < len(data):
+            wd, mask, _, length = EVENT_HEADER.unpack_from(data, offset)
+            offset += EVENT_HEADER.size
+            name = data[offset:offset + length].rstrip(b"\0")
+            offset += length
+            if mask & IN_Q_OVERFLOW:
+                overflow = True
+            elif wd in wds and name:
+                changed.add(os.path.join(wds[wd], os.fsdecode(name)))
+
+
+def _scan(dirs):
+    """dirs 中的文件：{文件路径: (mtime_ns, 大小)}"""
+    stamps = {}
+    for path in dirs:
+        try:
+            entries = list(os.scandir(path))
+        except OSError:
+            continue
+        for entry in entries:
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            stamps[entry.path] = (st.st_mtime_ns, st.st_size)
+    return stamps
+
+
+def _watch_polling(dirs, interval):
+    previous = _scan(dirs)
+    while True:
+        time.sleep(interval)
+        current = _scan(dirs)
+        changed = {
+            path for path in previous.keys() | current.keys()
+            if previous.get(path) != current.get(path)
+        }
+        previous = current
+        if changed:
+            yield changed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="打印 book/ 和 index.md 的变化")
+    parser.add_argument("--poll", action="store_true", help="不用 inotify，定时轮询")
+    args = parser.parse_args()
+
+    dirs = [ROOT_DIR, BOOK_DIR, os.path.join(BOOK_DIR, "img")]
+    print(f"监视: {', '.join(dirs)}（Ctrl-C 退出）")
+    try:
+        for changed in watch(dirs, poll=args.poll):
+            for path in sorted(changed):
+                print(f"  {os.path.relpath(path, ROOT_DIR)}")
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+流式 zip 写入：条目按提交顺序写入文件，压缩在线程中并行进行。EPUB（见 epub_writer.py）
+和 DOCX 都是 zip 包，共用这里的写入逻辑。
+
+    - 每个条目交给线程池压缩（zlib 压缩时释放 GIL），按提交顺序写入文件，
+      排队中的条目数有上限，内存不随全书大小增长；
+    - 已压缩过的图片直接存储，其余条目压缩后不变小的也改为直接存储；
+    - 所有条目使用同一个固定的时间戳（默认为 reproducible.source_date_epoch()），
+      条目顺序即提交顺序：同样的输入得到逐字节相同的文件。
+
+用法：
+    with ZipStreamWriter(output, jobs=4) as out:
+        out.write("word/document.xml", xml)
+        ...
+"""
+
+import hashlib
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from reproducible import source_date_epoch
+
+# zip 本地文件头、中央目录条目和中央目录结尾（见 APPNOTE.TXT 4.3）
+LOCAL_HEADER = struct.Struct("<4s5H3L2H")
+CENTRAL_HEADER = struct.Struct("<4s6H3L5H2L")
+END_OF_CENTRAL_DIR = struct.Struct("<4s4H2LH")
+
+ZIP_VERSION = 20          # 2.0：deflate
+FLAG_UTF8 = 0x800         # 文件名为 UTF-8
+METHOD_STORED = 0
+METHOD_DEFLATED = 8
+
+# 与 ebooklib、python-docx（zipfile 默认）相同的压缩级别
+COMPRESS_LEVEL = 6
+
+# 不用 zip64：单个文件和整个 zip 都不能超过 4 GB
+ZIP_LIMIT = 0xFFFFFFFF
+
+# 本身已经压缩过的图片格式，写入时不再 deflate
+COMPRESSED_EXTS = (".png", ".jpg", ".jpeg", ".gif", ".webp")
+
+
+def _dos_time(timestamp):
+    """zip 中的 (时间, 日期)，精度 2 秒。按 UTC 换算，结果与所在时区无关。"""
+    t = time.gmtime(max(timestamp, 315532800))  # zip 能表示的最早时间：1980-01-01
+    return (
+        (t.tm_hour << 11) | (t.tm_min << 5) | (t.tm_sec // 2),
+        ((t.tm_year - 1980) << 9) | (t.tm_mon << 5) | t.tm_mday,
+    )
+
+
+def _compress(data, compress):
+    """返回 (方法, crc32, 压缩后的数据, 内容哈希)。在线程池中运行。"""
+    crc = zlib.crc32(data)
+    digest = hashlib.sha256(data).digest()
+    if compress:
+        compressor = zlib.compressobj(COMPRESS_LEVEL, zlib.DEFLATED, -15)
+        packed = compressor.compress(data) + compressor.flush()
+        if len(packed) < len(data):
+            return METHOD_DEFLATED, crc, packed, digest
+    return METHOD_STORED, crc, data, digest
+
+
+class ZipStreamWriter:
+    """按提交顺序流式写出 zip 条目，压缩在 jobs 个线程中并行。
+
+    先写入临时文件，close() 成功后才替换为 path；出错时删除临时文件。
+    max_pending 为排队中（已提交、尚未写入文件）的条目数上限，默认 jobs 的 4 倍。
+    timestamp 为所有条目的修改时间（Unix 时间），默认为 source_date_epoch()。
+    """
+
+    def __init__(self, path, jobs=1, max_pending=None, timestamp=None):
+        self.path = path
+        self.tmp_path = f"{path}.{os.getpid()}.tmp"
+        self.max_pending = max_pending or 4 * max(1, jobs)
+        self._file = open(self.tmp_path, "wb")
+        self._pool = ThreadPoolExecutor(max_workers=max(1, jobs))
+        self._pending = deque()  # [(文件名, 原始大小, future)]
+        self._entries = []       # 中央目录：[(文件名, 标志, 方法, crc, 压缩后大小, 原始大小, 偏移)]
+        self._names = set()
+        self._digest = hashlib.sha256()
+        self._date_time = _dos_time(source_date_epoch() if timestamp is None else timestamp)
+        self._closed = False
+
+    def write(self, name, data, compress=True):
+        """提交一个条目。data 为 str 时按 UTF-8 编码。同名条目只写入第一次。"""
+        if name in self._names:
+            return
+        self._names.add(name)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if len(data) > ZIP_LIMIT:
+            raise ValueError(f"条目过大（超过 4 GB）: {name}")
+        future = self._pool.submit(_compress, data, compress)
+        self._pending.append((name, len(data), future))
+        # 写出已压缩完的条目；排队过长时等待最早的条目，限制内存占用
+        while self._pending and (
+            self._pending[0][2].done() or len(self._pending) > self.max_pending
+        ):
+            self._write_entry(*self._pending.popleft())
+
+    def __contains__(self, name):
+        return name in self._names
+
+    def content_digest(self):
+        """目前为止所有条目（文件名和内容，按顺序）的 SHA-256，十六进制。
+        会先写完排队中的条目。"""
+        self._flush()
+        return self._digest.hexdigest()
+
+    def _flush(self):
+        while self._pending:
+            self._write_entry(*self._pending.popleft())
+
+    def _write_entry(self, name, size, future):
+        method, crc, data, digest = future.result()
+        encoded = name.encode("utf-8")
+        self._digest.update(encoded + b"\0" + digest)
+        flags = 0 if encoded.isascii() else FLAG_UTF8
+        offset = self._file.tell()
+        if offset + len(data) > ZIP_LIMIT:
+            raise ValueError("zip 文件过大（超过 4 GB）")
+        self._file.write(LOCAL_HEADER.pack(
+            b"PK\x03\x04", ZIP_VERSION, flags, method, *self._date_time,
+            crc, len(data), size, len(encoded), 0,
+        ))
+        self._file.write(encoded)
+        self._file.write(data)
+        self._entries.append((encoded, flags, method, crc, len(data), size, offset))
+
+    def close(self):
+        """写完排队中的条目和中央目录，替换为目标文件。重复调用时什么也不做。"""
+        if self._closed:
+            return
+        try:
+            self._flush()
+            start = self._file.tell()
+            for encoded, flags, method, crc, packed_size, size, offset in self._entries:
+                self._file.write(CENTRAL_HEADER.pack(
+                    b"PK\x01\x02", ZIP_VERSION, ZIP_VERSION, flags, method, *self._date_time,
+                    crc, packed_size, size, len(encoded), 0, 0, 0, 0, 0o644 << 16, offset,
+                ))
+                self._file.write(encoded)
+            end = self._file.tell()
+            self._file.write(END_OF_CENTRAL_DIR.pack(
+                b"PK\x05\x06", 0, 0, len(self._entries), len(self._entries),
+                end - start, start, 0,
+            ))
+        except BaseException:
+            self.abort()
+            raise
+        self._pool.shutdown()
+        self._file.close()
+        self._closed = True
+        os.replace(self.tmp_path, self.path)
+
+    def abort(self):
+        """放弃写入，删除临时文件。"""
+        if self._closed:
+            return
+        self._closed = True
+        for _, _, future in self._pending:
+            future.cancel()
+        self._pending.clear()
+        self._pool.shutdown()
+        self._file.close()
+        if os.path.exists(self.tmp_path):
+            os.remove(self.tmp_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()